@@ -0,0 +1,53 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from tests.mock_server import MockServer  # noqa
+
+PAGE_SIZE = 30
+SCENES_PER_PROJECT = 1000
+EXPORT_FILE_SIZE = 64 * 1024 * 1024
+
+
+@pytest.fixture(scope='session')
+def mock_server():
+    server = MockServer(
+        sizes={
+            '/projects/': 10 * PAGE_SIZE,
+            '/projects/{uuid}/scenes/': SCENES_PER_PROJECT
+        },
+        export_file_size=EXPORT_FILE_SIZE
+    )
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session')
+def api(mock_server):
+    return mock_server.api()
+
+
+@pytest.fixture(scope='session')
+def project(api):
+    return api.projects[0]
+
+
+@pytest.fixture
+def annotations_uri(tmpdir):
+    features = [{
+        'type': 'Feature',
+        'geometry': {
+            'type': 'Polygon',
+            'coordinates': [[[i, 0], [i + 1, 0], [i + 1, 1], [i, 1], [i, 0]]]
+        },
+        'properties': {'class_name': 'car', 'class_id': 1, 'score': 0.9}
+    } for i in range(5000)]
+    path = os.path.join(str(tmpdir), 'predictions.json')
+    with open(path, 'w') as annotations_file:
+        json.dump({'type': 'FeatureCollection', 'features': features},
+                  annotations_file)
+    return path
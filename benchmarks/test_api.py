@@ -0,0 +1,9 @@
+from rasterfoundry.api import API
+
+
+def test_api_construction(benchmark, mock_server):
+    api = benchmark(
+        API, api_token='mock-api-token', host=mock_server.host, scheme='http',
+        tile_host=mock_server.host, spec_path=mock_server.spec_url)
+
+    assert api.api_token == 'mock-api-token'
@@ -0,0 +1,49 @@
+import pytest
+
+from rasterfoundry.compression import DEFAULT_MIN_SIZE
+from rasterfoundry.instrumentation import Instrumentation
+from tests.mock_server import MockServer
+
+
+@pytest.fixture(scope='module')
+def gzip_server():
+    server = MockServer(sizes={'/projects/{uuid}/scenes/': 1000}, gzip=True)
+    server.start()
+    yield server
+    server.stop()
+
+
+def wire_bytes(instrumentation):
+    totals = {'sent': 0, 'received': 0}
+    for metrics in instrumentation.snapshot().values():
+        totals['sent'] += metrics['bytes_sent']
+        totals['received'] += metrics['bytes_received']
+    return totals
+
+
+@pytest.mark.parametrize('compress_min_size', [None, DEFAULT_MIN_SIZE])
+def test_post_annotations_compression(benchmark, gzip_server,
+                                      annotations_uri, compress_min_size):
+    instrumentation = Instrumentation()
+    api = gzip_server.api(instrumentation=instrumentation,
+                          compress_min_size=compress_min_size)
+    project = api.projects[0]
+    instrumentation.reset()
+
+    benchmark(project.post_annotations, annotations_uri)
+
+    benchmark.extra_info.update(wire_bytes(instrumentation))
+
+
+@pytest.mark.parametrize('accept_encoding', ['identity', 'gzip, deflate'])
+def test_list_scenes_compression(benchmark, gzip_server, accept_encoding):
+    instrumentation = Instrumentation()
+    api = gzip_server.api(instrumentation=instrumentation)
+    api.http.session.headers['Accept-Encoding'] = accept_encoding
+    project = api.projects[0]
+    instrumentation.reset()
+
+    scenes = benchmark(project.get_scenes)
+
+    assert len(scenes) == 1000
+    benchmark.extra_info.update(wire_bytes(instrumentation))
@@ -0,0 +1,17 @@
+import pytest
+
+from rasterfoundry.models import Export
+
+from .conftest import EXPORT_FILE_SIZE
+
+
+@pytest.fixture(scope='module')
+def export(api, project):
+    export = Export.create_export(api, '0,0,1,1', 10, project=project)
+    return Export.poll_export_status(api, export.id, delay=0)
+
+
+def test_download_file_bytes(benchmark, export):
+    content = benchmark.pedantic(export.download_file_bytes, rounds=5)
+
+    assert len(content) == EXPORT_FILE_SIZE
@@ -0,0 +1,28 @@
+from collections import namedtuple
+
+from rasterfoundry.utils import get_all_paginated
+
+Page = namedtuple('Page', ['page', 'hasNext', 'results'])
+
+
+def test_get_all_paginated_in_memory(benchmark):
+    pages = [Page(page, page < 999, list(range(30))) for page in range(1000)]
+
+    results = benchmark(get_all_paginated, lambda page: pages[page])
+
+    assert len(results) == 30000
+
+
+def test_get_all_paginated_http(benchmark, api, mock_server):
+    def get_page(page):
+        return api.client.Imagery.get_projects(page=page).result()
+
+    results = benchmark(get_all_paginated, get_page)
+
+    assert len(results) == mock_server.size('/projects/')
+
+
+def test_list_projects(benchmark, api, mock_server):
+    projects = benchmark(lambda: api.projects)
+
+    assert len(projects) == mock_server.size('/projects/')
@@ -0,0 +1,22 @@
+from .conftest import SCENES_PER_PROJECT
+
+
+def test_get_image_source_uris(benchmark, project):
+    """Time fetching every scene page, bypassing the image sources cache"""
+    def workload():
+        return [source.source_uri
+                for source in project.get_image_sources(refresh=True)]
+
+    assert len(benchmark(workload)) == SCENES_PER_PROJECT
+
+
+def test_get_cached_image_source_uris(benchmark, project):
+    """Time revalidating cached image sources against the scene order"""
+    project.get_image_sources(refresh=True)
+    source_uris = benchmark(project.get_image_source_uris)
+
+    assert len(source_uris) == SCENES_PER_PROJECT
+
+
+def test_post_annotations(benchmark, project, annotations_uri):
+    benchmark(project.post_annotations, annotations_uri)
@@ -0,0 +1,27 @@
+import pytest
+
+from rasterfoundry.api import API
+from rasterfoundry.recording import Cassette, RecordingAdapter, ReplayAdapter
+
+from .conftest import SCENES_PER_PROJECT
+
+
+@pytest.fixture(scope='module')
+def cassette(mock_server):
+    cassette = Cassette()
+    api = mock_server.api(http_adapter=RecordingAdapter(cassette))
+    api.projects[0].get_image_source_uris()
+    return cassette
+
+
+def test_replayed_get_image_source_uris(benchmark, mock_server, cassette):
+    """Time unmarshalling and model wrapping without network noise"""
+    api = API(api_token='replay', host=mock_server.host, scheme='http',
+              tile_host=mock_server.host, spec_path=mock_server.spec_url,
+              http_adapter=ReplayAdapter(cassette))
+
+    def workload():
+        return [source.source_uri
+                for source in api.projects[0].get_image_sources(refresh=True)]
+
+    assert len(benchmark(workload)) == SCENES_PER_PROJECT
@@ -0,0 +1,41 @@
+import os
+
+import boto3
+import pytest
+
+from rasterfoundry.models import Upload
+
+moto = pytest.importorskip('moto')
+
+BUCKET = 'rf-benchmark-bucket'
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    mock = moto.mock_aws() if hasattr(moto, 'mock_aws') else moto.mock_s3()
+    with mock:
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(Upload, 's3_client', client)
+        yield client
+
+
+@pytest.fixture
+def tifs(tmpdir):
+    paths = []
+    for i in range(200):
+        path = os.path.join(str(tmpdir), '{}.tif'.format(i))
+        with open(path, 'w') as tif:
+            tif.write('a tif' * 1000)
+        paths.append(path)
+    return paths
+
+
+def test_upload_create_from_files(benchmark, s3_client, tifs):
+    upload_create = benchmark(
+        Upload.upload_create_from_files, 'fooDat', 'fooOrg', tifs, BUCKET,
+        'benchmark')
+
+    assert len(upload_create['files']) == len(tifs)
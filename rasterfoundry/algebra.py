@@ -0,0 +1,275 @@
+"""Evaluate Analysis map algebra locally with numpy
+
+An analysis's executionParameters are a tree of operation nodes, e.g.
+
+    {'apply': '/', 'args': [
+        {'apply': '-', 'args': [nir, red]},
+        {'apply': '+', 'args': [nir, red]}]}
+
+whose leaves are projectSrc nodes, referring to a band of a project, and
+const nodes. A MapAlgebraEvaluator computes such a tree over arrays of the
+project bands, e.g. from Analysis.download_inputs, one window of rows at a
+time so that rasters larger than memory can be read from memory maps.
+Subtrees that appear more than once are computed once per window, and
+results are kept between evaluations within a memory budget, so sweeping
+one parameter only recomputes the nodes that depend on it.
+
+Missing data is NaN throughout.
+"""
+import hashlib
+import json
+from collections import OrderedDict
+
+import numpy as np
+from shapely.prepared import prep
+
+from .geometry import to_shape
+
+try:
+    from shapely import contains_xy as _contains_xy
+except ImportError:  # shapely < 2
+    _contains_xy = None
+
+REDUCING_OPS = {
+    '+': np.add,
+    '*': np.multiply,
+    'max': np.fmax,
+    'min': np.fmin,
+    'and': np.logical_and,
+    'or': np.logical_or,
+    'xor': np.logical_xor,
+}
+
+BINARY_OPS = {
+    '-': np.subtract,
+    '/': np.true_divide,
+    '^': np.power,
+    '**': np.power,
+    '==': np.equal,
+    '!=': np.not_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+    'atan2': np.arctan2,
+}
+
+UNARY_OPS = {
+    'neg': np.negative,
+    'not': np.logical_not,
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'log': np.log,
+    'log10': np.log10,
+    'round': np.round,
+    'floor': np.floor,
+    'ceil': np.ceil,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'asin': np.arcsin,
+    'acos': np.arccos,
+    'atan': np.arctan,
+    'sinh': np.sinh,
+    'cosh': np.cosh,
+    'tanh': np.tanh,
+    'isnodata': np.isnan,
+    'undefined': np.isnan,
+    'isdata': lambda value: ~np.isnan(value),
+    'defined': lambda value: ~np.isnan(value),
+}
+
+# Node fields that don't change what a node computes
+IGNORED_FIELDS = ('id', 'metadata', 'args')
+
+
+def classify(values, class_map):
+    """Map values to classes by breakpoints
+
+    Args:
+        values (numpy.ndarray): values to classify
+        class_map (dict): classifications, a dict of breakpoint to class,
+            and options with a boundaryType of lessThanOrEqualTo (default),
+            lessThan, greaterThan, greaterThanOrEqualTo or exact, and a
+            fallback for values outside every class
+
+    Returns:
+        numpy.ndarray
+    """
+    options = class_map.get('options') or {}
+    boundary = options.get('boundaryType', 'lessThanOrEqualTo')
+    fallback = options.get('fallback')
+    fallback = np.nan if fallback is None else float(fallback)
+    breaks = sorted(
+        (float(k), float(v))
+        for k, v in class_map['classifications'].items())
+    breakpoints = np.array([k for k, _ in breaks])
+    classes = np.append([v for _, v in breaks], fallback)
+
+    if boundary in ('lessThanOrEqualTo', 'lessThan'):
+        side = 'left' if boundary == 'lessThanOrEqualTo' else 'right'
+        index = np.searchsorted(breakpoints, values, side=side)
+    elif boundary in ('greaterThan', 'greaterThanOrEqualTo'):
+        side = 'left' if boundary == 'greaterThan' else 'right'
+        index = np.searchsorted(breakpoints, values, side=side) - 1
+        index[index < 0] = len(breakpoints)
+    elif boundary == 'exact':
+        index = np.searchsorted(breakpoints, values)
+        found = index < len(breakpoints)
+        found[found] = breakpoints[index[found]] == values[found]
+        index[~found] = len(breakpoints)
+    else:
+        raise ValueError('Unknown boundaryType {}'.format(boundary))
+    result = classes[index]
+    result[np.isnan(values)] = np.nan
+    return result
+
+
+class MapAlgebraEvaluator(object):
+    """Evaluates map algebra trees over in-memory or memory-mapped rasters"""
+
+    def __init__(self, sources, transform=None, chunk_rows=1024,
+                 cache_bytes=512 * 1024 * 1024, dtype=np.float64):
+        """Instantiate a new MapAlgebraEvaluator
+
+        Args:
+            sources (dict): 2D arrays of the same shape, by (project id,
+                band) of the projectSrc nodes that refer to them
+            transform (tuple): GDAL geotransform of the arrays, i.e. (west,
+                pixel width, 0, north, 0, -pixel height), needed to apply
+                geometry masks
+            chunk_rows (int): number of rows evaluated at a time
+            cache_bytes (int): memory to keep results between evaluations in
+            dtype: floating point type to compute in
+        """
+        self.sources = sources
+        self.transform = transform
+        self.chunk_rows = chunk_rows
+        self.cache_bytes = cache_bytes
+        self.dtype = dtype
+        shapes = set(np.shape(array) for array in sources.values())
+        if len(shapes) != 1:
+            raise ValueError(
+                'Sources must all have the same shape, not {}'.format(
+                    ', '.join(str(shape) for shape in shapes)))
+        self.shape = shapes.pop()
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+
+    def evaluate(self, node):
+        """Evaluate a map algebra tree
+
+        Args:
+            node (dict): root of the tree, e.g. an analysis's
+                executionParameters
+
+        Returns:
+            numpy.ndarray
+        """
+        # Keys describe what nodes compute, so they are recomputed in case
+        # the tree was edited since the last evaluation
+        keys = {}
+        self._key(node, keys)
+        out = np.empty(self.shape, dtype=self.dtype)
+        for start in range(0, self.shape[0], self.chunk_rows):
+            window = (start, min(start + self.chunk_rows, self.shape[0]))
+            out[window[0]:window[1]] = self._evaluate(node, window, keys, {})
+        return out
+
+    def _key(self, node, keys):
+        fields = {k: v for k, v in node.items() if k not in IGNORED_FIELDS}
+        children = [self._key(arg, keys) for arg in node.get('args') or []]
+        key = hashlib.sha1(json.dumps(
+            [fields, children], sort_keys=True, default=str
+        ).encode('utf-8')).hexdigest()
+        keys[id(node)] = key
+        return key
+
+    def _evaluate(self, node, window, keys, window_cache):
+        key = keys[id(node)]
+        if key in window_cache:
+            return window_cache[key]
+        cache_key = (key, window)
+        if cache_key in self._cache:
+            # Reinsert as the most recently used
+            value = self._cache[cache_key] = self._cache.pop(cache_key)
+        else:
+            args = [self._evaluate(arg, window, keys, window_cache)
+                    for arg in node.get('args') or []]
+            value = self._apply(node, args, window)
+            self._remember(cache_key, value)
+        window_cache[key] = value
+        return value
+
+    def _remember(self, cache_key, value):
+        if value.nbytes > self.cache_bytes:
+            return
+        self._cache[cache_key] = value
+        self._cached_bytes += value.nbytes
+        while self._cached_bytes > self.cache_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cached_bytes -= evicted.nbytes
+
+    def _apply(self, node, args, window):
+        node_type = node.get('type')
+        if node_type == 'projectSrc':
+            source = (node.get('projId'), int(node.get('band') or 0))
+            if source not in self.sources:
+                raise ValueError(
+                    'No source for band {1} of project {0}'.format(*source))
+            return np.asarray(
+                self.sources[source][window[0]:window[1]], dtype=self.dtype)
+        if node_type == 'const':
+            return np.full((window[1] - window[0], self.shape[1]),
+                           float(node['constant']), dtype=self.dtype)
+
+        op = node.get('apply')
+        if op in REDUCING_OPS:
+            value = args[0]
+            for arg in args[1:]:
+                value = REDUCING_OPS[op](value, arg)
+        elif op == '-' and len(args) == 1:
+            value = np.negative(args[0])
+        elif op in BINARY_OPS:
+            value = args[0]
+            for arg in args[1:]:
+                value = BINARY_OPS[op](value, arg)
+        elif op in UNARY_OPS:
+            value = UNARY_OPS[op](args[0])
+        elif op == 'classify':
+            value = classify(args[0], node['classMap'])
+        elif op == 'mask':
+            value = self._mask(args[0], node['mask'], window)
+        else:
+            raise ValueError('Unsupported operation {}'.format(op))
+        value = np.asarray(value, dtype=self.dtype)
+        if op in ('==', '!=', '<', '<=', '>', '>=', 'and', 'or', 'xor',
+                  'not'):
+            # Comparisons with missing data are missing
+            missing = np.zeros(value.shape, dtype=bool)
+            for arg in args:
+                missing |= np.isnan(arg)
+            value[missing] = np.nan
+        return value
+
+    def _mask(self, values, geometry, window):
+        """Set the values of pixels outside a geometry to NaN"""
+        if self.transform is None:
+            raise ValueError('Masking requires the sources\' transform')
+        west, width, _, north, _, height = self.transform
+        geometry = to_shape(geometry)
+        xs = west + (np.arange(self.shape[1]) + 0.5) * width
+        ys = north + (np.arange(window[0], window[1]) + 0.5) * height
+        xs, ys = np.meshgrid(xs, ys)
+        if _contains_xy is not None:
+            inside = _contains_xy(geometry, xs, ys)
+        else:
+            from shapely.geometry import Point
+            prepared = prep(geometry)
+            inside = np.array([
+                prepared.contains(Point(x, y))
+                for x, y in zip(xs.ravel(), ys.ravel())
+            ]).reshape(xs.shape)
+        masked = np.array(values, dtype=self.dtype)
+        masked[~inside] = np.nan
+        return masked
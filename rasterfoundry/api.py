@@ -1,5 +1,8 @@
 import json
+import logging
 import os
+import threading
+import time
 import uuid
 
 from bravado.client import SwaggerClient
@@ -8,27 +11,81 @@ from bravado.swagger_model import load_file, load_url
 from simplejson import JSONDecodeError
 
 
+from .aws import s3
 from .aws.s3 import str_to_file
+from .compression import compress_session
+from .download import SceneDownloader
 from .exceptions import RefreshTokenException
-from .models import Analysis, MapToken, Project, Export, Datasource
+from .geometry import simplify_features
+from .instrumentation import instrument_boto3_client, instrument_session
+from .search import search_scenes
+from .models import Analysis, MapToken, Project, Export, Datasource, Upload
 from .settings import RV_TEMP_URI
+from .thumbnails import fetch_thumbnails
+from .token_cache import TokenRefresher, token_expiry
+from .utils import ExpiringCache
 
 try:
     from urllib.parse import urlparse
 except ImportError:
     from urlparse import urlparse
 
+logger = logging.getLogger(__name__)
+
 SPEC_PATH = os.getenv(
     'RF_API_SPEC_PATH',
     'https://raw.githubusercontent.com/raster-foundry/raster-foundry-api-spec/1.16.0/spec/spec.yml'  # NOQA
 )
 
 
+def make_resolver_thread_safe(resolver):
+    """Give a jsonschema RefResolver a separate scope stack per thread
+
+    bravado pushes and pops scopes on its spec's one RefResolver while
+    marshalling requests and unmarshalling responses, so concurrent requests
+    from several threads corrupt each other's scopes.
+
+    This relies on RefResolver keeping its scopes in a private
+    _scopes_stack list, so resolvers that don't, e.g. from other jsonschema
+    versions, are left as they are.
+
+    Args:
+        resolver (jsonschema.RefResolver): resolver to patch in place
+
+    Returns:
+        bool: whether the resolver was patched
+    """
+    if not isinstance(getattr(resolver, '__dict__', {}).get('_scopes_stack'),
+                      list):
+        logger.debug('Not patching %s, which has no scope stack to make '
+                     'thread safe', type(resolver).__name__)
+        return False
+    base_scopes = list(resolver._scopes_stack)
+    local = threading.local()
+
+    def get_scopes(self):
+        if not hasattr(local, 'scopes'):
+            local.scopes = list(base_scopes)
+        return local.scopes
+
+    def set_scopes(self, scopes):
+        local.scopes = scopes
+
+    del resolver._scopes_stack
+    resolver.__class__ = type(
+        'ThreadSafe' + type(resolver).__name__, (type(resolver),),
+        {'_scopes_stack': property(get_scopes, set_scopes)})
+    return True
+
+
 class API(object):
     """Class to interact with Raster Foundry API"""
 
     def __init__(self, refresh_token=None, api_token=None,
-                 host='app.rasterfoundry.com', scheme='https'):
+                 host='app.rasterfoundry.com', scheme='https',
+                 instrumentation=None, tile_host=None, spec_path=None,
+                 http_adapter=None, token_cache=None, auto_refresh=False,
+                 refresh_margin=300, spec=None, compress_min_size=None):
         """Instantiate an API object to make requests to Raster Foundry's REST API
 
         Args:
@@ -37,36 +94,163 @@ class API(object):
             api_token (str): optional token used to authenticate API requests
             host (str): optional host to use to make API requests against
             scheme (str): optional scheme to override making requests with
+            instrumentation (Instrumentation): optional collector to record
+                                               metrics for every request made
+                                               through this API in, and for
+                                               the shared S3 clients' calls
+                                               until the API is closed
+            tile_host (str): optional host to make tile requests against,
+                             derived from host by default
+            spec_path (str): optional url or file path of the swagger spec,
+                             RF_API_SPEC_PATH by default
+            http_adapter (BaseAdapter): optional requests transport adapter to
+                                        send all requests through, e.g. a
+                                        RecordingAdapter or ReplayAdapter
+            token_cache (TokenCache): optional cache to share API tokens
+                                      obtained with refresh_token between
+                                      processes
+            auto_refresh (bool): whether to refresh the API token, obtained
+                                 with or given along with refresh_token, in
+                                 the background before it expires, until
+                                 the API is closed
+            refresh_margin (int): seconds before expiry to refresh API tokens
+                                  and to stop reusing cached ones
+            spec (dict): optional already loaded swagger spec, used instead
+                         of loading spec_path
+            compress_min_size (int): optional size in bytes from which JSON
+                                     request bodies are sent gzipped, e.g.
+                                     compression.DEFAULT_MIN_SIZE
         """
 
         self.http = RequestsClient()
+        if http_adapter is not None:
+            self.http.session.mount('http://', http_adapter)
+            self.http.session.mount('https://', http_adapter)
+        self.instrumentation = instrumentation
+        self._uninstrument = []
+        if instrumentation is not None:
+            instrument_session(self.http.session, instrumentation)
+            # The S3 clients are shared by all APIs, so stop recording their
+            # calls once this API is closed
+            self._uninstrument = [
+                instrument_boto3_client(client, instrumentation)
+                for client in (s3.s3, Upload.s3_client)]
+        # Compress outside of instrumentation, so that it counts the bytes
+        # actually sent
+        self.compress_min_size = compress_min_size
+        if compress_min_size is not None:
+            compress_session(self.http.session, min_size=compress_min_size)
         self.scheme = scheme
 
-        if urlparse(SPEC_PATH).netloc:
-            spec = load_url(SPEC_PATH)
-        else:
-            spec = load_file(SPEC_PATH)
+        if spec is None:
+            spec_path = spec_path or SPEC_PATH
+            if urlparse(spec_path).netloc:
+                spec = load_url(spec_path, http_client=self.http)
+            else:
+                spec = load_file(spec_path)
+        self.spec = spec
 
         self.app_host = host
         spec['host'] = host
         spec['schemes'] = [scheme]
 
-        split_host = host.split('.')
-        split_host[0] = 'tiles'
-        self.tile_host = '.'.join(split_host)
+        if tile_host is None:
+            split_host = host.split('.')
+            split_host[0] = 'tiles'
+            tile_host = '.'.join(split_host)
+        self.tile_host = tile_host
 
         config = {'validate_responses': False}
         self.client = SwaggerClient.from_spec(spec, http_client=self.http,
                                               config=config)
-
+        make_resolver_thread_safe(self.client.swagger_spec.resolver)
+
+        # Projects and their image sources are cached per API, so they are
+        # never shared with requests made with other credentials
+        self.project_cache = ExpiringCache(max_size=1024, ttl=300)
+        self.image_sources_cache = ExpiringCache(max_size=64, ttl=300)
+
+        self.token_cache = token_cache
+        self.token_refresher = None
+        self._token_lock = threading.Lock()
+        self.refresh_token = refresh_token
+        self.auto_refresh = auto_refresh
+        self.refresh_margin = refresh_margin
         if refresh_token and not api_token:
-            api_token = self.get_api_token(refresh_token)
-        elif not api_token:
+            api_token, expires_at = self.fetch_api_token(
+                refresh_token, min_ttl=refresh_margin)
+        elif api_token:
+            # An API token obtained with refresh_token elsewhere, e.g. by the
+            # API a worker_config came from
+            expires_at = token_expiry(api_token)
+        else:
             raise Exception('Must provide either a refresh token or API token')
+        if refresh_token and auto_refresh:
+            self.token_refresher = TokenRefresher(
+                self, refresh_token, expires_at, margin=refresh_margin
+            ).start()
+
+        self.set_api_token(api_token)
+
+    def close(self):
+        """Stop the API's background work and close its connections
+
+        Token refresh stops, and so does recording the shared S3 clients'
+        calls in the API's instrumentation. The API can be used as a context
+        manager, which closes it on exit.
+        """
+        if self.token_refresher is not None:
+            self.token_refresher.stop()
+            self.token_refresher = None
+        for uninstrument in self._uninstrument:
+            uninstrument()
+        self._uninstrument = []
+        self.http.session.close()
 
-        self.api_token = api_token
-        self.http.session.headers['Authorization'] = 'Bearer {}'.format(
-            api_token)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def set_api_token(self, api_token):
+        """Use a new API token for all subsequent requests
+
+        Args:
+            api_token (str): token used to authenticate API requests
+        """
+        with self._token_lock:
+            self.api_token = api_token
+            self.http.session.headers['Authorization'] = 'Bearer {}'.format(
+                api_token)
+
+    def worker_config(self):
+        """Get picklable arguments to rebuild this API in another process
+
+        The config includes the loaded spec and current API token, so APIs
+        built from it make no requests during construction. If this API was
+        given a refresh token, the config includes it and the token cache, so
+        that long-running workers refresh their API token before it expires.
+
+        Returns:
+            dict: keyword arguments for API
+        """
+        config = {
+            'api_token': self.api_token,
+            'host': self.app_host,
+            'scheme': self.scheme,
+            'tile_host': self.tile_host,
+            'spec': self.spec,
+            'compress_min_size': self.compress_min_size
+        }
+        if self.refresh_token:
+            config.update({
+                'refresh_token': self.refresh_token,
+                'token_cache': self.token_cache,
+                'auto_refresh': True,
+                'refresh_margin': self.refresh_margin
+            })
+        return config
 
     def get_api_token(self, refresh_token):
         """Retrieve API token given a refresh token
@@ -78,15 +262,39 @@ class API(object):
         Returns:
             str
         """
+        return self._request_api_token(refresh_token)[0]
+
+    def fetch_api_token(self, refresh_token, min_ttl=0):
+        """Retrieve an API token and its expiry, using the token cache if set
+
+        Args:
+            refresh_token (str): refresh token used to make a request for a new
+                                 API token
+            min_ttl (int): seconds a cached API token must still be valid for
+
+        Returns:
+            tuple of (str, float): the API token and its expiry time as seconds
+                                   since the epoch
+        """
+        if self.token_cache is None:
+            return self._request_api_token(refresh_token)
+        return self.token_cache.get_or_fetch(
+            refresh_token, self._request_api_token, min_ttl=min_ttl)
+
+    def _request_api_token(self, refresh_token):
         post_body = {'refresh_token': refresh_token}
 
         try:
             response = self.client.Authentication.post_tokens(
                 authBody=post_body).future.result()
-            return response.json()['id_token']
+            body = response.json()
         except JSONDecodeError:
             raise RefreshTokenException('Error using refresh token, please '
                                         'verify it is valid')
+        api_token = body['id_token']
+        if body.get('expires_in'):
+            return api_token, time.time() + float(body['expires_in'])
+        return api_token, token_expiry(api_token)
 
     @property
     def map_tokens(self):
@@ -134,6 +342,23 @@ class API(object):
     def analyses(self):
         """List analyses a user has access to
 
+        Returns:
+            List[Analysis]
+        """
+        return self.get_analyses()
+
+    def get_analyses(self, resolve_inputs=False, max_workers=8,
+                     refresh=False):
+        """List analyses a user has access to
+
+        Args:
+            resolve_inputs (bool): whether to also fetch all of the analyses'
+                input projects, concurrently and once per project
+            max_workers (int): maximum number of concurrent requests when
+                fetching input projects
+            refresh (bool): whether to fetch input projects that are already
+                in project_cache again
+
         Returns:
             List[Analysis]
         """
@@ -146,6 +371,9 @@ class API(object):
             page = paginated_analyses.page + 1
             for analysis in paginated_analyses.results:
                 analyses.append(Analysis(analysis, self))
+        if resolve_inputs:
+            Analysis.resolve_inputs(
+                analyses, max_workers=max_workers, refresh=refresh)
         return analyses
 
     @property
@@ -184,6 +412,77 @@ class API(object):
             kwargs['bbox'] = ','.join(str(x) for x in bbox)
         return self.client.Imagery.get_scenes(**kwargs).result()
 
+    def search_scenes(self, geometries, **kwargs):
+        """Find the scenes intersecting each of many AOIs
+
+        Nearby and overlapping AOIs are searched with shared bounding box
+        queries, which are paginated concurrently, and each scene is fetched
+        once however many AOIs it intersects.
+
+        Args:
+            geometries (list): shapely geometries or GeoJSON-like dicts, in
+                lon/lat
+            **kwargs: additional arguments for search.search_scenes, e.g.
+                max_workers, and get_scenes filters, e.g. datasource or
+                maxCloudCover
+
+        Returns:
+            list with the list of scenes intersecting each geometry, in the
+            order of geometries
+        """
+        return search_scenes(self, geometries, **kwargs)
+
+    def download_scenes(self, scenes, destination, **kwargs):
+        """Download the assets of scenes concurrently
+
+        Args:
+            scenes (list): scenes, e.g. from get_scenes or
+                Project.get_scenes, or scene ids
+            destination (str): local directory or s3 URI prefix to save
+                assets under
+            **kwargs: additional arguments for SceneDownloader, e.g.
+                max_workers or max_bytes_per_second
+
+        Returns:
+            list of AssetDownload
+        """
+        return SceneDownloader(self, destination, **kwargs).download(scenes)
+
+    def fetch_thumbnails(self, scenes, size='SMALL', **kwargs):
+        """Fetch the thumbnails of scenes concurrently through a disk cache
+
+        Args:
+            scenes (list): scenes, e.g. from get_scenes or
+                Project.get_scenes, or scene ids
+            size (str): SMALL, LARGE or SQUARE
+            **kwargs: additional arguments for thumbnails.fetch_thumbnails,
+                e.g. max_workers or cache
+
+        Returns:
+            generator of (scene, thumbnail) tuples, in the order thumbnails
+            become available
+        """
+        return fetch_thumbnails(self, scenes, size=size, **kwargs)
+
+    def create_shapes(self, features, simplify_zoom=None):
+        """Create shapes from GeoJSON features
+
+        Args:
+            features (list of dict): GeoJSON features with a name property
+            simplify_zoom (int): if set, simplify the features' geometries to
+                the detail visible at this zoom level
+
+        Returns:
+            ShapeFeatureCollection
+        """
+        if simplify_zoom is not None:
+            features, reduction = simplify_features(
+                features, zoom=simplify_zoom)
+            logger.info('Simplified shapes: %s', reduction)
+        return self.client.Imagery.post_shapes(shapes={
+            'type': 'FeatureCollection', 'features': list(features)
+        }).result()
+
     def get_project_config(self, project_ids, annotations_uris=None):
         """Get data needed to create project config file for prep_train_data
 
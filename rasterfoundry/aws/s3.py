@@ -1,12 +1,19 @@
 from future.standard_library import install_aliases  # noqa
 install_aliases()  # noqa
 from urllib.parse import urlparse
+import hashlib
 import json
 import io
 import os
+import tempfile
+import threading
 
 import boto3
+import botocore.session
+from botocore.credentials import CredentialProvider, RefreshableCredentials
 from botocore.exceptions import ClientError
+from botocore.utils import parse_timestamp
+from dateutil.tz import tzutc
 
 from ..utils import mkdir_p
 
@@ -105,6 +112,49 @@ def unauthorize_bucket(bucket_name):
     return resp['ResponseMetadata']['HTTPStatusCode']
 
 
+def refreshable_client(service_name, fetch_credentials, **kwargs):
+    """Create a boto3 client whose temporary credentials renew themselves
+
+    Args:
+        service_name (str): AWS service, e.g. 's3'
+        fetch_credentials (callable): function returning a dict of
+            AccessKeyId, SecretAccessKey, SessionToken and Expiration, called
+            again whenever the credentials are about to expire
+        **kwargs: additional arguments for the client
+
+    Returns:
+        boto3 client
+    """
+    def refresh():
+        credentials = fetch_credentials()
+        expiration = credentials['Expiration']
+        if not hasattr(expiration, 'isoformat'):
+            expiration = parse_timestamp(expiration)
+        if expiration.tzinfo is None:
+            expiration = expiration.replace(tzinfo=tzutc())
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': expiration.isoformat()
+        }
+
+    class Provider(CredentialProvider):
+        METHOD = 'raster-foundry'
+
+        def load(self):
+            return RefreshableCredentials.create_from_metadata(
+                refresh(), refresh, self.METHOD)
+
+    # Resolve credentials with fetch_credentials before any of the usual
+    # sources, like environment variables or ~/.aws
+    session = botocore.session.get_session()
+    session.get_component('credential_provider').insert_before(
+        'env', Provider())
+    return boto3.Session(botocore_session=session).client(
+        service_name, **kwargs)
+
+
 def file_to_str(file_uri):
     parsed_uri = urlparse(file_uri)
     if parsed_uri.scheme == 's3':
@@ -128,3 +178,128 @@ def str_to_file(content_str, file_uri):
         mkdir_p(os.path.dirname(file_uri))
         with open(file_uri, 'w') as content_file:
             content_file.write(content_str)
+
+
+def file_exists(file_uri):
+    parsed_uri = urlparse(file_uri)
+    if parsed_uri.scheme == 's3':
+        try:
+            s3.head_object(Bucket=parsed_uri.netloc, Key=parsed_uri.path[1:])
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+    else:
+        return os.path.isfile(file_uri)
+
+
+def file_to_chunks(file_uri, chunk_size=64 * 1024):
+    """Read a file as a stream of bytes chunks
+
+    Args:
+        file_uri (str): local path or s3 URI of the file
+        chunk_size (int): size of the chunks in bytes
+
+    Yields:
+        bytes
+    """
+    parsed_uri = urlparse(file_uri)
+    if parsed_uri.scheme == 's3':
+        body = s3.get_object(
+            Bucket=parsed_uri.netloc, Key=parsed_uri.path[1:])['Body']
+        try:
+            for chunk in body.iter_chunks(chunk_size):
+                yield chunk
+        finally:
+            body.close()
+    else:
+        with open(file_uri, 'rb') as file_buffer:
+            for chunk in iter(lambda: file_buffer.read(chunk_size), b''):
+                yield chunk
+
+
+def file_etag(path, part_size=None, block_size=1024 * 1024):
+    """Compute the ETag S3 gives a local file once uploaded
+
+    Args:
+        path (str): local file
+        part_size (int): part size of a multipart upload, or None for the MD5
+            of an object uploaded in a single part
+        block_size (int): bytes to read at a time
+
+    Returns:
+        str: the ETag, without quotes
+    """
+    digests = []
+    part = hashlib.md5()
+    in_part = 0
+    with open(path, 'rb') as file_buffer:
+        for block in iter(lambda: file_buffer.read(block_size), b''):
+            block = memoryview(block)
+            while len(block):
+                take = (len(block) if part_size is None
+                        else min(len(block), part_size - in_part))
+                part.update(block[:take])
+                in_part += take
+                block = block[take:]
+                if in_part == part_size:
+                    digests.append(part.digest())
+                    part = hashlib.md5()
+                    in_part = 0
+    if part_size is None:
+        return part.hexdigest()
+    if in_part or not digests:
+        digests.append(part.digest())
+    return '{}-{}'.format(
+        hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
+
+
+class FileHashCache(object):
+    """Caches file ETags by path, modification time, size and part size"""
+
+    def __init__(self, path=None):
+        """Instantiate a new FileHashCache
+
+        Args:
+            path (str): optional JSON file to persist cached ETags to
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if path and os.path.isfile(path):
+            with open(path) as cache_file:
+                self.entries = json.load(cache_file)
+
+    def etag(self, file_path, part_size=None):
+        """Get the ETag of a local file, computing it if it isn't cached
+
+        Args:
+            file_path (str): local file
+            part_size (int): part size of a multipart upload, if any
+
+        Returns:
+            str: the ETag, without quotes
+        """
+        stat = os.stat(file_path)
+        key = '{}:{}:{}:{}'.format(os.path.abspath(file_path), stat.st_mtime,
+                                   stat.st_size, part_size or 0)
+        with self._lock:
+            etag = self.entries.get(key)
+        if etag is None:
+            etag = file_etag(file_path, part_size)
+            with self._lock:
+                self.entries[key] = etag
+        return etag
+
+    def save(self):
+        """Write cached ETags to this cache's path, if it has one"""
+        if not self.path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        mkdir_p(directory)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as tmp_file:
+            with self._lock:
+                json.dump(self.entries, tmp_file)
+        os.rename(tmp_path, self.path)
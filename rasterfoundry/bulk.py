@@ -0,0 +1,177 @@
+"""Run CPU-heavy work over many Raster Foundry objects in a process pool
+
+An API, with its bravado client, requests session and boto3 clients, can't
+be pickled or safely shared with forked processes. A BulkExecutor instead
+ships the API's worker_config (its loaded spec and current token) to each
+worker once, where a fresh API and fresh boto3 clients are built, and ships
+model objects as their marshalled specification dicts.
+
+Usage:
+
+    def count_features(api, project):
+        return len(project.get_annotations())
+
+    with BulkExecutor(api, processes=8) as executor:
+        for result in executor.map(count_features, api.projects):
+            ...
+
+The mapped function must be importable by the workers, i.e. defined at
+module level.
+"""
+import multiprocessing
+import traceback
+from collections import namedtuple
+
+import boto3
+
+from .aws import s3
+from .models import Analysis, Datasource, Export, Project, Upload
+
+# Model wrappers that can be rebuilt in workers, and their wrapped attribute
+WRAPPERS = {
+    'Analysis': (Analysis, '_analysis'),
+    'Datasource': (Datasource, '_datasource'),
+    'Export': (Export, '_export'),
+    'Project': (Project, '_project'),
+    'Upload': (Upload, '_upload'),
+}
+
+BulkResult = namedtuple('BulkResult', ['index', 'item', 'value', 'error'])
+BulkResult.__doc__ = """Outcome of applying a function to one item
+
+Attributes:
+    index (int): position of the item in the mapped iterable
+    item: the item
+    value: the function's return value, None if it raised
+    error (str): formatted traceback if the function raised, otherwise None
+"""
+
+_worker_api = None
+
+
+def _init_worker(config):
+    """Build this worker process's API and boto3 clients once"""
+    global _worker_api
+    from .api import API
+    # boto3 clients inherited through fork share connection pools with the
+    # parent, so replace them with this process's own
+    s3.s3 = boto3.client('s3')
+    Upload.s3_client = boto3.client('s3')
+    _worker_api = API(**config)
+
+
+def _detach(item):
+    """Convert model wrappers to a picklable form"""
+    name = type(item).__name__
+    if name in WRAPPERS and isinstance(item, WRAPPERS[name][0]):
+        wrapped = getattr(item, WRAPPERS[name][1])
+        return ('model', name, type(wrapped).__name__, wrapped._marshal())
+    return ('value', item)
+
+
+def _attach(detached):
+    if detached[0] == 'model':
+        _, name, model_name, marshalled = detached
+        wrapped = _worker_api.client.get_model(model_name)._unmarshal(
+            marshalled)
+        return WRAPPERS[name][0](wrapped, _worker_api)
+    return detached[1]
+
+
+def _run_chunk(args):
+    fn, chunk = args
+    results = []
+    for index, detached in chunk:
+        try:
+            results.append((index, fn(_worker_api, _attach(detached)), None))
+        except Exception:
+            results.append((index, None, traceback.format_exc()))
+    return results
+
+
+class BulkExecutor(object):
+    """Maps functions over Raster Foundry objects in a pool of processes"""
+
+    def __init__(self, api, processes=None, chunksize=1, mp_context=None):
+        """Instantiate a new BulkExecutor
+
+        Worker processes start when the executor is first used and each
+        build their API once.
+
+        Args:
+            api (API): API whose configuration workers use
+            processes (int): number of worker processes, the CPU count by
+                default
+            chunksize (int): number of items sent to a worker at once
+            mp_context: optional multiprocessing context, e.g.
+                multiprocessing.get_context('spawn')
+        """
+        self.config = api.worker_config()
+        self.processes = processes
+        self.chunksize = chunksize
+        self.mp_context = mp_context or multiprocessing
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = self.mp_context.Pool(
+                self.processes, initializer=_init_worker,
+                initargs=(self.config,))
+        return self._pool
+
+    def imap(self, fn, items, ordered=True, chunksize=None):
+        """Lazily apply fn(api, item) to every item in worker processes
+
+        Project, Export, Upload, Analysis and Datasource items are rebuilt
+        in the worker with the worker's API; other items must be picklable.
+        Errors are captured per item rather than raised.
+
+        Args:
+            fn (callable): module-level function of (api, item)
+            items (iterable): items to apply fn to
+            ordered (bool): whether to yield results in the order of items,
+                otherwise they are yielded as soon as they complete
+            chunksize (int): number of items sent to a worker at once,
+                overriding the executor's chunksize
+
+        Yields:
+            BulkResult
+        """
+        items = list(items)
+        chunksize = chunksize or self.chunksize
+        detached = [(i, _detach(item)) for i, item in enumerate(items)]
+        chunks = [
+            (fn, detached[start:start + chunksize])
+            for start in range(0, len(detached), chunksize)
+        ]
+        imap = self.pool.imap if ordered else self.pool.imap_unordered
+        for chunk_results in imap(_run_chunk, chunks):
+            for index, value, error in chunk_results:
+                yield BulkResult(index, items[index], value, error)
+
+    def map(self, fn, items, chunksize=None):
+        """Apply fn(api, item) to every item in worker processes
+
+        Args:
+            fn (callable): module-level function of (api, item)
+            items (iterable): items to apply fn to
+            chunksize (int): number of items sent to a worker at once
+
+        Returns:
+            list of BulkResult, in the order of items
+        """
+        return list(self.imap(fn, items, chunksize=chunksize))
+
+    def close(self):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
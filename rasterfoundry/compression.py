@@ -0,0 +1,118 @@
+"""Gzip large JSON request bodies
+
+Annotations, bulk scene additions, uploads with long file lists and shapes
+are sent as large JSON documents, which compress well. A CompressingAdapter
+mounted on the API's requests session gzips such bodies before they are
+sent. Responses need no help: requests already asks for them with
+Accept-Encoding: gzip, deflate and decompresses them transparently.
+"""
+import gzip
+import io
+import threading
+
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+# Smaller bodies aren't worth the time to compress them
+DEFAULT_MIN_SIZE = 8 * 1024
+
+
+def gzip_bytes(data, level=6):
+    """Gzip bytes
+
+    Args:
+        data (bytes): bytes to compress
+        level (int): compression level from 1, fastest, to 9, smallest
+
+    Returns:
+        bytes
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=level) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+class CompressingAdapter(HTTPAdapter):
+    """A requests transport adapter that gzips large JSON request bodies
+
+    Hosts that reject a compressed body with 415 Unsupported Media Type are
+    sent the request again uncompressed, and aren't sent compressed bodies
+    after that.
+    """
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, level=6, adapter=None,
+                 **kwargs):
+        """Instantiate a new CompressingAdapter
+
+        Args:
+            min_size (int): size in bytes from which bodies are compressed
+            level (int): gzip compression level
+            adapter (HTTPAdapter): optional adapter to send requests through,
+                so that compression can wrap other custom transports
+            **kwargs: additional arguments for HTTPAdapter
+        """
+        super(CompressingAdapter, self).__init__(**kwargs)
+        self.min_size = min_size
+        self.level = level
+        self.adapter = adapter
+        self.uncompressed_hosts = set()
+        self._lock = threading.Lock()
+
+    def _send(self, request, **kwargs):
+        if self.adapter is not None:
+            return self.adapter.send(request, **kwargs)
+        return super(CompressingAdapter, self).send(request, **kwargs)
+
+    def _compressible(self, request):
+        if not isinstance(request.body, (bytes, type(u''))):
+            return False
+        if 'json' not in request.headers.get('Content-Type', ''):
+            return False
+        if 'Content-Encoding' in request.headers:
+            return False
+        return urlparse(request.url).netloc not in self.uncompressed_hosts
+
+    def send(self, request, **kwargs):
+        if not self._compressible(request):
+            return self._send(request, **kwargs)
+        body = request.body
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        if len(body) < self.min_size:
+            return self._send(request, **kwargs)
+
+        compressed = request.copy()
+        compressed.body = gzip_bytes(body, self.level)
+        compressed.headers['Content-Encoding'] = 'gzip'
+        compressed.headers['Content-Length'] = str(len(compressed.body))
+        response = self._send(compressed, **kwargs)
+        if response.status_code != 415:
+            return response
+        response.close()
+        with self._lock:
+            self.uncompressed_hosts.add(urlparse(request.url).netloc)
+        return self._send(request, **kwargs)
+
+    def close(self):
+        if self.adapter is not None:
+            self.adapter.close()
+        super(CompressingAdapter, self).close()
+
+
+def compress_session(session, min_size=DEFAULT_MIN_SIZE, level=6):
+    """Gzip large JSON request bodies sent through a session
+
+    Args:
+        session (requests.Session): session to compress requests of
+        min_size (int): size in bytes from which bodies are compressed
+        level (int): gzip compression level
+    """
+    for prefix in ['http://', 'https://']:
+        session.mount(prefix, CompressingAdapter(
+            min_size=min_size, level=level,
+            adapter=session.get_adapter(prefix)))
@@ -0,0 +1,290 @@
+"""Download the source assets of many scenes concurrently
+
+Usage:
+
+    downloader = SceneDownloader(api, '/data/scenes', max_workers=8,
+                                 max_bytes_per_second=50 * 1024 * 1024)
+    for result in downloader.download(project.get_scenes()):
+        ...
+
+Each scene's assets are resolved through /scenes/{uuid}/download and saved
+under the destination as <scene id>/<file name>. Local downloads are written
+to a .part file which later runs resume with a ranged request, and are only
+moved into place once their size matches the size the server reported, so a
+file at its final path is always complete and is skipped on later runs.
+"""
+from future.standard_library import install_aliases  # noqa
+install_aliases()  # noqa
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from botocore.exceptions import ClientError
+
+from .aws import s3
+from .utils import RateLimiter, mkdir_p
+
+logger = logging.getLogger(__name__)
+
+AssetDownload = namedtuple(
+    'AssetDownload',
+    ['scene_id', 'uri', 'destination', 'size', 'status', 'error'])
+AssetDownload.__doc__ = """Outcome of downloading one scene asset
+
+Attributes:
+    scene_id (str): id of the scene the asset belongs to
+    uri (str): URI the asset was downloaded from
+    destination (str): local path or s3 URI the asset was saved to
+    size (int): size of the asset in bytes, if known
+    status (str): 'downloaded', 'skipped' or 'failed'
+    error (str): error message if the download failed, otherwise None
+"""
+
+
+class _RangeNotSatisfiable(Exception):
+    """A partial download can't be resumed from its size"""
+
+
+class _IncompleteDownload(IOError):
+    """A download's size doesn't match the size the server reported"""
+
+
+class SceneDownloader(object):
+    """Downloads scene assets concurrently with an optional bandwidth cap"""
+
+    def __init__(self, api, destination, max_workers=4,
+                 max_bytes_per_second=None, chunk_size=1024 * 1024,
+                 session=None, timeout=60):
+        """Instantiate a new SceneDownloader
+
+        Args:
+            api (API): API to resolve download URIs with
+            destination (str): local directory or s3 URI prefix to save
+                assets under
+            max_workers (int): maximum number of concurrent requests
+            max_bytes_per_second (int): total bandwidth cap across all
+                downloads, or None for no cap
+            chunk_size (int): bytes to read from a download at a time
+            session (requests.Session): session for asset requests. Download
+                URIs may be presigned, so by default a session without the
+                API's credentials is used
+            timeout (float): seconds to wait for each asset server response
+        """
+        self.api = api
+        self.destination = destination
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(max_bytes_per_second)
+
+    def resolve(self, scene_id):
+        """List the downloadable images of a scene
+
+        Args:
+            scene_id (str): id of the scene
+
+        Returns:
+            list of tuples of (download URI, file name)
+        """
+        images = self.api.client.Imagery.get_scenes_sceneID_download(
+            sceneID=scene_id).result()
+        return [
+            (image.downloadUri,
+             os.path.basename(image.filename or urlparse(
+                 image.downloadUri).path))
+            for image in images if image.downloadUri
+        ]
+
+    def _resolve_or_fail(self, scene_id):
+        """Resolve a scene, capturing any error as a failed AssetDownload
+
+        Returns:
+            tuple of (list of (download URI, file name), AssetDownload or
+            None)
+        """
+        try:
+            return self.resolve(scene_id), None
+        except Exception as e:
+            logger.exception('Failed to resolve downloads of %s', scene_id)
+            return [], AssetDownload(scene_id, None, None, None, 'failed',
+                                     str(e))
+
+    def download(self, scenes):
+        """Download all assets of some scenes
+
+        Scenes whose downloads can't be resolved are reported as one failed
+        AssetDownload without a URI.
+
+        Args:
+            scenes (list): scenes, e.g. from API.get_scenes or
+                Project.get_scenes, or scene ids
+
+        Returns:
+            list of AssetDownload
+        """
+        scene_ids = [getattr(scene, 'id', scene) for scene in scenes]
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            resolved = list(executor.map(self._resolve_or_fail, scene_ids))
+            assets = [
+                (scene_id, uri, filename)
+                for scene_id, (images, _) in zip(scene_ids, resolved)
+                for uri, filename in images
+            ]
+            downloads = list(executor.map(
+                lambda asset: self.download_asset(*asset), assets))
+        return [failure for _, failure in resolved if failure] + downloads
+
+    def download_asset(self, scene_id, uri, filename):
+        """Download one asset, capturing any error in the result
+
+        Args:
+            scene_id (str): id of the scene the asset belongs to
+            uri (str): download URI of the asset
+            filename (str): file name to save the asset as
+
+        Returns:
+            AssetDownload
+        """
+        if urlparse(self.destination).scheme == 's3':
+            destination = '/'.join(
+                [self.destination.rstrip('/'), scene_id, filename])
+            save = self._save_to_s3
+        else:
+            destination = os.path.join(self.destination, scene_id, filename)
+            save = self._save_to_file
+        try:
+            status, size = save(uri, destination)
+            return AssetDownload(scene_id, uri, destination, size, status,
+                                 None)
+        except Exception as e:
+            logger.exception('Failed to download %s', uri)
+            return AssetDownload(scene_id, uri, destination, None, 'failed',
+                                 str(e))
+
+    def _open(self, uri, offset=0):
+        """Request an asset from offset onwards
+
+        Returns:
+            tuple of (offset the content starts at, total size or None,
+            iterator of bytes chunks, function to release the response)
+        """
+        parsed = urlparse(uri)
+        if parsed.scheme == 's3':
+            kwargs = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+            try:
+                obj = s3.s3.get_object(
+                    Bucket=parsed.netloc, Key=parsed.path[1:], **kwargs)
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'InvalidRange':
+                    raise
+                raise _RangeNotSatisfiable()
+            if 'ContentRange' in obj:
+                start = offset
+                total = int(obj['ContentRange'].split('/')[-1])
+            else:
+                start, total = 0, obj['ContentLength']
+            return (start, total, obj['Body'].iter_chunks(self.chunk_size),
+                    obj['Body'].close)
+
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+        response = self.session.get(uri, headers=headers, stream=True,
+                                    timeout=self.timeout)
+        if response.status_code == 416:
+            response.close()
+            raise _RangeNotSatisfiable()
+        response.raise_for_status()
+        if response.status_code == 206:
+            start = offset
+            total = int(response.headers['Content-Range'].split('/')[-1])
+        else:
+            start = 0
+            length = response.headers.get('Content-Length')
+            total = int(length) if length else None
+        return (start, total, response.iter_content(self.chunk_size),
+                response.close)
+
+    def _throttled(self, chunks):
+        for chunk in chunks:
+            self.rate_limiter.wait(len(chunk))
+            yield chunk
+
+    def _save_to_file(self, uri, path):
+        if os.path.isfile(path):
+            return 'skipped', os.path.getsize(path)
+        mkdir_p(os.path.dirname(path))
+        part_path = path + '.part'
+        if os.path.isfile(part_path):
+            try:
+                return self._download_part(
+                    uri, path, part_path, os.path.getsize(part_path))
+            except (_RangeNotSatisfiable, _IncompleteDownload):
+                # The partial download is as large as the asset or larger, or
+                # doesn't match it, so it can't be resumed
+                logger.warning('Restarting the download of %s', uri)
+        return self._download_part(uri, path, part_path, 0)
+
+    def _download_part(self, uri, path, part_path, offset):
+        """Download an asset into its .part file from offset onwards"""
+        start, total, chunks, close = self._open(uri, offset)
+        try:
+            with open(part_path, 'ab' if start else 'wb') as part_file:
+                for chunk in self._throttled(chunks):
+                    part_file.write(chunk)
+        finally:
+            close()
+        size = os.path.getsize(part_path)
+        if total is not None and size != total:
+            # Don't resume from a file that doesn't match the asset
+            os.remove(part_path)
+            raise _IncompleteDownload('Downloaded {} of {} bytes of {}'.format(
+                size, total, uri))
+        os.rename(part_path, path)
+        return 'downloaded', size
+
+    def _save_to_s3(self, uri, s3_uri):
+        parsed = urlparse(s3_uri)
+        bucket, key = parsed.netloc, parsed.path[1:]
+        _, total, chunks, close = self._open(uri)
+        try:
+            try:
+                existing = s3.s3.head_object(
+                    Bucket=bucket, Key=key)['ContentLength']
+            except ClientError as e:
+                if e.response['Error']['Code'] not in ('404', 'NotFound'):
+                    raise
+                existing = None
+            if existing is not None and existing == total:
+                return 'skipped', existing
+            s3.s3.upload_fileobj(
+                _ChunkReader(self._throttled(chunks)), bucket, key)
+        finally:
+            close()
+        size = s3.s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+        if total is not None and size != total:
+            s3.s3.delete_object(Bucket=bucket, Key=key)
+            raise IOError('Copied {} of {} bytes of {}'.format(
+                size, total, uri))
+        return 'downloaded', size
+
+
+class _ChunkReader(object):
+    """A readable file object over an iterator of bytes chunks"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
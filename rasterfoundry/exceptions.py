@@ -7,3 +7,33 @@ class RefreshTokenException(Exception):
 
 class GatewayTimeoutException(Exception):
     pass
+
+
+class CassetteMissException(Exception):
+    pass
+
+
+class BatchJobTimeoutException(Exception):
+    pass
+
+
+class PredictionsTimeoutException(Exception):
+    pass
+
+
+class UploadFailedException(Exception):
+    def __init__(self, message, report=None):
+        super(UploadFailedException, self).__init__(message)
+        self.report = report
+
+
+class UploadTimeoutException(Exception):
+    def __init__(self, message, result=None):
+        super(UploadTimeoutException, self).__init__(message)
+        self.result = result
+
+
+class MissingScenesException(Exception):
+    def __init__(self, message, scene_ids=None):
+        super(MissingScenesException, self).__init__(message)
+        self.scene_ids = scene_ids
@@ -0,0 +1,273 @@
+"""Geometry helpers for choosing scene footprints and shrinking payloads"""
+import json
+import math
+from collections import namedtuple
+from datetime import datetime
+
+from dateutil.parser import parse as parse_date
+from shapely.geometry import mapping, shape
+
+try:
+    # shapely 2 applies operations to arrays of geometries at once
+    import numpy as np
+    from shapely import (
+        area as _area, intersection as _intersection, simplify as _simplify
+    )
+except ImportError:
+    np = None
+
+# Size of a web map tile in pixels
+TILE_SIZE = 256
+
+
+def to_shape(geometry):
+    """Convert a GeoJSON-like dict or shapely geometry to a shapely geometry"""
+    if hasattr(geometry, 'geom_type'):
+        return geometry
+    if hasattr(geometry, '_as_dict'):
+        geometry = geometry._as_dict()
+    return shape(geometry)
+
+
+def intersection_areas(geometries, other):
+    """Compute the area each geometry shares with another geometry
+
+    Args:
+        geometries (list): shapely geometries
+        other: shapely geometry
+
+    Returns:
+        list of float
+    """
+    if np is not None:
+        return list(_area(_intersection(
+            np.asarray(geometries, dtype=object), other)))
+    return [geometry.intersection(other).area for geometry in geometries]
+
+
+def scene_cost(scene, newest, cloud_weight=1., age_weight=1.):
+    """Cost of using a scene, growing with its cloud cover and age
+
+    Args:
+        scene: scene whose filterFields have a cloudCover and acquisitionDate
+        newest (datetime): acquisition date of the newest candidate
+        cloud_weight (float): cost of a fully clouded scene
+        age_weight (float): cost of a scene a year older than the newest
+
+    Returns:
+        float
+    """
+    cost = 1.
+    cloud_cover = _filter_field(scene, 'cloudCover')
+    if cloud_cover is not None:
+        cost += cloud_weight * cloud_cover / 100.
+    acquired = _acquisition_date(scene)
+    if acquired is not None and newest is not None:
+        cost += age_weight * (newest - acquired).days / 365.
+    return cost
+
+
+def _filter_field(scene, name):
+    filter_fields = getattr(scene, 'filterFields', None)
+    if isinstance(filter_fields, dict):
+        return filter_fields.get(name)
+    return getattr(filter_fields, name, None)
+
+
+def _acquisition_date(scene):
+    acquired = _filter_field(scene, 'acquisitionDate')
+    if acquired and not isinstance(acquired, datetime):
+        acquired = parse_date(acquired)
+    if acquired:
+        return acquired.replace(tzinfo=None)
+    return None
+
+
+def select_covering_scenes(aoi, scenes, cloud_weight=1., age_weight=1.,
+                           min_coverage=0.99):
+    """Choose few, clear and recent scenes that together cover an AOI
+
+    This is a greedy weighted set cover: each step picks the scene that
+    covers the most still uncovered area per unit of cost, see scene_cost,
+    until min_coverage of the AOI is covered or no scene covers any more of
+    it. With shapely 2 every step evaluates all candidates at once.
+
+    Args:
+        aoi: shapely geometry or GeoJSON-like dict to cover
+        scenes (list): candidate scenes with a dataFootprint
+        cloud_weight (float): cost of a fully clouded scene
+        age_weight (float): cost per year older than the newest candidate
+        min_coverage (float): fraction of the AOI to cover
+
+    Returns:
+        list of scenes in the order they were chosen, best first
+    """
+    aoi = to_shape(aoi)
+    candidates = [
+        (scene, to_shape(scene.dataFootprint)) for scene in scenes
+        if scene.dataFootprint
+    ]
+    footprints = [footprint for _, footprint in candidates]
+    candidates = [
+        candidate for candidate, area in zip(
+            candidates, intersection_areas(footprints, aoi))
+        if area > 0
+    ]
+    if not candidates:
+        return []
+    dates = [_acquisition_date(scene) for scene, _ in candidates]
+    newest = max([date for date in dates if date is not None] or [None])
+    costs = [scene_cost(scene, newest, cloud_weight, age_weight)
+             for scene, _ in candidates]
+
+    chosen = []
+    uncovered = aoi
+    target = aoi.area * (1 - min_coverage)
+    remaining = list(range(len(candidates)))
+    while remaining and uncovered.area > target:
+        gains = intersection_areas(
+            [candidates[i][1] for i in remaining], uncovered)
+        best = max(range(len(remaining)),
+                   key=lambda j: gains[j] / costs[remaining[j]])
+        if gains[best] <= 0:
+            break
+        index = remaining.pop(best)
+        chosen.append(candidates[index][0])
+        uncovered = uncovered.difference(candidates[index][1])
+    return chosen
+
+
+def round_coordinates(coordinates, precision):
+    """Round nested GeoJSON coordinates to some decimal places"""
+    if isinstance(coordinates, (list, tuple)):
+        return [round_coordinates(c, precision) for c in coordinates]
+    return round(coordinates, precision)
+
+
+def _round_geometry(geometry, precision):
+    geometry = dict(geometry)
+    if 'coordinates' in geometry:
+        geometry['coordinates'] = round_coordinates(
+            geometry['coordinates'], precision)
+    if 'geometries' in geometry:
+        geometry['geometries'] = [
+            _round_geometry(part, precision)
+            for part in geometry['geometries']
+        ]
+    return geometry
+
+
+def _count_coordinates(geometry):
+    def count(coordinates):
+        if coordinates and isinstance(coordinates[0], (list, tuple)):
+            return sum(count(c) for c in coordinates)
+        return 1 if coordinates else 0
+    if 'geometries' in geometry:
+        return sum(_count_coordinates(g) for g in geometry['geometries'])
+    return count(geometry.get('coordinates'))
+
+
+def zoom_tolerance(zoom, pixels=0.5):
+    """Get the size in degrees of a fraction of a pixel at a zoom level
+
+    Detail smaller than half a pixel can't be seen in tiles or exports at
+    that zoom, so it is a safe simplification tolerance.
+
+    Args:
+        zoom (int): web map zoom level
+        pixels (float): number of pixels
+
+    Returns:
+        float
+    """
+    return 360. / (TILE_SIZE * 2 ** zoom) * pixels
+
+
+class GeometryReduction(namedtuple('GeometryReduction', [
+        'geometries', 'original_vertices', 'vertices', 'original_bytes',
+        'bytes'])):
+    """How much simplify_geometries shrank some geometries"""
+
+    @property
+    def ratio(self):
+        """Simplified size as a fraction of the original size"""
+        if not self.original_bytes:
+            return 1.
+        return float(self.bytes) / self.original_bytes
+
+    def __str__(self):
+        return (
+            '{} geometries: {} to {} vertices, {} to {} bytes '
+            '({:.0%} smaller)'.format(
+                self.geometries, self.original_vertices, self.vertices,
+                self.original_bytes, self.bytes, 1 - self.ratio))
+
+
+def simplify_geometries(geometries, zoom=None, tolerance=None,
+                        precision=None):
+    """Simplify geometries and round their coordinates to shrink payloads
+
+    Simplification preserves topology, so polygons stay valid. With
+    shapely 2 all geometries are simplified in one vectorized call.
+
+    Args:
+        geometries (list): shapely geometries or GeoJSON-like dicts
+        zoom (int): zoom level to derive the tolerance from, see
+            zoom_tolerance
+        tolerance (float): simplification tolerance in coordinate units,
+            overriding zoom. Geometries aren't simplified without either
+        precision (int): decimal places to round coordinates to, by default
+            ten times finer than the tolerance, or no rounding without one
+
+    Returns:
+        tuple of (list of GeoJSON-like dicts, GeometryReduction)
+    """
+    shapes = [to_shape(geometry) for geometry in geometries]
+    original_vertices = 0
+    original_bytes = 0
+    for geometry in geometries:
+        if not isinstance(geometry, dict):
+            geometry = mapping(to_shape(geometry))
+        original_vertices += _count_coordinates(geometry)
+        original_bytes += len(json.dumps(geometry))
+
+    if tolerance is None and zoom is not None:
+        tolerance = zoom_tolerance(zoom)
+    if tolerance:
+        if np is not None:
+            shapes = list(_simplify(
+                np.asarray(shapes, dtype=object), tolerance,
+                preserve_topology=True))
+        else:
+            shapes = [shape_.simplify(tolerance, preserve_topology=True)
+                      for shape_ in shapes]
+        if precision is None:
+            precision = int(math.ceil(-math.log10(tolerance))) + 1
+
+    simplified = [mapping(shape_) for shape_ in shapes]
+    if precision is not None:
+        simplified = [
+            _round_geometry(geometry, precision) for geometry in simplified]
+    return simplified, GeometryReduction(
+        len(simplified), original_vertices,
+        sum(_count_coordinates(geometry) for geometry in simplified),
+        original_bytes, sum(len(json.dumps(g)) for g in simplified))
+
+
+def simplify_features(features, **kwargs):
+    """Simplify the geometries of GeoJSON features
+
+    Args:
+        features (list of dict): GeoJSON features
+        **kwargs: arguments for simplify_geometries
+
+    Returns:
+        tuple of (list of features with simplified geometries,
+        GeometryReduction)
+    """
+    geometries, reduction = simplify_geometries(
+        [feature['geometry'] for feature in features], **kwargs)
+    return [
+        dict(feature, geometry=geometry)
+        for feature, geometry in zip(features, geometries)
+    ], reduction
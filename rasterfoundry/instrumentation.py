@@ -0,0 +1,444 @@
+"""Request timing and metrics for Raster Foundry API traffic
+
+An Instrumentation collects per-operation latency histograms, status codes,
+byte counts, retries and in-flight counts. It observes HTTP traffic through
+an InstrumentedAdapter mounted on the API's requests session, which bravado
+and the models' raw tile and export requests share, and boto3 traffic
+through botocore's event hooks.
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from botocore.utils import determine_content_length
+from requests.adapters import HTTPAdapter
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+# Same defaults as the Prometheus client libraries, in seconds
+DEFAULT_BUCKETS = (
+    .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., float('inf')
+)
+
+ID_SEGMENT_RE = re.compile(
+    r'^([0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-'
+    r'[0-9a-fA-F]{12}|\d+)$'
+)
+
+
+def operation_name(method, url):
+    """Name an HTTP request by its method and templated path
+
+    Path segments that are UUIDs or integers (ids, tile coordinates) are
+    replaced with {id} so that requests for different objects share metrics.
+
+    Args:
+        method (str): HTTP method of the request
+        url (str): full URL of the request
+
+    Returns:
+        str: e.g. 'GET /api/projects/{id}/scenes/'
+    """
+    path = urlparse(url).path
+    segments = [
+        '{id}' if ID_SEGMENT_RE.match(segment) else segment
+        for segment in path.split('/')
+    ]
+    return '{} {}'.format(method.upper(), '/'.join(segments))
+
+
+class Histogram(object):
+    """A cumulative latency histogram"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def as_dict(self):
+        return {
+            'buckets': dict(zip(self.buckets, self.counts)),
+            'count': self.count,
+            'sum': self.sum
+        }
+
+
+class Instrumentation(object):
+    """Thread-safe collector of per-operation request metrics"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """Instantiate a new Instrumentation
+
+        Args:
+            buckets (tuple of float): upper bounds, in seconds, of the latency
+                histogram buckets. The last bucket should be infinity.
+        """
+        self.buckets = buckets
+        self.span_hooks = []
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discard all recorded metrics"""
+        with self._lock:
+            self.latency = {}
+            self.statuses = {}
+            self.bytes_sent = {}
+            self.bytes_received = {}
+            self.retries = {}
+            self.errors = {}
+            self.in_flight = {}
+
+    def add_span_hook(self, hook):
+        """Register a tracing hook called around every observed request
+
+        The hook is called as hook(name, attributes) and must return a context
+        manager, which is entered for the duration of the request. An
+        OpenTelemetry tracer's start_as_current_span has this signature.
+
+        Args:
+            hook (callable): span factory
+        """
+        self.span_hooks.append(hook)
+
+    def start(self, operation, attributes=None):
+        """Mark the start of a request
+
+        Args:
+            operation (str): name of the operation
+            attributes (dict): attributes passed to span hooks
+
+        Returns:
+            dict: token to pass to finish
+        """
+        spans = [hook(operation, attributes or {}) for hook in self.span_hooks]
+        for span in spans:
+            span.__enter__()
+        with self._lock:
+            self.in_flight[operation] = self.in_flight.get(operation, 0) + 1
+        return {
+            'operation': operation, 'start': time.time(), 'spans': spans
+        }
+
+    def finish(self, token, status=None, bytes_sent=0, bytes_received=0,
+               retries=0, error=None):
+        """Record the outcome of a request started with start
+
+        Args:
+            token (dict): value returned by start
+            status (int): HTTP status code, if a response was received
+            bytes_sent (int): size of the request body
+            bytes_received (int): size of the response body
+            retries (int): number of retries performed by the transport
+            error (Exception): exception raised by the request, if any
+        """
+        operation = token['operation']
+        elapsed = time.time() - token['start']
+        with self._lock:
+            self.in_flight[operation] -= 1
+            if operation not in self.latency:
+                self.latency[operation] = Histogram(self.buckets)
+            self.latency[operation].observe(elapsed)
+            if status is not None:
+                key = (operation, status)
+                self.statuses[key] = self.statuses.get(key, 0) + 1
+            if error is not None:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+            for counter, value in [(self.bytes_sent, bytes_sent),
+                                   (self.bytes_received, bytes_received),
+                                   (self.retries, retries)]:
+                counter[operation] = counter.get(operation, 0) + (value or 0)
+        for span in reversed(token['spans']):
+            if error is not None:
+                span.__exit__(type(error), error, None)
+            else:
+                span.__exit__(None, None, None)
+
+    def add_bytes_received(self, operation, count):
+        """Count response bytes read after a request was recorded
+
+        Streamed response bodies are read after the request finishes, so
+        their bytes are added as they're read.
+
+        Args:
+            operation (str): name of the operation
+            count (int): number of bytes read
+        """
+        with self._lock:
+            self.bytes_received[operation] = (
+                self.bytes_received.get(operation, 0) + count)
+
+    @contextmanager
+    def measure(self, operation, attributes=None):
+        """Time an arbitrary block of code as an operation
+
+        Args:
+            operation (str): name of the operation
+            attributes (dict): attributes passed to span hooks
+        """
+        token = self.start(operation, attributes)
+        try:
+            yield token
+        except Exception as e:
+            self.finish(token, error=e)
+            raise
+        self.finish(token)
+
+    def snapshot(self):
+        """Return all recorded metrics
+
+        Returns:
+            dict: mapping of operation name to its metrics
+        """
+        with self._lock:
+            operations = set(self.latency) | set(self.in_flight)
+            snapshot = {}
+            for operation in operations:
+                histogram = self.latency.get(operation, Histogram(self.buckets))
+                snapshot[operation] = {
+                    'latency': histogram.as_dict(),
+                    'statuses': {
+                        status: count
+                        for (op, status), count in self.statuses.items()
+                        if op == operation
+                    },
+                    'bytes_sent': self.bytes_sent.get(operation, 0),
+                    'bytes_received': self.bytes_received.get(operation, 0),
+                    'retries': self.retries.get(operation, 0),
+                    'errors': self.errors.get(operation, 0),
+                    'in_flight': self.in_flight.get(operation, 0)
+                }
+            return snapshot
+
+    def to_prometheus(self, prefix='rasterfoundry_client'):
+        """Render recorded metrics in the Prometheus text exposition format
+
+        Args:
+            prefix (str): prefix for every metric name
+
+        Returns:
+            str
+        """
+
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+        lines = []
+        snapshot = self.snapshot()
+        lines.append('# TYPE {}_request_seconds histogram'.format(prefix))
+        for operation in sorted(snapshot):
+            latency = snapshot[operation]['latency']
+            for bound in self.buckets:
+                lines.append(
+                    '{}_request_seconds_bucket{{operation="{}",le="{}"}} {}'
+                    .format(prefix, escape(operation),
+                            '+Inf' if bound == float('inf') else bound,
+                            latency['buckets'].get(bound, 0)))
+            lines.append('{}_request_seconds_sum{{operation="{}"}} {}'.format(
+                prefix, escape(operation), latency['sum']))
+            lines.append(
+                '{}_request_seconds_count{{operation="{}"}} {}'.format(
+                    prefix, escape(operation), latency['count']))
+        lines.append('# TYPE {}_responses_total counter'.format(prefix))
+        for operation in sorted(snapshot):
+            statuses = snapshot[operation]['statuses']
+            for status in sorted(statuses):
+                lines.append(
+                    '{}_responses_total{{operation="{}",status="{}"}} {}'
+                    .format(prefix, escape(operation), status,
+                            statuses[status]))
+        for field, metric_type in [('bytes_sent', 'counter'),
+                                   ('bytes_received', 'counter'),
+                                   ('retries', 'counter'),
+                                   ('errors', 'counter'),
+                                   ('in_flight', 'gauge')]:
+            name = '{}_{}{}'.format(
+                prefix, field, '_total' if metric_type == 'counter' else '')
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for operation in sorted(snapshot):
+                lines.append('{}{{operation="{}"}} {}'.format(
+                    name, escape(operation), snapshot[operation][field]))
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """A requests transport adapter that records metrics for each request"""
+
+    def __init__(self, instrumentation, adapter=None, **kwargs):
+        """Instantiate a new InstrumentedAdapter
+
+        Args:
+            instrumentation (Instrumentation): collector to record metrics in
+            adapter (HTTPAdapter): optional adapter to send requests through,
+                so that instrumentation can wrap other custom transports
+            **kwargs: additional arguments for HTTPAdapter
+        """
+        super(InstrumentedAdapter, self).__init__(**kwargs)
+        self.instrumentation = instrumentation
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        operation = operation_name(request.method, request.url)
+        token = self.instrumentation.start(
+            operation, {'http.method': request.method, 'http.url': request.url}
+        )
+        body = request.body
+        bytes_sent = len(body) if isinstance(body, (bytes, str)) else 0
+        bytes_received = 0
+        try:
+            if self.adapter is not None:
+                response = self.adapter.send(request, **kwargs)
+            else:
+                response = super(InstrumentedAdapter, self).send(
+                    request, **kwargs)
+            # Content-Length is missing from chunked responses and counts
+            # compressed bytes, so count the body itself. The session would
+            # read it right after anyway
+            if not kwargs.get('stream'):
+                bytes_received = len(response.content)
+        except Exception as e:
+            self.instrumentation.finish(token, bytes_sent=bytes_sent, error=e)
+            raise
+
+        if kwargs.get('stream'):
+            self._count_stream(response, operation)
+        retries = getattr(response.raw, 'retries', None)
+        history = getattr(retries, 'history', None) or ()
+        self.instrumentation.finish(
+            token,
+            status=response.status_code,
+            bytes_sent=bytes_sent,
+            bytes_received=bytes_received,
+            retries=len(history)
+        )
+        return response
+
+    def _count_stream(self, response, operation):
+        """Count the bytes of a streamed response body as they're read"""
+        iter_content = response.iter_content
+        instrumentation = self.instrumentation
+
+        def counted_iter_content(*args, **kwargs):
+            for chunk in iter_content(*args, **kwargs):
+                instrumentation.add_bytes_received(operation, len(chunk))
+                yield chunk
+
+        response.iter_content = counted_iter_content
+
+    def close(self):
+        if self.adapter is not None:
+            self.adapter.close()
+        super(InstrumentedAdapter, self).close()
+
+
+def instrument_session(session, instrumentation):
+    """Record metrics for all http and https requests made through a session
+
+    Args:
+        session (requests.Session): session to instrument
+        instrumentation (Instrumentation): collector to record metrics in
+    """
+    for prefix in ['http://', 'https://']:
+        session.mount(prefix, InstrumentedAdapter(
+            instrumentation, adapter=session.get_adapter(prefix)))
+
+
+def instrument_boto3_client(client, instrumentation):
+    """Record metrics for all calls made by a boto3 client
+
+    Operations are named after the service and API call, e.g. 's3 PutObject'.
+    A client can be instrumented with several collectors, and instrumenting
+    it with the same collector again doesn't count its calls twice.
+
+    Args:
+        client: boto3 client, e.g. rasterfoundry.aws.s3.s3
+        instrumentation (Instrumentation): collector to record metrics in
+
+    Returns:
+        callable: function that stops recording the client's calls. Clients
+        instrumented more than once with a collector are recorded until every
+        instrumentation is undone
+    """
+    service = client.meta.service_model.service_id.hyphenize()
+    # Calls share a context between hooks, so each collector keeps its token
+    # under its own key
+    token_key = 'rf_instrumentation-{}'.format(id(instrumentation))
+    bytes_sent_key = 'rf_bytes_sent-{}'.format(id(instrumentation))
+
+    def before_call(model, params, context, **kwargs):
+        body = params.get('body')
+        context[token_key] = instrumentation.start(
+            '{} {}'.format(service, model.name), {'rpc.service': service})
+        # Streamed bodies, e.g. PutObject's, are file objects
+        context[bytes_sent_key] = determine_content_length(body) or 0
+
+    def count_stream(body, operation):
+        read = body.read
+
+        def counted_read(*args, **kwargs):
+            chunk = read(*args, **kwargs)
+            instrumentation.add_bytes_received(operation, len(chunk))
+            return chunk
+
+        # iter_chunks, iter_lines and iteration all read through read
+        body.read = counted_read
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        token = context.pop(token_key, None)
+        if token is None:
+            return
+        bytes_received = 0
+        if model.has_streaming_output:
+            body = parsed.get(model.output_shape.serialization.get('payload'))
+            if hasattr(body, 'read'):
+                count_stream(body, token['operation'])
+        else:
+            bytes_received = len(getattr(http_response, 'content', b'') or b'')
+        instrumentation.finish(
+            token,
+            status=getattr(http_response, 'status_code', None),
+            bytes_sent=context.pop(bytes_sent_key, 0),
+            bytes_received=bytes_received,
+            retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        )
+
+    def after_call_error(exception, context, **kwargs):
+        context.pop(bytes_sent_key, None)
+        token = context.pop(token_key, None)
+        if token is not None:
+            instrumentation.finish(token, error=exception)
+
+    # Hooks registered again under the same unique id are counted rather than
+    # added, and stay until unregistered as many times
+    hooks = [('{}.{}'.format(event, service), handler,
+              '{}-{}'.format(token_key, event))
+             for event, handler in [('before-call', before_call),
+                                    ('after-call', after_call),
+                                    ('after-call-error', after_call_error)]]
+    events = client.meta.events
+    for event_name, handler, unique_id in hooks:
+        events.register(event_name, handler, unique_id=unique_id,
+                        unique_id_uses_count=True)
+    uninstrumented = []
+
+    def uninstrument():
+        if uninstrumented:
+            return
+        uninstrumented.append(True)
+        for event_name, _, unique_id in hooks:
+            events.unregister(event_name, unique_id=unique_id,
+                              unique_id_uses_count=True)
+
+    return uninstrument
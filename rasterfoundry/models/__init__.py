@@ -1,6 +1,7 @@
 from .project import Project # NOQA
 from .map_token import MapToken # NOQA
-from .upload import Upload # NOQA
+from .mosaic import Mosaic # NOQA
+from .upload import Upload, UploadMonitor # NOQA
 from .analysis import Analysis # NOQA
 from .export import Export # NOQA
 from .datasource import Datasource # NOQA
@@ -1,11 +1,24 @@
 """An Analysis is a set of operations which take projects as inputs and output raster imagery"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import requests
 
 from .. import NOTEBOOK_SUPPORT
 from .export import Export
 from .project import Project
+from ..algebra import MapAlgebraEvaluator
 from ..decorators import check_notebook
 from ..exceptions import GatewayTimeoutException
+from ..settings import ANALYSIS_INPUTS_DIR
+from ..utils import mkdir_p
+
+try:
+    import rasterio
+except ImportError:
+    rasterio = None
 
 if NOTEBOOK_SUPPORT:
     from ipyleaflet import (
@@ -15,6 +28,51 @@ if NOTEBOOK_SUPPORT:
     )
 
 
+def resolve_projects(api, project_ids, max_workers=8, refresh=False):
+    """Fetch projects concurrently, through the API's project cache
+
+    Projects are cached in api.project_cache, so each is fetched once however
+    many analyses use it, until the cache entry expires.
+
+    Args:
+        api (API): api to fetch projects with
+        project_ids (iterable of str): ids of the projects, which may repeat
+        max_workers (int): maximum number of concurrent requests
+        refresh (bool): whether to fetch projects that are already cached
+            again
+
+    Returns:
+        dict of Project by id
+    """
+    futures = {}
+    executor = None
+    with api.project_cache.lock:
+        misses = []
+        for project_id in set(project_ids):
+            future = None if refresh else api.project_cache.get(project_id)
+            if future is None or (
+                    future.done() and future.exception() is not None):
+                misses.append(project_id)
+            else:
+                futures[project_id] = future
+        if misses:
+            executor = ThreadPoolExecutor(min(max_workers, len(misses)))
+            for project_id in misses:
+                # Caching the future lets concurrent callers wait on the same
+                # request
+                future = executor.submit(
+                    api.client.Imagery.get_projects_projectID(
+                        projectID=project_id).result)
+                api.project_cache.put(project_id, future)
+                futures[project_id] = future
+    if executor is not None:
+        executor.shutdown(wait=False)
+    return {
+        project_id: Project(future.result(), api)
+        for project_id, future in futures.items()
+    }
+
+
 class Analysis(object):
     """A Raster Foundry Analysis"""
 
@@ -33,6 +91,7 @@ class Analysis(object):
         """
         self._analysis = analysis
         self.api = api
+        self._inputs = None
 
         self.name = analysis.name
         self.id = analysis.id
@@ -43,7 +102,7 @@ class Analysis(object):
             scheme=self.api.scheme, host=self.api.tile_host, export_path=export_path
         )
 
-        response = requests.get(
+        response = self.api.http.session.get(
             request_path,
             params={
                 'bbox': bbox,
@@ -140,33 +199,156 @@ class Analysis(object):
 
     def get_inputs(self):
         """Get the input nodes for the analysis"""
-        dag_root = self._analysis.executionParameters
-        nodes = [dag_root]
-        inputs = []
-        while len(nodes) > 0:
-            current = nodes.pop()
-            args = current.get('args')
-            if current.get('type') == 'projectSrc':
-                inputs.append(current)
-            if type(args) == list:
-                for arg in args:
-                    nodes.append(arg)
-        return inputs
-
-    def get_center(self):
-        """Get the center of this analysis's first input's extent"""
+        if self._inputs is None:
+            dag_root = self._analysis.executionParameters
+            nodes = [dag_root]
+            inputs = []
+            while len(nodes) > 0:
+                current = nodes.pop()
+                args = current.get('args')
+                if current.get('type') == 'projectSrc':
+                    inputs.append(current)
+                if type(args) == list:
+                    for arg in args:
+                        nodes.append(arg)
+            self._inputs = inputs
+        return list(self._inputs)
+
+    def get_input_projects(self, max_workers=8, refresh=False):
+        """Get the projects this analysis takes as inputs
+
+        Projects are fetched concurrently and cached in the API's project
+        cache.
+
+        Args:
+            max_workers (int): maximum number of concurrent requests
+            refresh (bool): whether to fetch cached projects again
+
+        Returns:
+            dict of Project by id
+        """
+        return resolve_projects(
+            self.api, [node.get('projId') for node in self.get_inputs()],
+            max_workers=max_workers, refresh=refresh)
+
+    @classmethod
+    def resolve_inputs(cls, analyses, max_workers=8, refresh=False):
+        """Fetch the input projects of many analyses in one batch
+
+        Each distinct project is fetched once, so that get_center and
+        get_input_projects don't make requests afterwards.
+
+        Args:
+            analyses (list of Analysis): analyses to fetch the inputs of
+            max_workers (int): maximum number of concurrent requests
+            refresh (bool): whether to fetch cached projects again
+
+        Returns:
+            dict of Project by id
+        """
+        if not analyses:
+            return {}
+        return resolve_projects(
+            analyses[0].api,
+            [node.get('projId') for analysis in analyses
+             for node in analysis.get_inputs()],
+            max_workers=max_workers, refresh=refresh)
+
+    def download_inputs(self, bbox, zoom=10, directory=ANALYSIS_INPUTS_DIR):
+        """Download the bands this analysis uses for local evaluation
+
+        Each input project is downloaded once as a geotiff without color
+        correction, and kept in directory for later calls with the same bbox
+        and zoom. Reading the geotiffs requires rasterio.
+
+        Args:
+            bbox (str): Bounding box (formatted as 'x1,y1,x2,y2') for the download
+            zoom (int): Zoom level for the download
+            directory (str): directory to keep downloaded geotiffs in
+
+        Returns:
+            tuple of (sources, transform), where sources is a dict of arrays by
+            (project id, band) with NaN for missing data, and transform is the
+            arrays' GDAL geotransform
+        """
+        if rasterio is None:
+            raise ImportError('Reading analysis inputs requires rasterio')
+        bands = {}
+        for node in self.get_inputs():
+            bands.setdefault(node.get('projId'), set()).add(
+                int(node.get('band') or 0))
+
+        area = hashlib.sha1(
+            '{}/{}'.format(bbox, zoom).encode('utf-8')).hexdigest()
+        sources = {}
+        transform = None
+        for project_id, project_bands in bands.items():
+            path = os.path.join(directory, project_id, area + '.tif')
+            if not os.path.exists(path):
+                project = resolve_projects(
+                    self.api, [project_id])[project_id]
+                mkdir_p(os.path.dirname(path))
+                # Write aside and rename so an interrupted download isn't
+                # mistaken for a complete one
+                with open(path + '.part', 'wb') as f:
+                    f.write(project.geotiff(bbox, zoom=zoom, raw=True))
+                os.rename(path + '.part', path)
+            with rasterio.open(path) as dataset:
+                transform = dataset.transform.to_gdal()
+                for band in project_bands:
+                    sources[(project_id, band)] = dataset.read(
+                        band + 1, masked=True
+                    ).astype(np.float64).filled(np.nan)
+        return sources, transform
+
+    def evaluator(self, sources, transform=None, **kwargs):
+        """Get an evaluator of this analysis over local rasters
+
+        Keep the evaluator to evaluate variations of the analysis, since it
+        remembers the results of the operations they have in common.
+
+        Args:
+            sources (dict): arrays by (project id, band), e.g. from
+                download_inputs
+            transform (tuple): GDAL geotransform of the arrays
+            **kwargs: additional arguments for MapAlgebraEvaluator
+
+        Returns:
+            MapAlgebraEvaluator
+        """
+        return MapAlgebraEvaluator(sources, transform=transform, **kwargs)
+
+    def evaluate(self, sources, transform=None, **kwargs):
+        """Evaluate this analysis locally
+
+        Args:
+            sources (dict): arrays by (project id, band), e.g. from
+                download_inputs
+            transform (tuple): GDAL geotransform of the arrays, needed if the
+                analysis masks by geometry
+            **kwargs: additional arguments for MapAlgebraEvaluator
+
+        Returns:
+            numpy.ndarray
+        """
+        return self.evaluator(sources, transform, **kwargs).evaluate(
+            self._analysis.executionParameters)
+
+    def get_center(self, refresh=False):
+        """Get the center of this analysis's first input's extent
+
+        Args:
+            refresh (bool): whether to fetch the input project again even if
+                it is cached
+        """
 
         # get analysis input UUIDS
         inputs = self.get_inputs()
         if len(inputs) > 0:
             # fetch first one from api and use that project's coordinates
-            input = inputs.pop()
-            project = Project(
-                self.api.client.Imagery.get_projects_projectID(
-                    projectID=input.get('projId')
-                ).result(),
-                self.api
-            )
-            return project.get_center()
+            project_id = inputs.pop().get('projId')
+            return resolve_projects(
+                self.api, [project_id], refresh=refresh
+            )[project_id].get_center()
         else:
             raise ValueError('An analysis must have inputs in order to be valid')
@@ -3,10 +3,11 @@
 import logging
 import time
 
-import requests
 from shapely.geometry import mapping, box, MultiPolygon
 from bravado import exception
 
+from ..geometry import simplify_geometries, to_shape
+
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 logger.setLevel('INFO')
@@ -41,7 +42,8 @@ class Export(object):
                 lambda name: name.upper() != 'RFUploadAccessTestFile'.upper(),
                 fnames_res)
             return [
-                'https://{app_host}/api/exports/{export_id}/files/{file_name}'.format(
+                '{scheme}://{app_host}/api/exports/{export_id}/files/{file_name}'.format(
+                    scheme=self.api.scheme,
                     app_host=self.api.app_host,
                     export_id=self.id,
                     file_name=fname) for fname in fnames]
@@ -92,14 +94,17 @@ class Export(object):
                       visibility='PRIVATE',
                       source=None,
                       export_type='S3',
-                      raster_size=4000):
+                      raster_size=4000,
+                      mask=None,
+                      simplify=False):
         """Create an asynchronous export job for a project or analysis
 
         Only one of project_id or analysis_id should be specified
 
         Args:
             api (API): API to use for requests
-            bbox (str): comma-separated bounding box of region to export
+            bbox (str): comma-separated bounding box of region to export, unused
+                if mask is given
             zoom (int): the zoom level for performing the export
             project (Project): the project to export
             analysis (Analysis): the analysis to export
@@ -107,6 +112,9 @@ class Export(object):
             source (str): the destination for the exported files
             export_type (str): one of 'S3', 'LOCAL', or 'DROPBOX'
             raster_size (int): desired tiff size after export, 4000 by default - same as backend
+            mask: geometry or GeoJSON-like dict to export within instead of bbox
+            simplify (bool): whether to simplify the mask to the detail visible
+                at the export's zoom and round its coordinates
 
         Returns:
             An export object
@@ -131,11 +139,16 @@ class Export(object):
                 'organizationId': analysis._analysis.organizationId
             }
 
-        box_poly = MultiPolygon([box(*map(float, bbox.split(',')))])
+        if mask is None:
+            mask = MultiPolygon([box(*map(float, bbox.split(',')))])
+        mask = mapping(to_shape(mask))
+        if simplify:
+            [mask], reduction = simplify_geometries([mask], zoom=zoom)
+            logger.info('Simplified export mask: %s', reduction)
 
         export_create = {
             'exportOptions': {
-                'mask': mapping(box_poly),
+                'mask': mask,
                 'resolution': zoom,
                 'rasterSize': raster_size
             },
@@ -168,6 +181,7 @@ class Export(object):
         Returns:
             a binary file
         """
-        resp = requests.get(self.files[index], params={'token': self.api.api_token})
+        resp = self.api.http.session.get(
+            self.files[index], params={'token': self.api.api_token})
         resp.raise_for_status()
         return resp.content
@@ -0,0 +1,223 @@
+"""A Mosaic is the color correction of all of a project's scenes"""
+import numpy as np
+
+from ..utils import chunked
+
+# Color correction fields, as dotted paths into a ColorCorrection, and the
+# type each is sent as
+FIELDS = [
+    ('redBand', int),
+    ('greenBand', int),
+    ('blueBand', int),
+    ('sigmoidalContrast.enabled', bool),
+    ('sigmoidalContrast.alpha', float),
+    ('sigmoidalContrast.beta', float),
+    ('gamma.enabled', bool),
+    ('gamma.redGamma', float),
+    ('gamma.greenGamma', float),
+    ('gamma.blueGamma', float),
+    ('bandClipping.enabled', bool),
+    ('bandClipping.redMax', int),
+    ('bandClipping.redMin', int),
+    ('bandClipping.greenMax', int),
+    ('bandClipping.greenMin', int),
+    ('bandClipping.blueMax', int),
+    ('bandClipping.blueMin', int),
+    ('tileClipping.enabled', bool),
+    ('tileClipping.min', int),
+    ('tileClipping.max', int),
+    ('saturation.enabled', bool),
+    ('saturation.saturation', float),
+    ('equalize.enabled', bool),
+    ('autoBalance.enabled', bool),
+]
+COLUMNS = [name for name, _ in FIELDS]
+
+
+class Mosaic(object):
+    """Color correction parameters of a project's scenes as a table
+
+    Every scene is a row and every color correction field a column of
+    values, with NaN for fields a scene doesn't set and booleans stored as 0
+    or 1, so edits apply to many scenes at once with numpy. Only scenes whose
+    parameters differ from the ones fetched are sent on save.
+
+    Usage:
+
+        mosaic = project.mosaic()
+        mosaic.set_gamma(1.2, 1.1, 1.0)
+        mosaic['saturation.saturation'] *= 1.1
+        mosaic.set_bands(3, 2, 1, scenes=landsat_scene_ids)
+        mosaic.save()
+    """
+
+    def __repr__(self):
+        return '<Mosaic - {} - {} scenes>'.format(
+            self.project.name, len(self.scene_ids))
+
+    def __init__(self, project, definitions):
+        """Instantiate a new Mosaic
+
+        Args:
+            project (Project): project the scenes belong to
+            definitions (list of dict): mosaic definitions, each with a
+                sceneId and its colorCorrection
+        """
+        self.project = project
+        self.scene_ids = [
+            definition['sceneId'] for definition in definitions]
+        self._rows = {
+            scene_id: row for row, scene_id in enumerate(self.scene_ids)}
+        self.values = np.full((len(definitions), len(FIELDS)), np.nan)
+        for row, definition in enumerate(definitions):
+            correction = definition.get('colorCorrection') or {}
+            for column, name in enumerate(COLUMNS):
+                value = _get_path(correction, name)
+                if value is not None:
+                    self.values[row, column] = float(value)
+        self.saved = self.values.copy()
+
+    @classmethod
+    def fetch(cls, project):
+        """Fetch the color correction of all of a project's scenes at once
+
+        Args:
+            project (Project): project to fetch the mosaic of
+
+        Returns:
+            Mosaic
+        """
+        response = project.api.client.Imagery.get_projects_projectID_mosaic(
+            projectID=project.id).future.result()
+        response.raise_for_status()
+        definitions = response.json()
+        # The spec describes a single definition, the API returns a list
+        if isinstance(definitions, dict):
+            definitions = [definitions]
+        return cls(project, definitions)
+
+    def __len__(self):
+        return len(self.scene_ids)
+
+    def __getitem__(self, name):
+        return self.values[:, COLUMNS.index(name)]
+
+    def __setitem__(self, name, value):
+        self.values[:, COLUMNS.index(name)] = value
+
+    def rows(self, scenes=None):
+        """Get the rows of some scenes
+
+        Args:
+            scenes: scene ids or scenes, a boolean mask over scene_ids, or
+                None for all scenes
+
+        Returns:
+            numpy index of the scenes' rows
+        """
+        if scenes is None:
+            return slice(None)
+        scenes = list(scenes) if not isinstance(scenes, np.ndarray) \
+            else scenes
+        if len(scenes) and isinstance(scenes[0], (bool, np.bool_)):
+            return np.asarray(scenes, dtype=bool)
+        return np.array(
+            [self._rows[getattr(scene, 'id', scene)] for scene in scenes],
+            dtype=int)
+
+    def update(self, fields, scenes=None):
+        """Set fields of some scenes
+
+        Args:
+            fields (dict): values by field name, e.g. 'gamma.redGamma'. A
+                value is a scalar for all of the scenes or an array with one
+                value per scene
+            scenes: scenes to update, see rows. All scenes by default
+        """
+        rows = self.rows(scenes)
+        for name, value in fields.items():
+            self.values[rows, COLUMNS.index(name)] = value
+
+    def set_bands(self, red, green, blue, scenes=None):
+        """Map bands to the red, green and blue channels of some scenes"""
+        self.update(
+            {'redBand': red, 'greenBand': green, 'blueBand': blue}, scenes)
+
+    def set_gamma(self, red, green, blue, scenes=None):
+        """Enable gamma correction of some scenes"""
+        self.update({
+            'gamma.enabled': True,
+            'gamma.redGamma': red,
+            'gamma.greenGamma': green,
+            'gamma.blueGamma': blue,
+        }, scenes)
+
+    def set_sigmoidal_contrast(self, alpha, beta, scenes=None):
+        """Enable sigmoidal contrast of some scenes"""
+        self.update({
+            'sigmoidalContrast.enabled': True,
+            'sigmoidalContrast.alpha': alpha,
+            'sigmoidalContrast.beta': beta,
+        }, scenes)
+
+    def changed(self):
+        """Get a boolean mask of the scenes changed since the last save"""
+        same = (self.values == self.saved) | (
+            np.isnan(self.values) & np.isnan(self.saved))
+        return ~same.all(axis=1)
+
+    def color_correction(self, scene_id):
+        """Get a scene's color correction as sent to the API
+
+        Args:
+            scene_id (str): id of the scene
+
+        Returns:
+            dict
+        """
+        correction = {}
+        for (name, kind), value in zip(
+                FIELDS, self.values[self._rows[scene_id]]):
+            if not np.isnan(value):
+                _set_path(correction, name, kind(value))
+        return correction
+
+    def save(self, chunk_size=1000):
+        """Save the color correction of the scenes that changed
+
+        Args:
+            chunk_size (int): maximum number of scenes to update per request
+
+        Returns:
+            list of str: ids of the updated scenes
+        """
+        changed = [
+            self.scene_ids[row] for row in np.flatnonzero(self.changed())]
+        for scene_ids in chunked(changed, chunk_size):
+            params = [{
+                'sceneId': scene_id,
+                'params': self.color_correction(scene_id),
+            } for scene_id in scene_ids]
+            self.project.api.client.Imagery \
+                .post_projects_projectID_mosaic_bulk_update_color_corrections(
+                    projectID=self.project.id,
+                    combinedSceneCorrectionParameters=params
+                ).future.result().raise_for_status()
+            rows = self.rows(scene_ids)
+            self.saved[rows] = self.values[rows]
+        return changed
+
+
+def _get_path(obj, path):
+    for key in path.split('.'):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+def _set_path(obj, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        obj = obj.setdefault(key, {})
+    obj[keys[-1]] = value
@@ -1,18 +1,34 @@
 """A Project is a collection of zero or more scenes"""
-import copy
+import hashlib
 import json
+import logging
+import os
+import time
 import uuid
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 
 import requests
 
 from .export import Export
 from .map_token import MapToken
+from .mosaic import Mosaic
 from .. import NOTEBOOK_SUPPORT
-from ..aws.s3 import file_to_str, str_to_file
+from ..aws.s3 import file_exists, file_to_chunks, file_to_str, str_to_file
 from ..decorators import check_notebook
-from ..exceptions import GatewayTimeoutException
-from ..utils import get_all_paginated
+from ..exceptions import (
+    GatewayTimeoutException, MissingScenesException,
+    PredictionsTimeoutException
+)
+from ..geometry import (
+    round_coordinates, select_covering_scenes, simplify_features, to_shape
+)
+from ..settings import RV_TEMP_URI
+from ..utils import (
+    balanced_shards, chunked, get_all_paginated, iter_json_array,
+    iter_paginated_json
+)
 
 if NOTEBOOK_SUPPORT:
     from ipyleaflet import (
@@ -21,6 +37,121 @@ if NOTEBOOK_SUPPORT:
         TileLayer,
     )
 
+logger = logging.getLogger(__name__)
+
+
+def merge_predictions(predictions_uris, output_uri):
+    """Combine prediction GeoJSON files into one feature collection
+
+    Args:
+        predictions_uris (list of str): prediction files to combine
+        output_uri (str): where to write the combined predictions
+    """
+    merged = {'type': 'FeatureCollection', 'features': []}
+    for predictions_uri in predictions_uris:
+        predictions = json.loads(file_to_str(predictions_uri))
+        merged['features'].extend(predictions['features'])
+    str_to_file(json.dumps(merged), output_uri)
+
+
+def rv_to_rf_annotation(feature):
+    """Convert a Raster Vision prediction to a Raster Foundry annotation"""
+    properties = feature['properties']
+    return {
+        'type': 'Feature',
+        'geometry': feature['geometry'],
+        'properties': {
+            'label': properties['class_name'],
+            'description': '',
+            'machineGenerated': True,
+            'confidence': properties['score']
+        }
+    }
+
+
+# Annotation properties that sync_annotations updates when they differ
+ANNOTATION_SYNC_PROPERTIES = [
+    'description', 'machineGenerated', 'confidence', 'quality']
+
+
+def annotation_key(feature, precision=7):
+    """Hash the label and geometry of an annotation, which identify it
+
+    Args:
+        feature (dict): Raster Foundry annotation feature
+        precision (int): decimal places coordinates are compared to
+
+    Returns:
+        str
+    """
+    geometry = dict(feature['geometry'])
+    if 'coordinates' in geometry:
+        geometry['coordinates'] = round_coordinates(
+            geometry['coordinates'], precision)
+    key = json.dumps([feature['properties'].get('label'), geometry],
+                     sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _sync_value(value):
+    if isinstance(value, float):
+        return round(value, 6)
+    # The API may return null for properties that were sent empty
+    return None if value == '' else value
+
+
+def _sync_values(feature):
+    """Get the properties of an annotation that sync_annotations compares"""
+    properties = feature['properties']
+    return {name: _sync_value(properties.get(name))
+            for name in ANNOTATION_SYNC_PROPERTIES}
+
+
+def _annotation_matches(local, remote):
+    """Check whether a remote annotation has a local feature's properties
+
+    Only properties the local feature sets to a non-empty value are
+    compared, so values the server fills in, e.g. quality, or that
+    rv_to_rf_annotation leaves empty, e.g. description, don't count as
+    changes.
+    """
+    return all(remote.get(name) == value for name, value in local.items())
+
+
+AnnotationSync = namedtuple(
+    'AnnotationSync', ['added', 'updated', 'deleted', 'unchanged'])
+AnnotationSync.__doc__ = """Changes made to sync a project's annotations
+
+Attributes:
+    added (int): number of annotations created
+    updated (int): number of annotations whose properties were updated
+    deleted (int): number of annotations deleted
+    unchanged (int): number of annotations left as they were
+"""
+
+ImageSource = namedtuple(
+    'ImageSource', ['scene_id', 'source_uri', 'raw_data_bytes'])
+ImageSource.__doc__ = """The parts of a project's image needed to process it
+
+Attributes:
+    scene_id (str): id of the scene the image belongs to
+    source_uri (str): URI of the image's source file
+    raw_data_bytes (int): size of the image's source file, if known
+"""
+
+
+class ShardedPredictJob(namedtuple('ShardedPredictJob', [
+        'job_id', 'manifest_uris', 'shard_predictions_uris',
+        'predictions_uri'])):
+    """A prediction Batch array job with one child per shard of images"""
+
+    def merge(self):
+        """Combine the shards' predictions into predictions_uri
+
+        Call this once the Batch job has succeeded.
+        """
+        merge_predictions(self.shard_predictions_uris, self.predictions_uri)
+
 
 class Project(object):
     """A Raster Foundry project"""
@@ -105,7 +236,7 @@ class Project(object):
             export_path=export_path
         )
 
-        response = requests.get(
+        response = self.api.http.session.get(
             request_path,
             params={
                 'bbox': bbox,
@@ -123,19 +254,22 @@ class Project(object):
         response.raise_for_status()
         return response
 
-    def create_export(self, bbox, zoom=10, raster_size=4000):
+    def create_export(self, bbox, zoom=10, raster_size=4000, **exportOpts):
         """Create an export job for this project
 
         Args:
             bbox (str): Bounding box (formatted as 'x1,y1,x2,y2') for the download
             zoom (int): Zoom level for the download
             raster_size (int): desired tiff size after export, 4000 by default - same as backend
+            exportOpts (dict): Additional parameters to pass to an async export
+                job, e.g. mask and simplify
 
         Returns:
             Export
         """
         return Export.create_export(
-            self.api, bbox=bbox, zoom=zoom, project=self, raster_size=raster_size)
+            self.api, bbox=bbox, zoom=zoom, project=self,
+            raster_size=raster_size, **exportOpts)
 
     def geotiff(self, bbox, zoom=10, raw=False):
         """Download this project as a geotiff
@@ -176,22 +310,206 @@ class Project(object):
             tile_path=tile_path, token=self.api.api_token
         )
 
-    def post_annotations(self, annotations_uri):
+    def post_annotations(self, annotations_uri, simplify_zoom=None):
+        """Post Raster Vision annotations to this project
+
+        Args:
+            annotations_uri (str): GeoJSON file of Raster Vision annotations
+            simplify_zoom (int): if set, simplify the annotations' geometries
+                to the detail visible at this zoom level
+        """
         annotations = json.loads(file_to_str(annotations_uri))
         # Convert RV annotations to RF format.
-        rf_annotations = copy.deepcopy(annotations)
-        for feature in rf_annotations['features']:
-            properties = feature['properties']
-            feature['properties'] = {
-                'label': properties['class_name'],
-                'description': '',
-                'machineGenerated': True,
-                'confidence': properties['score']
-            }
+        features = [rv_to_rf_annotation(feature)
+                    for feature in annotations['features']]
+        if simplify_zoom is not None:
+            features, reduction = simplify_features(
+                features, zoom=simplify_zoom)
+            logger.info('Simplified annotations: %s', reduction)
+        rf_annotations = {
+            'type': 'FeatureCollection',
+            'features': features
+        }
 
         self.api.client.Imagery.post_projects_projectID_annotations(
             projectID=self.id, annotations=rf_annotations).future.result()
 
+    def ingest_predictions(self, predictions_uris, min_confidence=0.,
+                           chunk_size=500, max_workers=4, poll_interval=10,
+                           timeout=None):
+        """Stream Raster Vision predictions into this project's annotations
+
+        Each predictions file is ingested as soon as it exists, e.g. as soon
+        as its shard of a ShardedPredictJob finishes, without waiting for the
+        others or for a merge. Files are parsed incrementally and posted in
+        chunks by a pool of threads that has at most two chunks per thread in
+        flight, so memory use doesn't grow with the number of predictions.
+
+        Args:
+            predictions_uris (list of str): GeoJSON files written by
+                prediction jobs
+            min_confidence (float): minimum score of predictions to keep
+            chunk_size (int): number of annotations per request
+            max_workers (int): number of concurrent requests
+            poll_interval (float): seconds between checks for files that
+                don't exist yet
+            timeout (float): seconds to wait for all files to appear,
+                unlimited by default
+
+        Returns:
+            int: number of annotations posted
+        """
+        if not isinstance(predictions_uris, (list, tuple)):
+            predictions_uris = [predictions_uris]
+        pending = list(predictions_uris)
+        deadline = None if timeout is None else time.time() + timeout
+        in_flight = deque()
+        posted = 0
+
+        def post_chunk(features):
+            # Skip unmarshalling the echoed annotations, as post_annotations
+            # does, but still fail on error responses
+            self.api.client.Imagery.post_projects_projectID_annotations(
+                projectID=self.id,
+                annotations={'type': 'FeatureCollection', 'features': features}
+            ).future.result().raise_for_status()
+            return len(features)
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            while pending:
+                ready = [uri for uri in pending if file_exists(uri)]
+                if not ready:
+                    next_poll = time.time() + poll_interval
+                    if deadline is not None and next_poll > deadline:
+                        raise PredictionsTimeoutException(
+                            'Predictions not written: {}'.format(
+                                ', '.join(pending)))
+                    time.sleep(poll_interval)
+                    continue
+                for uri in ready:
+                    pending.remove(uri)
+                    features = (
+                        rv_to_rf_annotation(feature) for feature in
+                        iter_json_array(file_to_chunks(uri), 'features')
+                        if feature['properties']['score'] >= min_confidence
+                    )
+                    for chunk in chunked(features, chunk_size):
+                        if len(in_flight) >= 2 * max_workers:
+                            posted += in_flight.popleft().result()
+                        in_flight.append(executor.submit(post_chunk, chunk))
+            while in_flight:
+                posted += in_flight.popleft().result()
+        return posted
+
+    def sync_annotations(self, features, delete=True, chunk_size=500,
+                         max_workers=4, page_size=100, precision=7):
+        """Make this project's annotations match some features
+
+        The project's annotations are streamed into an index of hashes of
+        their label and geometry, see annotation_key. Features matching no
+        annotation are added, annotations whose other properties differ from
+        the properties their feature sets are updated and, with delete,
+        annotations matching no feature are deleted. Changes are sent
+        concurrently, with additions posted in chunks, so traffic grows with
+        the size of the change rather than with the number of annotations.
+
+        Args:
+            features (iterable): Raster Foundry annotation features, e.g. from
+                rv_to_rf_annotation
+            delete (bool): whether to delete annotations matching no feature
+            chunk_size (int): number of annotations added per request
+            max_workers (int): number of concurrent requests
+            page_size (int): number of annotations fetched per request
+            precision (int): decimal places coordinates are compared to
+
+        Returns:
+            AnnotationSync
+        """
+        request_path = (
+            '{scheme}://{host}/api/projects/{project}/annotations/'.format(
+                scheme=self.api.scheme, host=self.api.app_host,
+                project=self.id))
+
+        def get_page(page):
+            return self.api.http.session.get(
+                request_path, params={'page': page, 'pageSize': page_size},
+                stream=True)
+
+        existing = {}
+        for annotation in iter_paginated_json(get_page, 'features'):
+            annotation_id = annotation.get('id') or \
+                annotation['properties']['id']
+            existing.setdefault(
+                annotation_key(annotation, precision), []
+            ).append((annotation_id, _sync_values(annotation)))
+
+        additions, updates, unchanged = [], [], 0
+        for feature in features:
+            matches = existing.get(annotation_key(feature, precision))
+            if not matches:
+                additions.append(feature)
+                continue
+            local = {name: value
+                     for name, value in _sync_values(feature).items()
+                     if value is not None}
+            # Prefer an identical annotation among duplicates
+            index = next((i for i, (_, remote) in enumerate(matches)
+                          if _annotation_matches(local, remote)), -1)
+            annotation_id, remote = matches.pop(index)
+            if _annotation_matches(local, remote):
+                unchanged += 1
+            else:
+                updates.append((annotation_id, feature))
+        deletions = [
+            annotation_id for matches in existing.values()
+            for annotation_id, _ in matches
+        ] if delete else []
+
+        imagery = self.api.client.Imagery
+
+        def add(chunk):
+            imagery.post_projects_projectID_annotations(
+                projectID=self.id,
+                annotations={'type': 'FeatureCollection', 'features': chunk}
+            ).future.result().raise_for_status()
+
+        def update(annotation_id, feature):
+            properties = feature['properties']
+            imagery.put_projects_projectID_annotations_annotationID(
+                projectID=self.id, annotationID=annotation_id,
+                annotation={
+                    'id': annotation_id,
+                    'type': 'Feature',
+                    'geometry': feature['geometry'],
+                    'properties': {
+                        name: properties[name]
+                        for name in ['label'] + ANNOTATION_SYNC_PROPERTIES
+                        if name in properties
+                    }
+                }
+            ).future.result().raise_for_status()
+
+        def remove(annotation_id):
+            imagery.delete_projects_projectID_annotations_annotationID(
+                projectID=self.id, annotationID=annotation_id
+            ).future.result().raise_for_status()
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            futures = [
+                executor.submit(add, chunk)
+                for chunk in chunked(additions, chunk_size)
+            ]
+            futures.extend(
+                executor.submit(update, *update_args)
+                for update_args in updates)
+            futures.extend(
+                executor.submit(remove, annotation_id)
+                for annotation_id in deletions)
+            for future in futures:
+                future.result()
+        return AnnotationSync(
+            len(additions), len(updates), len(deletions), unchanged)
+
     def get_annotations(self):
         def get_page(page):
             return self.api.client.Imagery.get_projects_projectID_annotations(
@@ -227,29 +545,198 @@ class Project(object):
         # Need to reverse so that order is from bottom-most to top-most layer.
         return list(reversed(get_all_paginated(get_page)))
 
+    def mosaic(self):
+        """Fetch the color correction of all of this project's scenes
+
+        Returns:
+            Mosaic: an editable table that saves changed scenes in bulk
+        """
+        return Mosaic.fetch(self)
+
+    def add_scenes(self, scene_ids):
+        """Add scenes to this project in one request
+
+        Args:
+            scene_ids (list of str): ids of the scenes to add
+        """
+        self.api.client.Imagery.post_projects_projectID_scenes(
+            projectID=self.id, scenes=list(scene_ids)
+        ).future.result().raise_for_status()
+        self.api.image_sources_cache.pop(self.id)
+
+    def set_scene_order(self, scene_ids):
+        """Set the mosaic order of this project's scenes
+
+        Args:
+            scene_ids (list of str): scene ids from top-most to bottom-most
+                layer, the order API.get_projects_projectID_order lists them in
+        """
+        # The spec doesn't describe this endpoint's body, so bravado can't
+        # send it
+        request_path = '{scheme}://{host}/api/projects/{project}/order'.format(
+            scheme=self.api.scheme, host=self.api.app_host, project=self.id
+        )
+        self.api.http.session.put(
+            request_path, json=list(scene_ids)
+        ).raise_for_status()
+        self.api.image_sources_cache.pop(self.id)
+
+    def add_scenes_covering(self, aoi, cloud_weight=1., age_weight=1.,
+                            min_coverage=0.99, page_size=100, **filters):
+        """Add a few clear, recent scenes that together cover an AOI
+
+        Candidate scenes intersecting the AOI's bounding box are fetched,
+        chosen locally with select_covering_scenes, added in one request and
+        ordered with the best scenes on top of the project's other scenes.
+
+        Args:
+            aoi: shapely geometry or GeoJSON-like dict to cover
+            cloud_weight (float): cost of a fully clouded scene
+            age_weight (float): cost per year older than the newest candidate
+            min_coverage (float): fraction of the AOI to cover
+            page_size (int): number of candidates fetched per request
+            **filters: additional API.get_scenes filters, e.g. datasource or
+                maxCloudCover
+
+        Returns:
+            list of the added scenes, best first
+        """
+        aoi = to_shape(aoi)
+
+        def get_page(page):
+            return self.api.get_scenes(
+                bbox=aoi, page=page, pageSize=page_size, **filters)
+
+        scenes = select_covering_scenes(
+            aoi, get_all_paginated(get_page), cloud_weight=cloud_weight,
+            age_weight=age_weight, min_coverage=min_coverage
+        )
+        if scenes:
+            scene_ids = [scene.id for scene in scenes]
+            self.add_scenes(scene_ids)
+            # The whole order is replaced, so the project's other scenes keep
+            # their order beneath the added ones
+            added = set(scene_ids)
+            self.set_scene_order(scene_ids + [
+                scene_id for scene_id in reversed(self.get_ordered_scene_ids())
+                if scene_id not in added
+            ])
+        return scenes
+
+    def _check_scene_ids(self, scene_ids, scenes):
+        """Check that every ordered scene id is one of the project's scenes"""
+        missing = [scene_id for scene_id in scene_ids if scene_id not in scenes]
+        if missing:
+            raise MissingScenesException(
+                'Project {} orders {} scenes missing from its scene list, '
+                'e.g. {}. Its scenes may have changed while they were read, '
+                'try again'.format(self.id, len(missing), missing[0]),
+                missing)
+        return scene_ids
+
+    def _get_scene_image_sources(self, page_size):
+        request_path = '{scheme}://{host}/api/projects/{project}/scenes/'.format(
+            scheme=self.api.scheme, host=self.api.app_host, project=self.id
+        )
+
+        def get_page(page):
+            return self.api.http.session.get(
+                request_path, params={'page': page, 'pageSize': page_size},
+                stream=True)
+
+        return {
+            scene['id']: [
+                ImageSource(scene['id'], image.get('sourceUri'),
+                            image.get('rawDataBytes'))
+                for image in scene.get('images') or []
+            ]
+            for scene in iter_paginated_json(get_page)
+        }
+
+    def get_image_sources(self, refresh=False, page_size=100):
+        """Return the images of this project sorted by z-index
+
+        The project's scenes and their order are fetched concurrently, and
+        scenes are streamed keeping only what ImageSource needs. Results are
+        kept in the API's image_sources_cache, and reused until the entry
+        expires while the project's scene order, fetched again on each call,
+        is unchanged.
+
+        Args:
+            refresh (bool): whether to fetch the images even if cached
+            page_size (int): number of scenes to fetch per request
+
+        Returns:
+            list of ImageSource
+
+        Raises:
+            MissingScenesException: if the order lists scenes the project's
+                scene list doesn't have
+        """
+        cached = None if refresh else self.api.image_sources_cache.get(self.id)
+        if cached is not None:
+            # Scenes may have been changed by other clients, so the cached
+            # sources are only used if the project still orders the same
+            # scenes. The order lists ids only, so it is cheap to check
+            ordered_scene_ids = self.get_ordered_scene_ids()
+            if ordered_scene_ids == cached[0]:
+                return list(cached[1])
+            scene_sources = self._get_scene_image_sources(page_size)
+        else:
+            with ThreadPoolExecutor(1) as executor:
+                order = executor.submit(self.get_ordered_scene_ids)
+                scene_sources = self._get_scene_image_sources(page_size)
+                ordered_scene_ids = order.result()
+        sources = [
+            source
+            for scene_id in self._check_scene_ids(
+                ordered_scene_ids, scene_sources)
+            for source in scene_sources[scene_id]
+        ]
+        self.api.image_sources_cache.put(
+            self.id, (list(ordered_scene_ids), sources))
+        return list(sources)
+
     def get_image_source_uris(self):
         """Return sourceUris of images for with this project sorted by z-index."""
-        source_uris = []
+        return [source.source_uri for source in self.get_image_sources()]
+
+    def get_images(self):
+        """Return images of this project sorted by z-index."""
+        images = []
 
-        scenes = self.get_scenes()
-        ordered_scene_ids = self.get_ordered_scene_ids()
+        with ThreadPoolExecutor(1) as executor:
+            order = executor.submit(self.get_ordered_scene_ids)
+            scenes = self.get_scenes()
+            ordered_scene_ids = order.result()
 
         id_to_scene = {}
         for scene in scenes:
             id_to_scene[scene.id] = scene
-        sorted_scenes = [id_to_scene[scene_id] for scene_id in ordered_scene_ids]
+        sorted_scenes = [
+            id_to_scene[scene_id] for scene_id in
+            self._check_scene_ids(ordered_scene_ids, id_to_scene)
+        ]
 
         for scene in sorted_scenes:
-            for image in scene.images:
-                source_uris.append(image.sourceUri)
+            images.extend(scene.images)
 
-        return source_uris
+        return images
 
     def start_predict_job(self, rv_batch_client, inference_graph_uri,
                           label_map_uri, predictions_uri,
-                          channel_order=[0, 1, 2]):
+                          channel_order=[0, 1, 2], num_shards=1,
+                          balance_by='count', shards_uri=None):
         """Start a Batch job to perform object detection on this project.
 
+        With num_shards greater than one, the project's images are split into
+        balanced shards whose image lists are written to manifests under
+        shards_uri, and one Batch array job runs a child per shard. Each child
+        reads its manifest with the AWS CLI and writes its own predictions
+        file, so the container command stays short however many images the
+        project has. Once the job succeeds, ShardedPredictJob.merge combines
+        the shards' predictions into predictions_uri.
+
         Args:
             rv_batch_client: instance of RasterVisionBatchClient used to start
                 Batch jobs
@@ -258,20 +745,58 @@ class Project(object):
             label_map_uri (str): file with mapping from class id to display name
             predictions_uri (str): GeoJSON file output by the prediction job
             channel_order (list of int)
+            num_shards (int): number of jobs to split the images between
+            balance_by (str): 'count' to give shards equal numbers of images,
+                or 'size' to give shards equal total image bytes
+            shards_uri (str): S3 prefix for shard manifests and predictions,
+                a new prefix under RV_TEMP_URI by default
         Returns:
-            job_id (str): job_id of job started on Batch
+            job_id (str): job_id of job started on Batch, or a
+                ShardedPredictJob if num_shards is greater than one
         """
-        source_uris = self.get_image_source_uris()
-        source_uris_str = ' '.join(source_uris)
         channel_order = ' '.join([str(channel) for channel in channel_order])
         # Add uuid to job_name because it has to be unique.
         job_name = 'predict_project_{}_{}'.format(self.id, uuid.uuid1())
-        command = 'python -m rv.detection.run predict --channel-order {} {} {} {} {}'.format(  # noqa
-            channel_order, inference_graph_uri, label_map_uri, source_uris_str,
+        command_template = 'python -m rv.detection.run predict --channel-order {} {} {} {} {}'  # noqa
+
+        if num_shards <= 1:
+            source_uris_str = ' '.join(self.get_image_source_uris())
+            command = command_template.format(
+                channel_order, inference_graph_uri, label_map_uri,
+                source_uris_str, predictions_uri)
+            return rv_batch_client.start_raster_vision_job(job_name, command)
+
+        if balance_by not in ('count', 'size'):
+            raise ValueError("balance_by must be 'count' or 'size'")
+        images = self.get_image_sources()
+        weights = None
+        if balance_by == 'size':
+            weights = [image.raw_data_bytes or 1 for image in images]
+        shards = balanced_shards(
+            [image.source_uri for image in images], num_shards, weights)
+
+        shards_uri = shards_uri or os.path.join(
+            RV_TEMP_URI, 'predict', '{}-{}'.format(self.id, uuid.uuid4()))
+        manifest_template = os.path.join(shards_uri, 'shard-{}.txt')
+        shard_predictions_template = os.path.join(
+            shards_uri, 'predictions-{}.json')
+        manifest_uris = []
+        for index, shard in enumerate(shards):
+            manifest_uris.append(manifest_template.format(index))
+            str_to_file('\n'.join(shard), manifest_uris[-1])
+
+        index = '${AWS_BATCH_JOB_ARRAY_INDEX}' if len(shards) > 1 else '0'
+        command = command_template.format(
+            channel_order, inference_graph_uri, label_map_uri,
+            '$(aws s3 cp {} -)'.format(manifest_template.format(index)),
+            shard_predictions_template.format(index))
+        job_id = rv_batch_client.start_raster_vision_array_job(
+            job_name, command, len(shards))
+
+        return ShardedPredictJob(
+            job_id, manifest_uris,
+            [shard_predictions_template.format(i) for i in range(len(shards))],
             predictions_uri)
-        job_id = rv_batch_client.start_raster_vision_job(job_name, command)
-
-        return job_id
 
     @check_notebook
     def add_to(self, leaflet_map):
@@ -0,0 +1,30 @@
+import numpy as np
+
+from tests.mock_server import MockServer
+
+
+def test_mosaic_saves_changed_scenes_in_bulk():
+    with MockServer(sizes={'/projects/{uuid}/mosaic/': 250}) as server:
+        project = server.api().projects[0]
+        mosaic = project.mosaic()
+        assert len(mosaic) == 250
+        assert mosaic.save() == []
+
+        edited = mosaic.scene_ids[:120]
+        mosaic.set_gamma(1.2, 1.1, 1.0, scenes=edited)
+        mask = np.zeros(len(mosaic), dtype=bool)
+        mask[-3:] = True
+        mosaic.set_bands(np.arange(3), 2, 1, scenes=mask)
+        server.reset_log()
+        saved = mosaic.save(chunk_size=100)
+        writes = list(server.requests)
+
+    assert saved == edited + mosaic.scene_ids[-3:]
+    assert len(writes) == 2
+    assert not mosaic.changed().any()
+    correction = mosaic.color_correction(edited[0])
+    assert correction['gamma'] == {
+        'enabled': True, 'redGamma': 1.2, 'greenGamma': 1.1,
+        'blueGamma': 1.0}
+    assert [mosaic.color_correction(scene_id)['redBand']
+            for scene_id in mosaic.scene_ids[-3:]] == [0, 1, 2]
@@ -0,0 +1,172 @@
+import json
+import os
+
+import pytest
+
+from tests.mock_server import MockServer
+
+from ...exceptions import MissingScenesException
+from ...geometry import to_shape
+from ..project import rv_to_rf_annotation
+from ...utils import balanced_shards
+
+
+class FakeBatchClient(object):
+    def __init__(self):
+        self.jobs = []
+
+    def start_raster_vision_array_job(self, job_name, command, size):
+        self.jobs.append((command, size))
+        return 'job-{}'.format(len(self.jobs))
+
+
+def test_balanced_shards_by_weight():
+    shards = balanced_shards(['a', 'b', 'c', 'd', 'e'], 2, [5, 1, 1, 1, 4])
+    assert shards == [['a', 'c'], ['b', 'd', 'e']]
+
+
+def test_sharded_predict_job(tmpdir):
+    batch_client = FakeBatchClient()
+    with MockServer(sizes={'/projects/{uuid}/scenes/': 10}) as server:
+        project = server.api().projects[0]
+        source_uris = project.get_image_source_uris()
+        job = project.start_predict_job(
+            batch_client, 'graph.pb', 'label_map.pbtxt',
+            os.path.join(str(tmpdir), 'predictions.json'), num_shards=3,
+            shards_uri=str(tmpdir))
+
+    command, size = batch_client.jobs[0]
+    assert size == 3
+    assert '${AWS_BATCH_JOB_ARRAY_INDEX}' in command
+    manifests = []
+    for manifest_uri in job.manifest_uris:
+        with open(manifest_uri) as manifest:
+            manifests.append(manifest.read().split('\n'))
+    assert sorted(len(manifest) for manifest in manifests) == [3, 3, 4]
+    assert sorted(sum(manifests, [])) == sorted(source_uris)
+
+    for i, shard_predictions_uri in enumerate(job.shard_predictions_uris):
+        with open(shard_predictions_uri, 'w') as predictions:
+            json.dump({'features': [{'id': i}]}, predictions)
+    job.merge()
+    with open(job.predictions_uri) as predictions:
+        assert len(json.load(predictions)['features']) == 3
+
+
+def test_ingest_predictions(tmpdir):
+    predictions_uris = []
+    for shard in range(2):
+        features = [{
+            'type': 'Feature',
+            'geometry': {'type': 'Polygon', 'coordinates': [
+                [[i, i], [i + 1, i], [i + 1, i + 1], [i, i]]]},
+            'properties': {'class_name': 'car', 'score': i / 100.}
+        } for i in range(100)]
+        predictions_uris.append(
+            os.path.join(str(tmpdir), 'predictions-{}.json'.format(shard)))
+        with open(predictions_uris[-1], 'w') as predictions:
+            json.dump({'type': 'FeatureCollection', 'features': features},
+                      predictions)
+
+    with MockServer() as server:
+        project = server.api().projects[0]
+        server.reset_log()
+        posted = project.ingest_predictions(
+            predictions_uris, min_confidence=0.5, chunk_size=20)
+        posts = [path for method, path in server.requests if method == 'POST']
+
+    assert posted == 100
+    assert len(posts) == 6
+    assert set(posts) == {'/api/projects/{}/annotations/'.format(project.id)}
+
+
+def test_add_scenes_covering():
+    with MockServer(sizes={'/scenes/': 30,
+                           '/projects/{uuid}/scenes/': 5}) as server:
+        api = server.api()
+        project = api.projects[0]
+        # Top-most first, as the order is listed and set
+        existing = list(reversed(project.get_ordered_scene_ids()))
+        scenes = api.get_scenes(pageSize=100).results
+        aoi = to_shape(scenes[0].dataFootprint).union(
+            to_shape(scenes[1].dataFootprint))
+        orders = []
+
+        def record_order(response, **kwargs):
+            if response.request.method == 'PUT':
+                orders.append(json.loads(response.request.body))
+
+        api.http.session.hooks['response'].append(record_order)
+        server.reset_log()
+        chosen = project.add_scenes_covering(aoi, page_size=10)
+        writes = [r for r in server.requests if r[0] != 'GET']
+
+    chosen_ids = [scene.id for scene in chosen]
+    assert set(chosen_ids) >= set([scenes[0].id, scenes[1].id])
+    assert writes == [
+        ('POST', '/api/projects/{}/scenes/'.format(project.id)),
+        ('PUT', '/api/projects/{}/order'.format(project.id)),
+    ]
+    # The project's scenes stay in order beneath the added ones
+    assert len(existing) == 5
+    assert orders == [chosen_ids + [
+        scene_id for scene_id in existing if scene_id not in chosen_ids]]
+
+
+def test_image_sources_are_memoized():
+    with MockServer(sizes={'/projects/{uuid}/scenes/': 250}) as server:
+        project = server.api().projects[0]
+        source_uris = project.get_image_source_uris()
+        image_uris = [image.sourceUri for image in project.get_images()]
+        server.reset_log()
+        assert project.get_image_source_uris() == source_uris
+        cached_requests = list(server.requests)
+        project.add_scenes([])
+        project.get_image_source_uris()
+        refetched_requests = list(server.requests)
+
+        # A changed order, e.g. by another client, isn't served from cache
+        project.get_ordered_scene_ids = lambda: ['not-a-scene']
+        with pytest.raises(MissingScenesException) as e:
+            project.get_image_sources()
+
+    assert len(source_uris) == 250
+    assert source_uris == image_uris
+    # Only the order is fetched again, to check that scenes haven't changed
+    assert cached_requests and all(
+        request == ('GET', '/api/projects/{}/order'.format(project.id))
+        for request in cached_requests)
+    assert len(refetched_requests) > 1
+    assert e.value.scene_ids == ['not-a-scene']
+
+
+def test_sync_annotations():
+    with MockServer(sizes={'/projects/{uuid}/annotations/': 40}) as server:
+        project = server.api().projects[0]
+        features = project.api.http.session.get(
+            '{}/api/projects/{}/annotations/'.format(server.url, project.id),
+            params={'pageSize': 100}).json()['features']
+        deleted = features.pop(), features.pop()
+        features[0]['properties']['confidence'] += 1
+        features[1]['geometry']['coordinates'][0][0][0] += 1e-9
+        # Properties a feature leaves unset or empty aren't compared
+        del features[2]['properties']['quality']
+        features[3]['properties']['description'] = ''
+        features.extend(
+            rv_to_rf_annotation({
+                'geometry': {'type': 'Polygon', 'coordinates': [
+                    [[i, i], [i + 1, i], [i + 1, i + 1], [i, i]]]},
+                'properties': {'class_name': 'car', 'score': 0.9}
+            }) for i in range(3))
+        server.reset_log()
+        result = project.sync_annotations(features)
+        writes = [r for r in server.requests if r[0] != 'GET']
+
+    assert result == (3, 1, 2, 37)
+    annotations_path = '/api/projects/{}/annotations/'.format(project.id)
+    assert sorted(writes) == sorted([
+        ('POST', annotations_path),
+        ('PUT', annotations_path + features[0]['id']),
+        ('DELETE', annotations_path + deleted[0]['id']),
+        ('DELETE', annotations_path + deleted[1]['id']),
+    ])
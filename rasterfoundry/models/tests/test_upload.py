@@ -1,13 +1,17 @@
 import os
 import shutil
 import random
+import uuid
+from argparse import Namespace
 from string import ascii_letters
 
 
 import pytest
 
 
-from ..upload import Upload
+from tests.mock_server import MockServer
+from ..upload import Upload, UploadMonitor
+from ...exceptions import UploadTimeoutException
 
 
 @pytest.fixture
@@ -76,3 +80,171 @@ def test_no_file_globbing(datasource, organization, bogus_bucket,
 
     upload_fnames = [os.path.split(f)[-1] for f in upload_create['files']]
     assert upload_fnames == files
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    moto = pytest.importorskip('moto')
+    import boto3
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    mock = moto.mock_aws() if hasattr(moto, 'mock_aws') else moto.mock_s3()
+    with mock:
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket='foo-bucket')
+        monkeypatch.setattr(Upload, 's3_client', client)
+        yield client
+
+
+def test_skip_existing_uploads(s3_client, tmpdir):
+    paths = []
+    # The last file is large enough to be uploaded in multiple parts
+    for i, size in enumerate([10, 20, 9 * 1024 * 1024]):
+        paths.append(os.path.join(str(tmpdir), '{}.tif'.format(i)))
+        with open(paths[-1], 'wb') as tif:
+            tif.write(os.urandom(size))
+    cache_path = os.path.join(str(tmpdir), 'hashes.json')
+
+    report = Upload.upload_files(paths, 'foo-bucket', 'tifs',
+                                 skip_existing=True, max_workers=3,
+                                 hash_cache=cache_path)
+    assert report.uploaded == paths
+    assert '-' in s3_client.head_object(
+        Bucket='foo-bucket', Key='tifs/2.tif')['ETag']
+
+    with open(paths[0], 'wb') as tif:
+        tif.write(os.urandom(10))
+    report = Upload.upload_files(paths, 'foo-bucket', 'tifs',
+                                 skip_existing=True, max_workers=3,
+                                 hash_cache=cache_path)
+    assert report.uploaded == paths[:1]
+    assert report.skipped == paths[1:]
+    assert report.failed == []
+    assert report.files[0] == 's3://foo-bucket/tifs/0.tif'
+
+
+class Result(object):
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+class FakeImagery(object):
+    """Uploads which advance one status every time all uploads are listed"""
+
+    def __init__(self, lifecycles):
+        self.lifecycles = lifecycles
+        self.polls = 0
+        self.calls = []
+
+    def upload(self, upload_id):
+        lifecycle = self.lifecycles[upload_id]
+        status = lifecycle[min(self.polls, len(lifecycle) - 1)]
+        return Namespace(id=upload_id, uploadStatus=status, uploadType='S3',
+                         metadata={}, files=[])
+
+    def get_uploads(self, uploadStatus, page, pageSize):
+        self.calls.append(('list', uploadStatus))
+        results = [self.upload(upload_id) for upload_id in self.lifecycles]
+        if uploadStatus == 'PROCESSING':
+            self.polls += 1
+        return Result(Namespace(page=page, hasNext=False, results=[
+            upload for upload in results
+            if upload.uploadStatus == uploadStatus]))
+
+    def get_uploads_uploadID(self, uploadID):
+        self.calls.append(('get', uploadID))
+        return Result(self.upload(uploadID))
+
+
+def test_upload_monitor():
+    imagery = FakeImagery({
+        'a': ['UPLOADED', 'PROCESSING', 'COMPLETE'],
+        'b': ['QUEUED', 'PROCESSING', 'PROCESSING', 'FAILED'],
+    })
+    api = Namespace(client=Namespace(Imagery=imagery))
+    changes = []
+    statuses = UploadMonitor(api, ['a', 'b'], max_workers=1).wait(
+        on_change=lambda upload: changes.append(
+            (upload.id, upload.upload_status)),
+        min_delay=0)
+
+    assert statuses == {'a': 'COMPLETE', 'b': 'FAILED'}
+    assert changes == [
+        ('a', 'UPLOADED'), ('b', 'QUEUED'),
+        ('a', 'PROCESSING'), ('b', 'PROCESSING'),
+        ('a', 'COMPLETE'),
+        ('b', 'FAILED'),
+    ]
+    gets = [call for call in imagery.calls if call[0] == 'get']
+    assert gets == [('get', 'a'), ('get', 'b')]
+
+
+def test_create_from_local_files(s3_client, tmpdir):
+    s3_client.create_bucket(Bucket='mock-bucket')
+    paths = []
+    for i, size in enumerate([10, 6 * 1024 * 1024]):
+        paths.append(os.path.join(str(tmpdir), '{}.tif'.format(i)))
+        with open(paths[-1], 'wb') as tif:
+            tif.write(os.urandom(size))
+
+    # Credentials that expire within botocore's refresh window are renewed
+    # before every use
+    with MockServer(credentials_ttl=60) as server:
+        upload = Upload.create_from_local_files(
+            server.api(), str(uuid.uuid4()), str(uuid.uuid4()), paths,
+            multipart_chunksize=5 * 1024 * 1024)
+        requests = server.requests
+
+    prefix = 'user-uploads/{}'.format(upload.id)
+    assert upload.upload_status == 'UPLOADED'
+    assert upload.files == [
+        's3://mock-bucket/{}/{}.tif'.format(prefix, i) for i in range(2)]
+    assert '-2' in s3_client.head_object(
+        Bucket='mock-bucket', Key=prefix + '/1.tif')['ETag']
+    credentials_path = '/api/uploads/{}/credentials/'.format(upload.id)
+    assert requests.count(('GET', credentials_path)) > 1
+    assert requests[-1] == ('PUT', '/api/uploads/{}/'.format(upload.id))
+
+
+def test_import_from_planet_in_chunks():
+    planet_ids = ['planet-{}'.format(i) for i in range(95)]
+    with MockServer(error_rates={500: 0.3}, seed=1) as server:
+        result = Upload.import_from_planet(
+            server.api(), str(uuid.uuid4()), str(uuid.uuid4()), planet_ids,
+            chunk_size=10, max_workers=1, requests_per_second=None,
+            max_retries=10, wait=False)
+        posts = server.requests.count(('POST', '/api/uploads/'))
+
+    assert result.failed == []
+    assert sorted(result.upload_ids) == sorted(planet_ids)
+    assert len(set(result.upload_ids.values())) == 10
+    # Some chunks needed retries
+    assert posts > 10
+
+
+class PlanetImagery(FakeImagery):
+    """Creates the fake uploads in order of their ids"""
+
+    def post_uploads(self, Upload):
+        upload_id = sorted(self.lifecycles)[len(self.calls)]
+        self.calls.append(('post', upload_id))
+        return Result(self.upload(upload_id))
+
+
+def test_import_from_planet_timeout_keeps_pending_uploads():
+    imagery = PlanetImagery({'a': ['COMPLETE'], 'b': ['PROCESSING']})
+    api = Namespace(client=Namespace(Imagery=imagery))
+    planet_ids = ['planet-{}'.format(i) for i in range(20)]
+    with pytest.raises(UploadTimeoutException) as e:
+        Upload.import_from_planet(
+            api, str(uuid.uuid4()), str(uuid.uuid4()), planet_ids,
+            chunk_size=10, max_workers=1, requests_per_second=None,
+            timeout=0, min_delay=1)
+
+    result = e.value.result
+    assert result.upload_ids == {planet_id: 'a' for planet_id in planet_ids[:10]}
+    assert result.pending == {'b': planet_ids[10:]}
+    assert result.failed == []
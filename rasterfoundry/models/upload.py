@@ -1,8 +1,49 @@
 """An Upload is raw data to be transformed into a Scene"""
+from future.standard_library import install_aliases  # noqa
+install_aliases()  # noqa
 import glob
+import logging
 import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+from ..aws.s3 import FileHashCache, refreshable_client
+from ..exceptions import UploadFailedException, UploadTimeoutException
+from ..instrumentation import instrument_boto3_client
+from ..utils import RateLimiter, chunked, get_all_paginated
+
+logger = logging.getLogger(__name__)
+
+PlanetImport = namedtuple('PlanetImport', ['upload_ids', 'failed', 'pending'])
+PlanetImport.__doc__ = """Outcome of importing Planet scenes in chunks
+
+Attributes:
+    upload_ids (dict): id of the upload that imported each Planet id
+    failed (list of str): Planet ids whose chunk failed every attempt
+    pending (dict): Planet ids of each upload still processing when waiting
+        timed out, by upload id
+"""
+
+UPLOAD_ACTIVE_STATUSES = (
+    'CREATED', 'UPLOADING', 'UPLOADED', 'QUEUED', 'PROCESSING')
+UPLOAD_DONE_STATUSES = ('COMPLETE', 'FAILED', 'ABORTED')
+
+UploadReport = namedtuple(
+    'UploadReport', ['files', 'uploaded', 'skipped', 'failed'])
+UploadReport.__doc__ = """Outcome of copying local files to S3
+
+Attributes:
+    files (list of str): S3 URIs of all files, in the order of their paths
+    uploaded (list of str): paths of the files that were uploaded
+    skipped (list of str): paths of the files already present unchanged
+    failed (list of tuple): (path, error message) of files that failed
+"""
 
 
 class Upload(object):
@@ -26,9 +67,35 @@ class Upload(object):
 
         self.id = upload.id
         self.upload_type = upload.uploadType
+        self.upload_status = upload.uploadStatus
         self.metadata = upload.metadata
         self.files = upload.files
 
+    def refresh(self):
+        """Fetch the current state of this upload
+
+        Returns:
+            Upload
+        """
+        return Upload(
+            self.api.client.Imagery.get_uploads_uploadID(
+                uploadID=self.id).result(),
+            self.api)
+
+    def wait_for_completion(self, **kwargs):
+        """Wait until this upload is processed, returning the final upload
+
+        Args:
+            **kwargs: additional arguments for UploadMonitor.iter_changes
+
+        Returns:
+            Upload
+        """
+        monitor = UploadMonitor(self.api, [self])
+        for _ in monitor.iter_changes(**kwargs):
+            pass
+        return monitor.uploads[self.id]
+
     @classmethod
     def upload_create_from_planet(
             cls, datasource, organization, planet_ids,
@@ -65,11 +132,108 @@ class Upload(object):
             projectId=project_id
         )
 
+    @staticmethod
+    def destination(path, dest_bucket, dest_prefix):
+        """Return the S3 key and URI a local file is uploaded to"""
+        fname = os.path.split(path)[-1]
+        key = '/'.join([x for x in [dest_prefix, fname] if x])
+        dest_path = 's3://' + '/'.join(
+            [x for x in [dest_bucket, dest_prefix, fname] if x]
+        )
+        return key, dest_path
+
+    @classmethod
+    def is_uploaded(cls, path, dest_bucket, key, hash_cache=None,
+                    s3_client=None):
+        """Check whether an identical copy of a local file is in S3
+
+        The object's ETag is compared with the local file's MD5, or with its
+        multipart ETag computed with the object's part size. Objects whose
+        ETags aren't MD5-based, e.g. those encrypted with SSE-KMS, never
+        match.
+
+        Args:
+            path (str): local file
+            dest_bucket (str): s3 bucket of the object
+            key (str): s3 key of the object
+            hash_cache (FileHashCache): optional cache of local ETags
+            s3_client: boto3 S3 client to use instead of Upload.s3_client
+
+        Returns:
+            bool
+        """
+        s3_client = s3_client or cls.s3_client
+        try:
+            head = s3_client.head_object(Bucket=dest_bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        if head['ContentLength'] != os.path.getsize(path):
+            return False
+        etag = head['ETag'].strip('"')
+        part_size = None
+        if '-' in etag:
+            part_size = s3_client.head_object(
+                Bucket=dest_bucket, Key=key, PartNumber=1)['ContentLength']
+        hash_cache = hash_cache or FileHashCache()
+        return hash_cache.etag(path, part_size) == etag
+
+    @classmethod
+    def upload_files(cls, paths, dest_bucket, dest_prefix,
+                     skip_existing=False, max_workers=1, hash_cache=None,
+                     s3_client=None, transfer_config=None):
+        """Copy local files to S3, optionally skipping unchanged files
+
+        Args:
+            paths (list of str): local files to upload
+            dest_bucket (str): s3 bucket to upload local files to
+            dest_prefix (str): s3 prefix to upload local files to
+            skip_existing (bool): whether to skip files already present at
+                their destination with the same content
+            max_workers (int): number of files to hash and upload concurrently
+            hash_cache (FileHashCache or str): cache, or path of a cache file,
+                for local ETags so unchanged files aren't rehashed across runs
+            s3_client: boto3 S3 client to use instead of Upload.s3_client
+            transfer_config (boto3.s3.transfer.TransferConfig): multipart
+                thresholds, part size and concurrency for each file
+
+        Returns:
+            UploadReport
+        """
+        s3_client = s3_client or cls.s3_client
+        if not isinstance(hash_cache, FileHashCache):
+            hash_cache = FileHashCache(hash_cache)
+
+        def upload(path):
+            key, _ = cls.destination(path, dest_bucket, dest_prefix)
+            if skip_existing and cls.is_uploaded(
+                    path, dest_bucket, key, hash_cache, s3_client):
+                return 'skipped'
+            s3_client.upload_file(path, dest_bucket, key,
+                                  Config=transfer_config)
+            return 'uploaded'
+
+        report = UploadReport(
+            [cls.destination(path, dest_bucket, dest_prefix)[1]
+             for path in paths], [], [], [])
+        with ThreadPoolExecutor(max_workers) as executor:
+            futures = [executor.submit(upload, path) for path in paths]
+            for path, future in zip(paths, futures):
+                try:
+                    getattr(report, future.result()).append(path)
+                except Exception as e:
+                    logger.exception('Failed to upload %s', path)
+                    report.failed.append((path, str(e)))
+        hash_cache.save()
+        return report
+
     @classmethod
     def upload_create_from_files(
             cls, datasource, organization, paths_to_tifs,
             dest_bucket, dest_prefix, metadata={}, visibility='PRIVATE',
-            project_id=None, dry_run=False
+            project_id=None, dry_run=False, skip_existing=False,
+            max_workers=1, hash_cache=None
     ):
         """Create an Upload from a set of tifs
 
@@ -96,9 +260,18 @@ class Upload(object):
                 should be added to
             dry_run (bool): whether to perform side-effecting actions like
                 uploads to s3
+            skip_existing (bool): whether to skip files already present at
+                their destination with the same content
+            max_workers (int): number of files to hash and upload concurrently
+            hash_cache (FileHashCache or str): cache, or path of a cache file,
+                for local file ETags
 
         Returns:
             dict: splattable object to post to /uploads/
+
+        Raises:
+            UploadFailedException: if any file failed to upload, with the
+                UploadReport as its report attribute
         """
         if isinstance(paths_to_tifs, str):
             paths = glob.glob(paths_to_tifs)
@@ -107,21 +280,22 @@ class Upload(object):
         upload_status = 'UPLOADED'
         file_type = 'GEOTIFF'
 
-        files = []
-        for f in paths:
-            fname = os.path.split(f)[-1]
-            key = '/'.join([x for x in [dest_prefix, fname] if x])
-            dest_path = 's3://' + '/'.join(
-                [x for x in [dest_bucket, dest_prefix, fname] if x]
-            )
-            if not dry_run:
-                with open(f, 'r') as inf:
-                    cls.s3_client.put_object(
-                        Body=inf.read(),
-                        Bucket=dest_bucket,
-                        Key=key
-                    )
-            files.append(dest_path)
+        if dry_run:
+            files = [cls.destination(f, dest_bucket, dest_prefix)[1]
+                     for f in paths]
+        else:
+            report = cls.upload_files(
+                paths, dest_bucket, dest_prefix, skip_existing=skip_existing,
+                max_workers=max_workers, hash_cache=hash_cache)
+            logger.info('Uploaded %s files, skipped %s unchanged files',
+                        len(report.uploaded), len(report.skipped))
+            if report.failed:
+                raise UploadFailedException(
+                    'Failed to upload {} files: {}'.format(
+                        len(report.failed),
+                        ', '.join(path for path, _ in report.failed)),
+                    report)
+            files = report.files
 
         return dict(
             uploadStatus=upload_status,
@@ -149,3 +323,327 @@ class Upload(object):
         """
 
         return api.client.Imagery.post_uploads(Upload=upload_create).result()
+
+    @classmethod
+    def import_from_planet(
+            cls, api, datasource, organization, planet_ids, chunk_size=100,
+            max_workers=4, requests_per_second=5, max_retries=2, wait=True,
+            metadata={}, visibility='PRIVATE', project_id=None, **kwargs
+    ):
+        """Import Planet scenes as many small uploads processed in parallel
+
+        The ids are split into chunks of chunk_size, each imported by its own
+        upload, so the backend can process chunks on separate workers and a
+        failure only affects one chunk. Uploads are created concurrently at
+        a limited rate. Chunks whose upload can't be created, or, with wait,
+        whose upload fails processing, are retried with a new upload.
+
+        Args:
+            api (API): API to use for requests
+            datasource (str): UUID of the datasource the uploads belong to
+            organization (str): UUID of the organization the uploads belong to
+            planet_ids (list[str]): IDs from Planet to import
+            chunk_size (int): number of Planet ids per upload
+            max_workers (int): maximum number of concurrent requests
+            requests_per_second (float): maximum rate of upload creation, or
+                None for no limit
+            max_retries (int): number of times to retry each chunk
+            wait (bool): whether to wait for the uploads to be processed,
+                retrying chunks whose upload failed
+            metadata (dict): Additional information to store with the uploads
+            visibility (str): PUBLIC, PRIVATE, or ORGANIZATION visibility level
+                for the created scenes
+            project_id (str): UUID of the project scenes from these uploads
+                should be added to
+            **kwargs: additional arguments for UploadMonitor.wait
+
+        Returns:
+            PlanetImport
+
+        Raises:
+            UploadTimeoutException: if the uploads weren't processed within
+                the wait's timeout. Its result is the PlanetImport so far,
+                with the uploads still processing as pending, and chunks not
+                yet retried as failed, so that the import can be resumed
+        """
+        chunks = list(chunked(planet_ids, chunk_size))
+        attempts = [0] * len(chunks)
+        rate_limiter = RateLimiter(requests_per_second)
+        result = PlanetImport({}, [], {})
+
+        def create(chunk):
+            rate_limiter.wait()
+            return Upload(cls.create(api, cls.upload_create_from_planet(
+                datasource, organization, chunk, metadata, visibility,
+                project_id)), api)
+
+        def retry_or_fail(index):
+            if attempts[index] <= max_retries:
+                return [index]
+            result.failed.extend(chunks[index])
+            return []
+
+        pending = list(range(len(chunks)))
+        while pending:
+            created = {}
+            retries = []
+            with ThreadPoolExecutor(max_workers) as executor:
+                futures = [(index, executor.submit(create, chunks[index]))
+                           for index in pending]
+                for index, future in futures:
+                    attempts[index] += 1
+                    try:
+                        upload = future.result()
+                    except Exception:
+                        logger.exception('Failed to create Planet upload')
+                        retries.extend(retry_or_fail(index))
+                        continue
+                    created[upload.id] = (index, upload)
+            statuses = {}
+            timed_out = None
+            if wait and created:
+                monitor = UploadMonitor(
+                    api, [upload for _, upload in created.values()],
+                    max_workers=max_workers)
+                try:
+                    statuses = monitor.wait(**kwargs)
+                except UploadTimeoutException as e:
+                    statuses = dict(monitor.statuses)
+                    timed_out = e
+            for upload_id, (index, _) in created.items():
+                status = statuses.get(upload_id, 'COMPLETE')
+                if timed_out is not None and status not in UPLOAD_DONE_STATUSES:
+                    result.pending[upload_id] = list(chunks[index])
+                    continue
+                if status != 'COMPLETE':
+                    logger.warning('Upload %s of Planet chunk %s %s',
+                                   upload_id, index, statuses[upload_id])
+                    retries.extend(retry_or_fail(index))
+                    continue
+                for planet_id in chunks[index]:
+                    result.upload_ids[planet_id] = upload_id
+            if timed_out is not None:
+                for index in sorted(retries):
+                    result.failed.extend(chunks[index])
+                raise UploadTimeoutException(
+                    '{} Planet uploads still processing'.format(
+                        len(result.pending)), result)
+            pending = sorted(retries)
+        return result
+
+    @classmethod
+    def create_from_local_files(
+            cls, api, datasource, organization, paths_to_tifs, metadata={},
+            visibility='PRIVATE', project_id=None, max_workers=4,
+            multipart_chunksize=16 * 1024 * 1024, max_concurrency=4
+    ):
+        """Upload local tifs straight to Raster Foundry for processing
+
+        Files are streamed into Raster Foundry's upload bucket with the
+        upload's temporary credentials, which are renewed as they near
+        expiry, so no bucket of your own or authorize_bucket is needed.
+
+        Args:
+            api (API): API to use for requests
+            datasource (str): UUID of the datasource this upload belongs to
+            organization (str): UUID of the organization this upload belongs to
+            paths_to_tifs (str | str[]): which tifs to upload, as a unix path
+                expansion or a list of files
+            metadata (dict): Additional information to store with this upload.
+            visibility (str): PUBLIC, PRIVATE, or ORGANIZATION visibility level
+                for the created scenes
+            project_id (str): UUID of the project scenes from this upload
+                should be added to
+            max_workers (int): number of files to upload concurrently
+            multipart_chunksize (int): size in bytes of multipart upload parts
+            max_concurrency (int): number of parts of each file to upload
+                concurrently
+
+        Returns:
+            Upload: the upload, marked UPLOADED
+
+        Raises:
+            UploadFailedException: if any file failed to upload, leaving the
+                upload CREATED
+        """
+        if isinstance(paths_to_tifs, str):
+            paths = glob.glob(paths_to_tifs)
+        else:
+            paths = paths_to_tifs
+
+        upload = api.client.Imagery.post_uploads(Upload=dict(
+            uploadStatus='CREATED',
+            files=[],
+            uploadType='LOCAL',
+            fileType='GEOTIFF',
+            datasource=datasource,
+            organizationId=organization,
+            metadata=metadata,
+            visibility=visibility,
+            projectId=project_id
+        )).result()
+
+        bucket_paths = []
+
+        def fetch_credentials():
+            response = api.client.Imagery.get_uploads_uploadID_credentials(
+                uploadID=upload.id).result()
+            bucket_paths.append(response.bucketPath)
+            credentials = response.credentials
+            return {
+                key: getattr(credentials, key) for key in [
+                    'AccessKeyId', 'SecretAccessKey', 'SessionToken',
+                    'Expiration'
+                ]
+            }
+
+        s3_client = refreshable_client('s3', fetch_credentials)
+        if api.instrumentation is not None:
+            instrument_boto3_client(s3_client, api.instrumentation)
+        bucket_path = urlparse(bucket_paths[0])
+        report = cls.upload_files(
+            paths, bucket_path.netloc, bucket_path.path.strip('/'),
+            max_workers=max_workers, s3_client=s3_client,
+            transfer_config=TransferConfig(
+                multipart_threshold=multipart_chunksize,
+                multipart_chunksize=multipart_chunksize,
+                max_concurrency=max_concurrency))
+        if report.failed:
+            raise UploadFailedException(
+                'Failed to upload {} files to upload {}'.format(
+                    len(report.failed), upload.id),
+                report)
+
+        upload.uploadStatus = 'UPLOADED'
+        upload.files = report.files
+        api.client.Imagery.put_uploads_uploadID(
+            uploadID=upload.id, upload=upload._marshal()).result()
+        return Upload(upload, api)
+
+
+class UploadMonitor(object):
+    """Follows the processing of many uploads with a few list queries
+
+    Each poll lists uploads once per active status, concurrently, instead of
+    requesting each upload. Only uploads that have left every active status
+    are then fetched individually, once, to learn their final status.
+    """
+
+    def __init__(self, api, uploads, max_workers=4, page_size=100,
+                 **filters):
+        """Instantiate a new UploadMonitor
+
+        Args:
+            api (API): API to use for requests
+            uploads (list of Upload or str): uploads or upload ids to follow
+            max_workers (int): maximum number of concurrent requests
+            page_size (int): page size of list queries
+            **filters: additional filters for list queries, e.g. datasource,
+                to narrow them to the followed uploads
+        """
+        self.api = api
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.filters = filters
+        self.uploads = {}
+        self.statuses = {}
+        for upload in uploads:
+            if isinstance(upload, Upload):
+                self.uploads[upload.id] = upload
+                self.statuses[upload.id] = upload.upload_status
+            else:
+                self.uploads[upload] = None
+                self.statuses[upload] = None
+
+    @property
+    def pending(self):
+        return [
+            upload_id for upload_id, status in self.statuses.items()
+            if status not in UPLOAD_DONE_STATUSES
+        ]
+
+    def list_uploads(self, status):
+        def get_page(page):
+            return self.api.client.Imagery.get_uploads(
+                uploadStatus=status, page=page, pageSize=self.page_size,
+                **self.filters).result()
+
+        return get_all_paginated(get_page)
+
+    def get_upload(self, upload_id):
+        return self.api.client.Imagery.get_uploads_uploadID(
+            uploadID=upload_id).result()
+
+    def poll(self):
+        """Check the status of all unfinished uploads once
+
+        Returns:
+            list of Upload: uploads whose status changed since the last poll
+        """
+        pending = set(self.pending)
+        found = {}
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for uploads in executor.map(self.list_uploads,
+                                        UPLOAD_ACTIVE_STATUSES):
+                for upload in uploads:
+                    if upload.id in pending:
+                        found[upload.id] = upload
+            missing = [upload_id for upload_id in pending
+                       if upload_id not in found]
+            for upload in executor.map(self.get_upload, missing):
+                found[upload.id] = upload
+
+        changed = []
+        for upload_id, upload in found.items():
+            if upload.uploadStatus != self.statuses[upload_id]:
+                self.statuses[upload_id] = upload.uploadStatus
+                self.uploads[upload_id] = Upload(upload, self.api)
+                changed.append(self.uploads[upload_id])
+        return changed
+
+    def iter_changes(self, min_delay=5, max_delay=60, backoff=2,
+                     timeout=None):
+        """Yield uploads as their status changes, until all are processed
+
+        The delay between polls starts at min_delay, grows by backoff after
+        each poll in which nothing changed, up to max_delay, and resets when
+        uploads change.
+
+        Args:
+            min_delay (float): shortest delay between polls in seconds
+            max_delay (float): longest delay between polls in seconds
+            backoff (float): factor to grow the delay by
+            timeout (float): seconds after which to stop waiting
+
+        Yields:
+            Upload
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        delay = min_delay
+        while self.pending:
+            changed = self.poll()
+            for upload in changed:
+                yield upload
+            if not self.pending:
+                return
+            if deadline is not None and time.time() + delay > deadline:
+                raise UploadTimeoutException(
+                    '{} uploads still processing'.format(len(self.pending)))
+            delay = min_delay if changed else min(delay * backoff, max_delay)
+            time.sleep(delay)
+
+    def wait(self, on_change=None, **kwargs):
+        """Wait for all uploads to be processed
+
+        Args:
+            on_change (callable): optional function called with each Upload
+                whose status changes
+            **kwargs: additional arguments for iter_changes
+
+        Returns:
+            dict: final status of each upload by id
+        """
+        for upload in self.iter_changes(**kwargs):
+            if on_change is not None:
+                on_change(upload)
+        return dict(self.statuses)
@@ -0,0 +1,255 @@
+"""Record and replay Raster Foundry API sessions
+
+A RecordingAdapter captures every request made through an API's session,
+including spec loading, token requests, swagger operations and tile and
+export downloads, into a Cassette. A ReplayAdapter serves a saved Cassette
+back to the client without any network access, either at full speed or with
+the originally recorded response times, so that unmarshalling, pagination
+and model-wrapping overhead can be profiled in isolation.
+
+Usage:
+
+    cassette = Cassette()
+    api = API(refresh_token=token, http_adapter=RecordingAdapter(cassette))
+    ...
+    cassette.save('session.cassette')
+
+    api = API(api_token='replay', http_adapter=ReplayAdapter(
+        Cassette.load('session.cassette'), original_timing=True))
+"""
+import base64
+import gzip
+import io
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+import requests
+from requests.adapters import HTTPAdapter, BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .exceptions import CassetteMissException
+
+try:
+    from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+except ImportError:
+    from urllib import urlencode
+    from urlparse import parse_qsl, urlparse, urlunparse
+
+CASSETTE_VERSION = 1
+
+# Query parameters and response fields holding credentials, never recorded
+SECRET_PARAMS = {'token'}
+SECRET_FIELDS = {'id_token', 'access_token', 'refresh_token'}
+
+
+def request_key(method, url):
+    """Identify a request by its method and URL, ignoring credentials
+
+    Args:
+        method (str): HTTP method
+        url (str): request URL
+
+    Returns:
+        str
+    """
+    parsed = urlparse(url)
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+        if k not in SECRET_PARAMS
+    )
+    url = urlunparse(parsed._replace(query=urlencode(query)))
+    return '{} {}'.format(method.upper(), url)
+
+
+class Cassette(object):
+    """An ordered log of recorded HTTP interactions"""
+
+    def __init__(self, interactions=None):
+        """Instantiate a new Cassette
+
+        Args:
+            interactions (list of dict): previously recorded interactions
+        """
+        self.interactions = interactions or []
+        self._lock = threading.Lock()
+        self._start = None
+
+    def record(self, method, url, request_size, response, elapsed):
+        """Append an interaction
+
+        Args:
+            method (str): HTTP method of the request
+            url (str): URL of the request
+            request_size (int): size of the request body in bytes
+            response (requests.Response): response to the request
+            elapsed (float): seconds between sending the request and
+                receiving the full response
+        """
+        content = response.content
+        content_type = response.headers.get('Content-Type', '')
+        interaction = {
+            'key': request_key(method, url),
+            'status': response.status_code,
+            'reason': response.reason,
+            'content_type': content_type,
+            'elapsed': round(elapsed, 6),
+            'request_size': request_size
+        }
+        try:
+            if 'json' not in content_type:
+                raise ValueError('Not a JSON response')
+            body = json.loads(content.decode('utf-8')) if content else None
+            if isinstance(body, dict):
+                body = {
+                    k: 'REDACTED' if k in SECRET_FIELDS else v
+                    for k, v in body.items()
+                }
+            interaction['json'] = body
+        except ValueError:
+            interaction['content'] = base64.b64encode(content).decode('ascii')
+        now = time.time()
+        with self._lock:
+            if self._start is None:
+                self._start = now - elapsed
+            interaction['offset'] = round(now - elapsed - self._start, 6)
+            self.interactions.append(interaction)
+
+    def body(self, interaction):
+        """Return the recorded response body of an interaction as bytes"""
+        if 'json' in interaction:
+            if interaction['json'] is None:
+                return b''
+            return json.dumps(interaction['json']).encode('utf-8')
+        return base64.b64decode(interaction['content'])
+
+    def save(self, path):
+        """Write this cassette as gzipped JSON lines
+
+        Args:
+            path (str): file to write to
+        """
+        with gzip.open(path, 'wb') as cassette_file:
+            header = {'version': CASSETTE_VERSION}
+            for line in [header] + self.interactions:
+                cassette_file.write(
+                    json.dumps(line, separators=(',', ':')).encode('utf-8'))
+                cassette_file.write(b'\n')
+
+    @classmethod
+    def load(cls, path):
+        """Read a cassette written by save
+
+        Args:
+            path (str): file to read from
+
+        Returns:
+            Cassette
+        """
+        with gzip.open(path, 'rb') as cassette_file:
+            lines = [json.loads(line.decode('utf-8'))
+                     for line in cassette_file if line.strip()]
+        header, interactions = lines[0], lines[1:]
+        if header.get('version') != CASSETTE_VERSION:
+            raise ValueError(
+                'Unsupported cassette version {}'.format(header.get('version')))
+        return cls(interactions)
+
+
+class RecordingAdapter(HTTPAdapter):
+    """A requests transport adapter that records interactions to a Cassette"""
+
+    def __init__(self, cassette, adapter=None, **kwargs):
+        """Instantiate a new RecordingAdapter
+
+        Args:
+            cassette (Cassette): cassette to record interactions to
+            adapter (HTTPAdapter): optional adapter to send requests through
+            **kwargs: additional arguments for HTTPAdapter
+        """
+        super(RecordingAdapter, self).__init__(**kwargs)
+        self.cassette = cassette
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        start = time.time()
+        if self.adapter is not None:
+            response = self.adapter.send(request, **kwargs)
+        else:
+            response = super(RecordingAdapter, self).send(request, **kwargs)
+        # Reading the content here buffers streamed downloads, so that the
+        # recorded time includes the transfer
+        response.content
+        body = request.body
+        self.cassette.record(
+            request.method, request.url,
+            len(body) if isinstance(body, (bytes, str)) else 0,
+            response, time.time() - start)
+        return response
+
+    def close(self):
+        if self.adapter is not None:
+            self.adapter.close()
+        super(RecordingAdapter, self).close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """A requests transport adapter that serves responses from a Cassette"""
+
+    def __init__(self, cassette, original_timing=False, speed=1.):
+        """Instantiate a new ReplayAdapter
+
+        Requests are matched to recorded interactions by method and URL, in
+        the order they were recorded. Credentials in the URL are ignored.
+
+        Args:
+            cassette (Cassette): cassette to serve responses from
+            original_timing (bool): whether to wait for each interaction's
+                recorded response time before responding
+            speed (float): factor to speed up original timings by
+        """
+        super(ReplayAdapter, self).__init__()
+        self.cassette = cassette
+        self.original_timing = original_timing
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._queues = defaultdict(deque)
+        for interaction in cassette.interactions:
+            self._queues[interaction['key']].append(interaction)
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url)
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue:
+                raise CassetteMissException(
+                    'No recorded interaction left for {}'.format(key))
+            # Keep serving the last response for requests repeated more
+            # often than they were recorded, e.g. during benchmarks
+            interaction = queue.popleft() if len(queue) > 1 else queue[0]
+        if self.original_timing:
+            time.sleep(interaction['elapsed'] / self.speed)
+        return self.build_response(request, interaction)
+
+    def build_response(self, request, interaction):
+        content = self.cassette.body(interaction)
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.reason = interaction.get('reason')
+        response.headers = CaseInsensitiveDict({
+            'Content-Type': interaction.get('content_type', ''),
+            'Content-Length': str(len(content))
+        })
+        response.raw = io.BytesIO(content)
+        response._content = content
+        response._content_consumed = True
+        response.encoding = requests.utils.get_encoding_from_headers(
+            response.headers)
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
@@ -0,0 +1,217 @@
+"""Search scenes for many AOIs with few requests
+
+Usage:
+
+    scenes_by_aoi = api.search_scenes(aois, datasource=landsat_id,
+                                      maxCloudCover=20)
+
+Nearby and overlapping AOIs are merged into a few bounding box queries,
+which are paginated concurrently. Scenes returned by more than one query are
+kept once, and each is assigned to the AOIs its footprint intersects.
+"""
+import heapq
+import math
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from shapely.geometry import box
+from shapely.strtree import STRtree
+
+from .geometry import to_shape
+
+# Boxes narrower than this, in degrees, count as this wide when deciding what
+# to merge, so that points and lines can be merged with their neighbors
+MIN_SIZE = 0.01
+
+
+def _box_area(bounds):
+    width = max(bounds[2] - bounds[0], MIN_SIZE)
+    height = max(bounds[3] - bounds[1], MIN_SIZE)
+    return width * height
+
+
+def _merged_bounds(bounds, other):
+    return (min(bounds[0], other[0]), min(bounds[1], other[1]),
+            max(bounds[2], other[2]), max(bounds[3], other[3]))
+
+
+def _query(tree, boxes, geometry):
+    """Get the indices of the boxes in an STRtree intersecting a geometry"""
+    if hasattr(tree, 'geometries'):
+        return tree.query(geometry)
+    # shapely < 2 returns the geometries themselves
+    indices = dict((id(b), index) for index, b in enumerate(boxes))
+    return [indices[id(b)] for b in tree.query(geometry)]
+
+
+def plan_queries(geometries, max_waste=0.5):
+    """Merge the bounding boxes of geometries into fewer boxes
+
+    The two groups whose merged box wastes the least area are merged, until
+    any further merge would make a box more than max_waste larger than the
+    boxes of the geometries in it.
+
+    Only groups near each other can be merged, so candidate pairs are found
+    with a spatial index of the geometries' boxes, queried around each group
+    as it grows, and kept in a heap. This takes time and memory in proportion
+    to the number of nearby pairs, rather than to the square of the number of
+    geometries.
+
+    Args:
+        geometries (list): shapely geometries or GeoJSON-like dicts
+        max_waste (float): area a merged box may cover beyond its geometries'
+            boxes, as a fraction of theirs
+
+    Returns:
+        list of (bounds, indices) tuples, where bounds is a (west, south,
+        east, north) tuple and indices are those of the geometries within
+    """
+    bounds = [tuple(float(b) for b in to_shape(geometry).bounds)
+              for geometry in geometries]
+    if not bounds:
+        return []
+    boxes = [box(*b) for b in bounds]
+    tree = STRtree(boxes)
+    areas = [_box_area(b) for b in bounds]
+    members = [[index] for index in range(len(bounds))]
+    # Each geometry's group, as a union-find forest whose roots hold the
+    # group's bounds, area and a version that changes as it grows
+    parents = list(range(len(bounds)))
+    versions = [0] * len(bounds)
+
+    def root(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    def push_pair(i, j):
+        merged_area = _box_area(_merged_bounds(bounds[i], bounds[j]))
+        cost = merged_area / (areas[i] + areas[j])
+        heapq.heappush(heap, (cost, i, j, versions[i], versions[j]))
+
+    def push_candidates(i):
+        # A group farther away than this from a smaller one would waste more
+        # than max_waste when merged, so it needn't be considered. Pairs are
+        # found from the larger group's side
+        west, south, east, north = bounds[i]
+        pad = (1 + 2 * max_waste) * max(east - west, north - south, MIN_SIZE)
+        nearby = _query(tree, boxes, box(
+            west - pad, south - pad, east + pad, north + pad))
+        for j in set(root(int(index)) for index in nearby):
+            if j != i:
+                push_pair(i, j)
+
+    heap = []
+    for i in range(len(bounds)):
+        push_candidates(i)
+    while heap:
+        cost, i, j, version_i, version_j = heapq.heappop(heap)
+        if cost > 1 + max_waste:
+            break
+        if (i, j, version_i, version_j) != (
+                root(i), root(j), versions[i], versions[j]):
+            # One of the groups has grown since, so consider the groups
+            # they're now part of instead
+            i, j = root(i), root(j)
+            if i != j:
+                push_pair(i, j)
+            continue
+        bounds[i] = _merged_bounds(bounds[i], bounds[j])
+        areas[i] += areas[j]
+        members[i].extend(members[j])
+        parents[j] = i
+        versions[i] += 1
+        push_candidates(i)
+    return [(bounds[i], sorted(members[i]))
+            for i in range(len(bounds)) if root(i) == i]
+
+
+def _footprint(scene):
+    footprint = getattr(scene, 'dataFootprint', None) or getattr(
+        scene, 'tileFootprint', None)
+    return to_shape(footprint) if footprint else None
+
+
+def assign_scenes(geometries, scenes):
+    """Find the geometries each scene's footprint intersects
+
+    Args:
+        geometries (list): shapely geometries
+        scenes (list): scenes to assign
+
+    Returns:
+        list with the list of scenes intersecting each geometry. Scenes
+        without a footprint aren't assigned
+    """
+    assigned = [[] for _ in geometries]
+    footprints = [(scene, _footprint(scene)) for scene in scenes]
+    footprints = [(scene, f) for scene, f in footprints if f is not None]
+    if not geometries or not footprints:
+        return assigned
+    tree = STRtree(geometries)
+    if hasattr(tree, 'geometries'):
+        # shapely 2 tests every footprint against the index at once
+        scene_indices, geometry_indices = tree.query(
+            np.array([f for _, f in footprints], dtype=object),
+            predicate='intersects')
+        for scene_index, geometry_index in sorted(
+                zip(scene_indices, geometry_indices)):
+            assigned[geometry_index].append(footprints[scene_index][0])
+    else:
+        indices = dict((id(geometry), index)
+                       for index, geometry in enumerate(geometries))
+        for scene, footprint in footprints:
+            for geometry in tree.query(footprint):
+                if geometry.intersects(footprint):
+                    assigned[indices[id(geometry)]].append(scene)
+    return assigned
+
+
+def search_scenes(api, geometries, max_waste=0.5, page_size=100,
+                  max_workers=8, **filters):
+    """Find the scenes intersecting each of many geometries
+
+    Args:
+        api (API): API to search with
+        geometries (list): shapely geometries or GeoJSON-like dicts, in
+            lon/lat
+        max_waste (float): area a merged bounding box query may cover beyond
+            its geometries' boxes, as a fraction of theirs
+        page_size (int): number of scenes per request
+        max_workers (int): maximum number of concurrent requests
+        **filters: additional API.get_scenes filters, e.g. datasource or
+            maxCloudCover
+
+    Returns:
+        list with the list of scenes intersecting each geometry, in the order
+        of geometries
+    """
+    geometries = [to_shape(geometry) for geometry in geometries]
+    queries = plan_queries(geometries, max_waste=max_waste)
+
+    def get_page(bounds, page):
+        return api.get_scenes(
+            bbox=bounds, page=page, pageSize=page_size, **filters)
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        first_pages = [executor.submit(get_page, bounds, 0)
+                       for bounds, _ in queries]
+        pages, more_pages = [], []
+        # The first page's count tells how many more pages to request
+        for (bounds, _), future in zip(queries, first_pages):
+            first_page = future.result()
+            pages.append(first_page)
+            num_pages = int(math.ceil(
+                float(first_page.count) / (first_page.pageSize or page_size)))
+            more_pages.extend(
+                executor.submit(get_page, bounds, page)
+                for page in range(1, num_pages))
+        pages.extend(future.result() for future in more_pages)
+
+    scenes = OrderedDict()
+    for page in pages:
+        for scene in page.results:
+            scenes.setdefault(scene.id, scene)
+    return assign_scenes(geometries, list(scenes.values()))
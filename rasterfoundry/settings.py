@@ -1,4 +1,18 @@
+import os
+
 RV_CPU_QUEUE = 'raster-vision-cpu'
 RV_CPU_JOB_DEF = 'raster-vision-cpu'
 RV_TEMP_URI = 's3://raster-vision-lf-dev/detection/rf-generated'
 DEVELOP_BRANCH = 'develop'
+TOKEN_CACHE_PATH = os.getenv(
+    'RF_TOKEN_CACHE_PATH',
+    os.path.join(os.path.expanduser('~'), '.rasterfoundry', 'tokens.json')
+)
+THUMBNAIL_CACHE_DIR = os.getenv(
+    'RF_THUMBNAIL_CACHE_DIR',
+    os.path.join(os.path.expanduser('~'), '.rasterfoundry', 'thumbnails')
+)
+ANALYSIS_INPUTS_DIR = os.getenv(
+    'RF_ANALYSIS_INPUTS_DIR',
+    os.path.join(os.path.expanduser('~'), '.rasterfoundry', 'analysis-inputs')
+)
@@ -0,0 +1,226 @@
+"""Fetch scene thumbnails concurrently through an on-disk cache
+
+Usage:
+
+    for scene, thumbnail in fetch_thumbnails(api, api.get_scenes().results):
+        ...
+
+Thumbnails are yielded as soon as each one is available, cached ones first
+in practice, so a grid can be filled in while the rest download.
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .settings import THUMBNAIL_CACHE_DIR
+from .utils import mkdir_p
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+
+class ThumbnailCache(object):
+    """A size-bounded, content-addressed disk cache of thumbnails
+
+    Thumbnails are stored once per distinct content, under the SHA-256 of
+    their bytes, with an index from URL to content hash. Reading a thumbnail
+    touches its file, and when the cache grows past max_bytes the least
+    recently used files are evicted.
+    """
+
+    def __init__(self, directory=THUMBNAIL_CACHE_DIR,
+                 max_bytes=512 * 1024 * 1024):
+        """Instantiate a new ThumbnailCache
+
+        Args:
+            directory (str): directory to store thumbnails in
+            max_bytes (int): total size of thumbnails to keep
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.json')
+        self._lock = threading.Lock()
+        mkdir_p(os.path.join(directory, 'blobs'))
+        try:
+            with open(self.index_path) as index_file:
+                self.index = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            self.index = {}
+        self.size = sum(
+            os.path.getsize(self.blob_path(digest))
+            for digest in set(self.index.values())
+            if os.path.isfile(self.blob_path(digest))
+        )
+
+    def blob_path(self, digest):
+        return os.path.join(self.directory, 'blobs', digest)
+
+    def get(self, url):
+        """Get a cached thumbnail
+
+        Args:
+            url (str): URL the thumbnail was fetched from
+
+        Returns:
+            bytes, or None if it isn't cached
+        """
+        with self._lock:
+            digest = self.index.get(url)
+        if digest is None:
+            return None
+        try:
+            with open(self.blob_path(digest), 'rb') as blob:
+                content = blob.read()
+            os.utime(self.blob_path(digest), None)
+            return content
+        except (IOError, OSError):
+            return None
+
+    def put(self, url, content):
+        """Cache a thumbnail
+
+        Args:
+            url (str): URL the thumbnail was fetched from
+            content (bytes): the thumbnail
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self.blob_path(digest)
+        with self._lock:
+            self.index[url] = digest
+            if os.path.isfile(path):
+                os.utime(path, None)
+                return
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.join(self.directory, 'blobs'))
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(content)
+            os.rename(tmp_path, path)
+            self.size += len(content)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        blobs = []
+        for digest in set(self.index.values()):
+            try:
+                stat = os.stat(self.blob_path(digest))
+            except OSError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, digest))
+        evicted = set()
+        # Evict down to 90% so that every put doesn't evict
+        for _, size, digest in sorted(blobs):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            os.remove(self.blob_path(digest))
+            self.size -= size
+            evicted.add(digest)
+        self.index = {
+            url: digest for url, digest in self.index.items()
+            if digest not in evicted
+        }
+
+    def save(self):
+        """Write the cache's index to disk"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'w') as tmp_file:
+            with self._lock:
+                json.dump(self.index, tmp_file)
+        os.rename(tmp_path, self.index_path)
+
+
+def is_api_url(api, url):
+    """Check whether a URL points at the API's own app or tile host
+
+    Only such URLs may be sent the API token.
+    """
+    parsed = urlparse(url)
+    return parsed.scheme == api.scheme and parsed.netloc in (
+        api.app_host, api.tile_host)
+
+
+def fetch_thumbnails(api, scenes, size='SMALL', max_workers=16, cache=None,
+                     decode=None, session=None):
+    """Fetch the thumbnails of many scenes concurrently
+
+    Args:
+        api (API): API to look up thumbnails with
+        scenes (list): scenes, e.g. from API.get_scenes or
+            Project.get_scenes, or scene ids. Scenes that include their
+            thumbnails don't need to be looked up
+        size (str): SMALL, LARGE or SQUARE
+        max_workers (int): maximum number of concurrent requests
+        cache (ThumbnailCache): cache to use, one in THUMBNAIL_CACHE_DIR by
+            default
+        decode (bool): whether to decode thumbnails into PIL images, by
+            default if Pillow is installed
+        session (requests.Session): session for thumbnail requests, by
+            default a new one with a connection pool of max_workers
+
+    Yields:
+        tuple of (scene, thumbnail): the scene as passed in and its thumbnail
+        as a PIL image or bytes, or None if it has no thumbnail of that size,
+        in the order they become available
+    """
+    if decode is None:
+        decode = Image is not None
+    elif decode and Image is None:
+        raise ImportError('Decoding thumbnails requires Pillow')
+    cache = cache or ThumbnailCache()
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers,
+                              pool_maxsize=max_workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def resolve(scene):
+        thumbnails = getattr(scene, 'thumbnails', None)
+        if thumbnails is None:
+            thumbnails = api.client.Imagery.get_thumbnails(
+                sceneId=getattr(scene, 'id', scene)).result().results
+        for thumbnail in thumbnails:
+            if thumbnail.thumbnailSize == size:
+                return thumbnail.url
+
+    def fetch(scene):
+        url = resolve(scene)
+        if url is None:
+            return scene, None
+        content = cache.get(url)
+        if content is None:
+            # Thumbnails served by Raster Foundry itself need the API token
+            params = {'token': api.api_token} if is_api_url(api, url) else {}
+            response = session.get(url, params=params)
+            response.raise_for_status()
+            content = response.content
+            cache.put(url, content)
+        if decode:
+            return scene, Image.open(io.BytesIO(content))
+        return scene, content
+
+    executor = ThreadPoolExecutor(max_workers)
+    futures = [executor.submit(fetch, scene) for scene in scenes]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Don't fetch the rest if the caller stops early
+        for future in futures:
+            future.cancel()
+        executor.shutdown()
+        cache.save()
@@ -0,0 +1,313 @@
+"""Seed the tiles of a project or analysis for an AOI into an MBTiles file
+
+Usage:
+
+    report = seed_tiles(project, aoi, range(10, 17), out='field.mbtiles',
+                        max_workers=16, requests_per_second=50)
+
+Tiles are fetched concurrently and written in batched transactions. Tiles
+already in the file, including those recorded as empty, are skipped, so an
+interrupted seed picks up where it stopped when run again.
+"""
+import logging
+import math
+import sqlite3
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from shapely.geometry import box
+from shapely.prepared import prep
+from urllib3.util.retry import Retry
+
+from .geometry import to_shape
+from .utils import RateLimiter
+
+try:
+    # shapely 2 tests a whole row of tiles against the geometry at once
+    import numpy as np
+    from shapely import (
+        box as _boxes, intersects as _intersects, prepare as _prepare
+    )
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Latitudes beyond this aren't covered by web mercator tiles
+MAX_LATITUDE = 85.0511287798066
+
+SeedReport = namedtuple(
+    'SeedReport', ['fetched', 'skipped', 'empty', 'failed'])
+SeedReport.__doc__ = """Outcome of seeding tiles
+
+Attributes:
+    fetched (int): number of tiles fetched and written
+    skipped (int): number of tiles already in the file or recorded as empty
+    empty (int): number of tiles the tile server had no content for
+    failed (list): (z, x, y) of tiles that couldn't be fetched
+"""
+
+
+def tile_xy(lon, lat, zoom):
+    """Get the x and y of the tile containing a point
+
+    Args:
+        lon (float): longitude
+        lat (float): latitude
+        zoom (int): zoom level
+
+    Returns:
+        tuple of (x, y)
+    """
+    n = 2 ** zoom
+    lat = math.radians(max(min(lat, MAX_LATITUDE), -MAX_LATITUDE))
+    x = int((lon + 180.) / 360. * n)
+    mercator_y = math.log(math.tan(lat) + 1. / math.cos(lat)) / math.pi
+    y = int((1. - mercator_y) / 2. * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_latitude(y, zoom):
+    """Get the latitude of the north edge of a row of tiles"""
+    return math.degrees(
+        math.atan(math.sinh(math.pi * (1 - 2. * y / 2 ** zoom))))
+
+
+def tiles_covering(geometry, zoom):
+    """Enumerate the tiles intersecting a geometry at a zoom level
+
+    Args:
+        geometry: shapely geometry or GeoJSON-like dict, in lon/lat
+        zoom (int): zoom level
+
+    Yields:
+        tuples of (z, x, y)
+    """
+    geometry = to_shape(geometry)
+    west, south, east, north = geometry.bounds
+    x0, y0 = tile_xy(west, north, zoom)
+    x1, y1 = tile_xy(east, south, zoom)
+    n = 2. ** zoom
+    if np is not None:
+        _prepare(geometry)
+        xs = np.arange(x0, x1 + 1)
+        wests, easts = xs / n * 360 - 180, (xs + 1) / n * 360 - 180
+    else:
+        prepared = prep(geometry)
+    for y in range(y0, y1 + 1):
+        row_north, row_south = tile_latitude(y, zoom), tile_latitude(
+            y + 1, zoom)
+        if np is not None:
+            hits = xs[_intersects(
+                _boxes(wests, row_south, easts, row_north), geometry)]
+        else:
+            hits = [
+                x for x in range(x0, x1 + 1) if prepared.intersects(box(
+                    x / n * 360 - 180, row_south,
+                    (x + 1) / n * 360 - 180, row_north))
+            ]
+        for x in hits:
+            yield zoom, int(x), y
+
+
+class MBTiles(object):
+    """A minimal MBTiles file writer
+
+    MBTiles numbers rows from the south, so y is flipped on the way in and
+    out. Tiles the tile server had no content for are recorded in a separate
+    empty_tiles table, so that they aren't requested again. The connection
+    belongs to the thread that opened the file.
+    """
+
+    def __init__(self, path):
+        """Open or create an MBTiles file
+
+        Args:
+            path (str): path of the file
+        """
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)')
+            self.connection.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS metadata_name '
+                'ON metadata (name)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, '
+                'tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+            self.connection.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS tile_index '
+                'ON tiles (zoom_level, tile_column, tile_row)')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS empty_tiles (zoom_level INTEGER, '
+                'tile_column INTEGER, tile_row INTEGER)')
+            self.connection.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS empty_tile_index '
+                'ON empty_tiles (zoom_level, tile_column, tile_row)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def set_metadata(self, metadata):
+        """Set metadata such as name, format, bounds, minzoom and maxzoom"""
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)',
+                [(name, str(value)) for name, value in metadata.items()])
+
+    def existing(self, zoom, include_empty=True):
+        """Get the x and y of the tiles already seeded at a zoom level
+
+        Args:
+            zoom (int): zoom level
+            include_empty (bool): whether to include tiles recorded as empty
+        """
+        flip = 2 ** zoom - 1
+        tables = ['tiles', 'empty_tiles'] if include_empty else ['tiles']
+        return set(
+            (column, flip - row)
+            for table in tables
+            for column, row in self.connection.execute(
+                'SELECT tile_column, tile_row FROM {} '
+                'WHERE zoom_level = ?'.format(table), (zoom,)))
+
+    def write(self, tiles, empty=()):
+        """Write tiles in one transaction
+
+        Args:
+            tiles (list): tuples of (z, x, y, bytes)
+            empty (list): tuples of (z, x, y) of tiles without content
+        """
+        with self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO tiles '
+                '(zoom_level, tile_column, tile_row, tile_data) '
+                'VALUES (?, ?, ?, ?)',
+                [(z, x, 2 ** z - 1 - y, sqlite3.Binary(data))
+                 for z, x, y, data in tiles])
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO empty_tiles '
+                '(zoom_level, tile_column, tile_row) VALUES (?, ?, ?)',
+                [(z, x, 2 ** z - 1 - y) for z, x, y in empty])
+
+    def read(self, z, x, y):
+        """Read a tile, or None if it isn't in the file"""
+        row = self.connection.execute(
+            'SELECT tile_data FROM tiles WHERE zoom_level = ? AND '
+            'tile_column = ? AND tile_row = ?',
+            (z, x, 2 ** z - 1 - y)).fetchone()
+        return bytes(row[0]) if row else None
+
+    def close(self):
+        self.connection.close()
+
+
+def _tile_url_template(target):
+    if hasattr(target, 'tms'):
+        target = target.tms()
+    return target.replace('{z}', '{0}').replace('{x}', '{1}').replace(
+        '{y}', '{2}')
+
+
+def seed_tiles(target, geometry, zooms, out='tiles.mbtiles', max_workers=8,
+               requests_per_second=None, max_retries=3, batch_size=500,
+               session=None, timeout=60):
+    """Fetch every tile of a project or analysis covering a geometry
+
+    Args:
+        target: Project or Analysis, or a tile URL template with {z}, {x} and
+            {y}, e.g. from Project.tms
+        geometry: shapely geometry or GeoJSON-like dict, in lon/lat
+        zooms (iterable of int): zoom levels to seed
+        out (str): MBTiles file to write tiles to
+        max_workers (int): maximum number of concurrent requests
+        requests_per_second (float): maximum request rate, unlimited by
+            default
+        max_retries (int): number of times to retry a tile after connection
+            errors, 429s and 5xx responses, with exponential backoff
+        batch_size (int): number of tiles written per transaction
+        session (requests.Session): session for tile requests, by default a
+            new one with a connection pool of max_workers and retries
+        timeout (float): seconds to wait for each tile server response
+
+    Returns:
+        SeedReport
+    """
+    url_template = _tile_url_template(target)
+    geometry = to_shape(geometry)
+    zooms = sorted(zooms)
+    rate_limiter = RateLimiter(requests_per_second)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=max_workers, pool_maxsize=max_workers,
+            max_retries=Retry(
+                total=max_retries, backoff_factor=0.5,
+                status_forcelist=[429, 500, 502, 503, 504]))
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def fetch(tile):
+        rate_limiter.wait()
+        try:
+            response = session.get(url_template.format(*tile),
+                                   timeout=timeout)
+            if response.status_code in (204, 404):
+                return tile, b''
+            response.raise_for_status()
+            return tile, response.content
+        except requests.RequestException:
+            logger.exception('Failed to fetch tile %s/%s/%s', *tile)
+            return tile, None
+
+    counts = {'fetched': 0, 'skipped': 0, 'empty': 0}
+    failed = []
+    with MBTiles(out) as mbtiles:
+        mbtiles.set_metadata({
+            'name': url_template.split('?')[0],
+            'format': 'png',
+            'type': 'overlay',
+            'bounds': ','.join(str(b) for b in geometry.bounds),
+            'minzoom': zooms[0],
+            'maxzoom': zooms[-1],
+        })
+        batch, empty_batch = [], []
+
+        def collect(future):
+            # Runs on this thread, which owns the sqlite connection
+            tile, data = future.result()
+            if data is None:
+                failed.append(tile)
+            elif not data:
+                counts['empty'] += 1
+                empty_batch.append(tile)
+            else:
+                counts['fetched'] += 1
+                batch.append(tile + (data,))
+            if len(batch) + len(empty_batch) >= batch_size:
+                mbtiles.write(batch, empty_batch)
+                del batch[:]
+                del empty_batch[:]
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            in_flight = deque()
+            for zoom in zooms:
+                existing = mbtiles.existing(zoom)
+                for tile in tiles_covering(geometry, zoom):
+                    if tile[1:] in existing:
+                        counts['skipped'] += 1
+                        continue
+                    if len(in_flight) >= 2 * max_workers:
+                        collect(in_flight.popleft())
+                    in_flight.append(executor.submit(fetch, tile))
+            while in_flight:
+                collect(in_flight.popleft())
+        mbtiles.write(batch, empty_batch)
+    return SeedReport(
+        counts['fetched'], counts['skipped'], counts['empty'], failed)
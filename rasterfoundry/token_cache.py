@@ -0,0 +1,223 @@
+"""Share API tokens between processes and refresh them before they expire"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from .settings import TOKEN_CACHE_PATH
+from .utils import mkdir_p
+
+logger = logging.getLogger(__name__)
+
+# Lifetime assumed for tokens whose expiry can't be determined
+DEFAULT_TOKEN_TTL = 3600
+
+
+def token_expiry(token, default_ttl=DEFAULT_TOKEN_TTL):
+    """Get the expiry time of an API token from its JWT exp claim
+
+    Args:
+        token (str): API token
+        default_ttl (int): seconds from now the token is assumed to expire in
+            if it isn't a JWT with an exp claim
+
+    Returns:
+        float: expiry time as seconds since the epoch
+    """
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload.encode('ascii')).decode('utf-8'))
+        return float(claims['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return time.time() + default_ttl
+
+
+class TokenCache(object):
+    """An on-disk cache of API tokens keyed by a hash of their refresh token
+
+    The cache file is locked while it is read and written, so any number of
+    processes on a machine can share it. Refresh tokens themselves are never
+    written to disk.
+    """
+
+    def __init__(self, path=TOKEN_CACHE_PATH):
+        """Instantiate a new TokenCache
+
+        Args:
+            path (str): file to store cached tokens in
+        """
+        self.path = path
+        self.lock_path = path + '.lock'
+        self._thread_lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks can't be pickled, e.g. to send the cache to worker processes
+        state = dict(self.__dict__)
+        del state['_thread_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._thread_lock = threading.Lock()
+
+    @staticmethod
+    def key(refresh_token):
+        return hashlib.sha256(refresh_token.encode('utf-8')).hexdigest()
+
+    @contextmanager
+    def locked(self):
+        """Hold an exclusive lock on the cache file"""
+        mkdir_p(os.path.dirname(os.path.abspath(self.path)))
+        with self._thread_lock:
+            with open(self.lock_path, 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            with open(self.path) as cache_file:
+                return json.load(cache_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, entries):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as tmp_file:
+            json.dump(entries, tmp_file)
+        os.chmod(tmp_path, 0o600)
+        os.rename(tmp_path, self.path)
+
+    def get(self, refresh_token, min_ttl=0):
+        """Get a cached API token
+
+        Args:
+            refresh_token (str): refresh token the API token was obtained with
+            min_ttl (int): seconds the token must still be valid for
+
+        Returns:
+            tuple of (str, float): the token and its expiry time, or None
+        """
+        with self.locked():
+            return self._valid(self._read(), refresh_token, min_ttl)
+
+    def _valid(self, entries, refresh_token, min_ttl):
+        entry = entries.get(self.key(refresh_token))
+        if entry and entry['expires_at'] - time.time() > min_ttl:
+            return entry['token'], entry['expires_at']
+
+    def put(self, refresh_token, token, expires_at):
+        """Cache an API token
+
+        Args:
+            refresh_token (str): refresh token the API token was obtained with
+            token (str): API token
+            expires_at (float): expiry time as seconds since the epoch
+        """
+        with self.locked():
+            self._put(self._read(), refresh_token, token, expires_at)
+
+    def _put(self, entries, refresh_token, token, expires_at):
+        now = time.time()
+        entries = {k: v for k, v in entries.items() if v['expires_at'] > now}
+        entries[self.key(refresh_token)] = {
+            'token': token, 'expires_at': expires_at}
+        self._write(entries)
+
+    def get_or_fetch(self, refresh_token, fetch, min_ttl=0):
+        """Get a cached API token, fetching and caching a new one if needed
+
+        The cache stays locked while fetching, so concurrent callers wait for
+        one token request instead of each making their own.
+
+        Args:
+            refresh_token (str): refresh token to obtain an API token with
+            fetch (callable): function of the refresh token returning a tuple
+                of (token, expiry time)
+            min_ttl (int): seconds a cached token must still be valid for
+
+        Returns:
+            tuple of (str, float): the token and its expiry time
+        """
+        with self.locked():
+            entries = self._read()
+            cached = self._valid(entries, refresh_token, min_ttl)
+            if cached:
+                return cached
+            token, expires_at = fetch(refresh_token)
+            self._put(entries, refresh_token, token, expires_at)
+            return token, expires_at
+
+
+class TokenRefresher(object):
+    """Refreshes an API's token in a background thread before it expires
+
+    The thread holds the API weakly, and exits once the API is stopped with
+    API.close or garbage collected.
+    """
+
+    def __init__(self, api, refresh_token, expires_at, margin=300,
+                 retry_delay=30):
+        """Instantiate a new TokenRefresher
+
+        Args:
+            api (API): API whose token to keep fresh
+            refresh_token (str): refresh token to obtain new API tokens with
+            expires_at (float): expiry time of the API's current token
+            margin (int): seconds before expiry to refresh the token
+            retry_delay (int): seconds to wait after a failed refresh
+        """
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at
+        self.margin = margin
+        self.retry_delay = retry_delay
+        self._stopped = threading.Event()
+        self._api = weakref.ref(api, lambda _: self._stopped.set())
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        min_wait = 0
+        while not self._stopped.is_set():
+            wait = max(self.expires_at - self.margin - time.time(), min_wait)
+            # Don't refresh in a tight loop if tokens live shorter than margin
+            min_wait = self.retry_delay
+            if self._stopped.wait(wait):
+                return
+            api = self._api()
+            if api is None:
+                return
+            try:
+                token, self.expires_at = api.fetch_api_token(
+                    self.refresh_token, min_ttl=self.margin)
+                api.set_api_token(token)
+            except Exception:
+                logger.exception('Failed to refresh API token')
+                self._stopped.wait(self.retry_delay)
+            # Don't keep the API alive while waiting for the next refresh
+            del api
@@ -1,16 +1,34 @@
 from future.standard_library import install_aliases  # noqa
 install_aliases()  # noqa
 import os
+import codecs
 import errno
+import heapq
+import itertools
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
 
 import boto3
 
+from .exceptions import BatchJobTimeoutException
 from .settings import RV_CPU_JOB_DEF, RV_CPU_QUEUE, DEVELOP_BRANCH
 
+logger = logging.getLogger(__name__)
+
+# describe_jobs accepts at most this many job ids per call
+DESCRIBE_JOBS_LIMIT = 100
+# Status of jobs describe_jobs stopped returning, e.g. because they expired
+BATCH_UNKNOWN_STATUS = 'UNKNOWN'
+BATCH_DONE_STATUSES = ('SUCCEEDED', 'FAILED', BATCH_UNKNOWN_STATUS)
+
 
 class RasterVisionBatchClient():
     def __init__(self, job_queue=RV_CPU_QUEUE, job_definition=RV_CPU_JOB_DEF,
-                 branch_name=DEVELOP_BRANCH, attempts=1):
+                 branch_name=DEVELOP_BRANCH, attempts=1, batch_client=None):
         """Create a Raster Vision Batch Client
 
         Args:
@@ -18,13 +36,14 @@ class RasterVisionBatchClient():
             job_definition (str): name of the Batch job definition
             branch_name (str): branch of the raster-vision repo to use
             attempts (int): number of attempts for each job
+            batch_client: optional boto3 Batch client to use
         """
 
         self.job_queue = job_queue
         self.job_definition = job_definition
         self.branch_name = branch_name
         self.attempts = attempts
-        self.batch_client = boto3.client('batch')
+        self.batch_client = batch_client or boto3.client('batch')
 
     def start_raster_vision_job(self, job_name, command):
         """Start a raster-vision Batch job.
@@ -51,6 +70,228 @@ class RasterVisionBatchClient():
 
         return job_id
 
+    def start_raster_vision_array_job(self, job_name, command, size):
+        """Start a raster-vision Batch array job.
+
+        Each of the job's children can read its index from the
+        AWS_BATCH_JOB_ARRAY_INDEX environment variable. Batch array jobs
+        need at least two children, so a size of one starts a regular job.
+
+        Args:
+            job_name (str): name of the Batch job
+            command (str): command to run inside each child's Docker container
+            size (int): number of children
+
+        Returns:
+            job_id (str): job_id of job started on Batch
+        """
+        job_command = ['run_script.sh', self.branch_name, command]
+        kwargs = {}
+        if size > 1:
+            kwargs['arrayProperties'] = {'size': size}
+        job_id = self.batch_client.submit_job(
+            jobName=job_name, jobQueue=self.job_queue,
+            jobDefinition=self.job_definition,
+            containerOverrides={
+                'command': job_command
+            },
+            retryStrategy={
+                'attempts': self.attempts
+            },
+            **kwargs)['jobId']
+
+        return job_id
+
+    def track(self, job_ids, max_resubmits=0, max_missing_polls=3):
+        """Track a group of Batch jobs until they finish
+
+        Args:
+            job_ids (list of str): ids of the jobs to track
+            max_resubmits (int): number of times to resubmit each failed job
+            max_missing_polls (int): number of polls a job may be missing from
+                describe_jobs before it is considered finished as UNKNOWN
+
+        Returns:
+            BatchJobTracker
+        """
+        return BatchJobTracker(self.batch_client, job_ids, max_resubmits,
+                               max_missing_polls)
+
+
+class BatchJobTracker(object):
+    """Polls the status of many Batch jobs with few describe_jobs calls"""
+
+    def __init__(self, batch_client, job_ids, max_resubmits=0,
+                 max_missing_polls=3):
+        """Create a Batch job tracker
+
+        Args:
+            batch_client: boto3 Batch client
+            job_ids (list of str): ids of the jobs to track
+            max_resubmits (int): number of times to resubmit each failed job
+            max_missing_polls (int): number of polls a job may be missing from
+                describe_jobs, e.g. because its id is unknown or it expired,
+                before it is considered finished with status UNKNOWN
+        """
+        self.batch_client = batch_client
+        self.max_resubmits = max_resubmits
+        self.max_missing_polls = max_missing_polls
+        self.missing_polls = {job_id: 0 for job_id in job_ids}
+        # Jobs are tracked under their original id, even once resubmitted
+        self.current_ids = {job_id: job_id for job_id in job_ids}
+        self.resubmits = {job_id: 0 for job_id in job_ids}
+        self.statuses = {job_id: None for job_id in job_ids}
+        self.jobs = {}
+
+    @property
+    def pending(self):
+        return [
+            job_id for job_id, status in self.statuses.items()
+            if status not in BATCH_DONE_STATUSES
+        ]
+
+    def describe(self, job_ids):
+        """Describe jobs in chunks of at most 100 ids
+
+        Args:
+            job_ids (list of str): ids of the jobs to describe
+
+        Returns:
+            dict: job descriptions by job id
+        """
+        jobs = {}
+        for start in range(0, len(job_ids), DESCRIBE_JOBS_LIMIT):
+            chunk = job_ids[start:start + DESCRIBE_JOBS_LIMIT]
+            for job in self.batch_client.describe_jobs(jobs=chunk)['jobs']:
+                jobs[job['jobId']] = job
+        return jobs
+
+    def resubmit(self, job):
+        """Submit a copy of a job described by describe_jobs
+
+        Args:
+            job (dict): description of the job
+
+        Returns:
+            str: id of the new job
+        """
+        kwargs = {}
+        if job.get('arrayProperties', {}).get('size'):
+            kwargs['arrayProperties'] = {'size': job['arrayProperties']['size']}
+        for field in ['retryStrategy', 'parameters', 'timeout']:
+            if job.get(field):
+                kwargs[field] = job[field]
+        if job.get('dependsOn'):
+            kwargs['dependsOn'] = [
+                {k: v for k, v in dependency.items()
+                 if k in ('jobId', 'type')}
+                for dependency in job['dependsOn']
+            ]
+        container_overrides = {'command': job['container']['command']}
+        if job['container'].get('environment'):
+            container_overrides['environment'] = job['container'][
+                'environment']
+        return self.batch_client.submit_job(
+            jobName=job['jobName'], jobQueue=job['jobQueue'],
+            jobDefinition=job['jobDefinition'],
+            containerOverrides=container_overrides, **kwargs)['jobId']
+
+    def poll(self):
+        """Check the status of all unfinished jobs once
+
+        Failed jobs with resubmits left are resubmitted instead of being
+        reported as finished. Jobs missing from max_missing_polls consecutive
+        polls are reported as finished with status UNKNOWN.
+
+        Returns:
+            list of (str, dict): original id and description of each job that
+            finished since the last poll
+        """
+        pending = self.pending
+        current_to_original = {
+            self.current_ids[job_id]: job_id for job_id in pending
+        }
+        described = self.describe(list(current_to_original))
+        finished = []
+        for current_id, job in described.items():
+            job_id = current_to_original[current_id]
+            status = job['status']
+            self.jobs[job_id] = job
+            self.missing_polls[job_id] = 0
+            can_resubmit = self.resubmits[job_id] < self.max_resubmits
+            if status == 'FAILED' and can_resubmit:
+                self.resubmits[job_id] += 1
+                self.current_ids[job_id] = self.resubmit(job)
+                logger.info('Resubmitted failed job %s as %s', current_id,
+                            self.current_ids[job_id])
+                status = 'SUBMITTED'
+            self.statuses[job_id] = status
+            if status in BATCH_DONE_STATUSES:
+                finished.append((job_id, job))
+        for current_id, job_id in current_to_original.items():
+            if current_id in described:
+                continue
+            self.missing_polls[job_id] += 1
+            if self.missing_polls[job_id] >= self.max_missing_polls:
+                logger.warning('Batch job %s is missing, giving up on it',
+                               current_id)
+                job = {'jobId': current_id, 'status': BATCH_UNKNOWN_STATUS}
+                self.jobs[job_id] = job
+                self.statuses[job_id] = BATCH_UNKNOWN_STATUS
+                finished.append((job_id, job))
+        return finished
+
+    def iter_completed(self, min_delay=5, max_delay=60, backoff=2,
+                       timeout=None):
+        """Yield jobs as they finish, polling adaptively
+
+        The delay between polls starts at min_delay, grows by backoff after
+        each poll in which no job finished, up to max_delay, and resets when
+        jobs finish.
+
+        Args:
+            min_delay (float): shortest delay between polls in seconds
+            max_delay (float): longest delay between polls in seconds
+            backoff (float): factor to grow the delay by
+            timeout (float): seconds after which to stop waiting, raising
+                BatchJobTimeoutException if a last poll finds jobs unfinished
+
+        Yields:
+            (str, dict): original id and description of each finished job
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        delay = min_delay
+        while self.pending:
+            finished = self.poll()
+            for job_id, job in finished:
+                yield job_id, job
+            if not self.pending:
+                return
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                raise BatchJobTimeoutException(
+                    '{} Batch jobs still running'.format(len(self.pending)))
+            delay = min_delay if finished else min(delay * backoff, max_delay)
+            # Poll once more at the deadline rather than giving up early
+            time.sleep(delay if remaining is None else min(delay, remaining))
+
+    def wait(self, on_complete=None, **kwargs):
+        """Wait for all jobs to finish
+
+        Args:
+            on_complete (callable): optional function of (job_id, job) called
+                as each job finishes
+            **kwargs: additional arguments for iter_completed, e.g. timeout
+                to raise BatchJobTimeoutException instead of waiting forever
+
+        Returns:
+            dict: final status of each job by original id
+        """
+        for job_id, job in self.iter_completed(**kwargs):
+            if on_complete is not None:
+                on_complete(job_id, job)
+        return dict(self.statuses)
+
 
 def mkdir_p(path):
     try:
@@ -83,3 +324,230 @@ def get_all_paginated(get_page_fn, list_field='results'):
             all_results.append(result)
 
     return all_results
+
+
+def balanced_shards(items, num_shards, weights=None):
+    """Split items into shards of roughly equal total weight.
+
+    Items are assigned largest first to the lightest shard, and each shard
+    keeps the items' original relative order.
+
+    Args:
+        items: list of items to split
+        num_shards: number of shards
+        weights: optional list of weights for each item, 1 for each item by
+            default
+
+    Returns:
+        List of num_shards lists of items, omitting empty shards
+    """
+    if weights is None:
+        weights = [1] * len(items)
+    heap = [(0, shard) for shard in range(num_shards)]
+    assignments = [[] for _ in range(num_shards)]
+    by_weight = sorted(range(len(items)), key=lambda i: -weights[i])
+    for i in by_weight:
+        load, shard = heapq.heappop(heap)
+        assignments[shard].append(i)
+        heapq.heappush(heap, (load + weights[i], shard))
+    return [
+        [items[i] for i in sorted(indices)]
+        for indices in assignments if indices
+    ]
+
+
+def chunked(items, size):
+    """Lazily split an iterable into lists of at most size items.
+
+    Args:
+        items: iterable to split
+        size: maximum number of items in each list
+
+    Yields:
+        Lists of consecutive items
+    """
+    iterator = iter(items)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+def iter_json_array(chunks, field):
+    """Incrementally parse the items of an array in a JSON document.
+
+    Only the item being parsed is held in memory, so arbitrarily large
+    documents, e.g. GeoJSON feature collections, can be streamed.
+
+    Args:
+        chunks: iterable of bytes chunks of a UTF-8 JSON object
+        field: key of the array, which must appear before any other array
+            whose items contain a key of the same name
+
+    Yields:
+        Parsed items of the array
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    key = re.compile(r'"{}"\s*:\s*\['.format(re.escape(field)))
+    in_array = False
+    buffer = ''
+    for chunk in chunks:
+        buffer += utf8.decode(chunk)
+        pos = 0
+        if not in_array:
+            match = key.search(buffer)
+            if match is None:
+                # Keep enough of the tail to match a key split across chunks
+                buffer = buffer[-(len(field) + 64):]
+                continue
+            in_array = True
+            pos = match.end()
+        while True:
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                pos += 1
+            if pos == len(buffer):
+                break
+            if buffer[pos] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                # The item continues in the next chunk
+                break
+            if end == len(buffer) and not isinstance(item, (dict, list)):
+                # A number or literal may continue in the next chunk
+                break
+            pos = end
+            yield item
+        buffer = buffer[pos:]
+    if in_array and buffer.strip():
+        raise ValueError('Unterminated "{}" array'.format(field))
+
+
+def iter_paginated_json(get_page_fn, list_field='results',
+                        chunk_size=64 * 1024):
+    """Stream the objects of a paginated endpoint page by page.
+
+    Unlike get_all_paginated, responses aren't unmarshalled into models and
+    only one object at a time is held in memory, so callers can keep just
+    the fields they need.
+
+    Args:
+        get_page_fn: function that takes a page number and returns a
+            streamed requests.Response
+        list_field: field in the results that contains the list of objects
+        chunk_size: bytes to read from a response at a time
+
+    Yields:
+        Parsed objects, as dicts
+    """
+    page = 0
+    while True:
+        response = get_page_fn(page)
+        response.raise_for_status()
+        # Pagination fields precede the list in Raster Foundry's responses
+        head = bytearray()
+
+        def chunks():
+            for chunk in response.iter_content(chunk_size):
+                if len(head) < 1024:
+                    head.extend(chunk[:1024 - len(head)])
+                yield chunk
+
+        count = 0
+        try:
+            for item in iter_json_array(chunks(), list_field):
+                count += 1
+                yield item
+        finally:
+            response.close()
+        match = re.search(br'"hasNext"\s*:\s*(true|false)', bytes(head))
+        if not (match.group(1) == b'true' if match else count):
+            return
+        page += 1
+
+
+class RateLimiter(object):
+    """Spaces out calls from any number of threads to at most a given rate"""
+
+    def __init__(self, rate):
+        """Create a rate limiter
+
+        Args:
+            rate: maximum calls, or units of cost, per second, or None for no
+                limit
+        """
+        self.interval = 1. / rate if rate else 0.
+        self._lock = threading.Lock()
+        self._next = 0.
+
+    def wait(self, cost=1):
+        """Block until the next call is allowed
+
+        Args:
+            cost: units of the rate the call uses, e.g. bytes for a bandwidth
+                limit
+        """
+        with self._lock:
+            now = time.time()
+            start = max(self._next, now)
+            self._next = start + self.interval * cost
+        if start > now:
+            time.sleep(start - now)
+
+
+class ExpiringCache(object):
+    """A thread-safe, size-bounded cache whose entries expire
+
+    The least recently used entry is evicted once max_size is reached.
+    Callers that need to check and fill the cache atomically can hold lock,
+    which is reentrant.
+    """
+
+    def __init__(self, max_size=256, ttl=300):
+        """Create a cache
+
+        Args:
+            max_size (int): maximum number of entries
+            ttl (float): seconds an entry is kept for, or None to keep entries
+                until they are evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self._entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """Get an entry, or default if it is missing or expired"""
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return default
+            stored_at, value = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                return default
+            # Reinsert as the most recently used
+            self._entries[key] = entry
+            return value
+
+    def put(self, key, value):
+        """Add or replace an entry"""
+        with self.lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove an entry and return it"""
+        with self.lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -27,15 +27,28 @@ setuptools.setup(
         'bravado >= 8.4.0',
         'boto3 >= 1.4.4',
         'future >= 0.16.0',
-        'shapely >= 1.6.4post1'
+        'shapely >= 1.6.4post1',
+        'numpy >= 1.13.0',
+        'python-dateutil >= 2.1',
+        'futures >= 3.0.0; python_version < "3"'
     ],
     extras_require={
         'notebook': [
             'notebook >= 4.0.0',
             'az-ipyleaflet==0.4.1'
         ],
+        'thumbnails': [
+            'Pillow >= 4.0.0'
+        ],
+        'analysis': [
+            'rasterio >= 1.0.0'
+        ],
         'dev': [],
         'test': [],
+        'benchmark': [
+            'pytest-benchmark >= 3.1.1',
+            'moto >= 1.3.4'
+        ],
     },
     setup_requires=['setuptools_scm==3.*'],
     tests_require=[],
@@ -0,0 +1,641 @@
+"""A local stand-in for the Raster Foundry API and tile server
+
+The MockServer is generated from the bundled swagger spec: every path in the
+spec is routed, list endpoints serve deterministic paginated fixtures built
+from the spec's definitions, and detail endpoints serve a fixture for the
+requested id. It also simulates export processing, export file downloads and
+the tile server behind API.tile_host, and can inject latency and 429/504
+errors. It runs entirely offline so that the client's throughput can be
+measured and regression-tested.
+
+Usage:
+
+    with MockServer(sizes={'/projects/': 500}, latency=0.01) as server:
+        api = server.api()
+        projects = api.projects
+"""
+from future.standard_library import install_aliases  # noqa
+install_aliases()  # noqa
+import copy
+import datetime
+import json
+import os
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import rasterfoundry
+from bravado.swagger_model import load_file
+from rasterfoundry.compression import gzip_bytes
+
+BUNDLED_SPEC_PATH = os.path.join(
+    os.path.dirname(rasterfoundry.__file__), 'spec.yml')
+FIXTURE_NAMESPACE = uuid.UUID('6f1f3a2e-3f5c-4b8e-9d0e-5b7c1f0e2a11')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Path parameters that the published spec names after their resource
+RESOURCE_PARAM_NAMES = {
+    'mosaic': 'sceneID',
+    'areas-of-interest': 'aoiID',
+    'map-tokens': 'mapTokenID',
+    'tool-runs': 'toolRunID',
+}
+
+
+def _resource_param_name(resource):
+    if resource in RESOURCE_PARAM_NAMES:
+        return RESOURCE_PARAM_NAMES[resource]
+    words = resource.split('-')
+    singular = words[-1][:-3] + 'y' if words[-1].endswith('ies') else (
+        words[-1][:-1] if words[-1].endswith('s') else words[-1])
+    words[-1] = singular
+    return words[0] + ''.join(w.capitalize() for w in words[1:]) + 'ID'
+
+
+def client_spec(spec):
+    """Rename the bundled spec's parameters to match the published spec
+
+    The bundled spec predates the published spec's resource-named path
+    parameters (e.g. /projects/{projectID}/ rather than /projects/{uuid}/),
+    which determine the operation names the client calls. This rewrites a
+    copy of the spec so that bravado generates those names.
+
+    Args:
+        spec (dict): swagger spec loaded from the bundled spec.yml
+
+    Returns:
+        dict
+    """
+    spec = copy.deepcopy(spec)
+    shared_params = spec.get('parameters', {})
+    paths = {}
+    for path, path_item in spec['paths'].items():
+        segments = path.split('/')
+        renames = {}
+        for i, segment in enumerate(segments):
+            if segment in ('{uuid}', '{uuid2}'):
+                name = _resource_param_name(segments[i - 1])
+                renames[segment[1:-1]] = name
+                segments[i] = '{' + name + '}'
+        for method, operation in path_item.items():
+            if not isinstance(operation, dict):
+                continue
+            params = []
+            for param in operation.get('parameters', []):
+                if '$ref' in param:
+                    ref_name = param['$ref'].split('/')[-1]
+                    resolved = shared_params.get(ref_name, {})
+                else:
+                    ref_name, resolved = param.get('name'), param
+                if resolved.get('in') == 'path' and ref_name in renames:
+                    param = dict(resolved, name=renames[ref_name])
+                elif path == '/tokens/' and resolved.get('in') == 'body':
+                    param = dict(resolved, name='authBody')
+                params.append(param)
+            if params:
+                operation['parameters'] = params
+        paths['/'.join(segments)] = path_item
+    spec['paths'] = paths
+    return spec
+
+
+def _route_regex(path):
+    pattern = re.sub(r'\\\{[^/]+?\\\}', '([^/]+)', re.escape(path))
+    return re.compile('^{}$'.format(pattern))
+
+
+class MockServer(object):
+    """An offline, spec-driven stand-in for the Raster Foundry API"""
+
+    def __init__(self, spec_path=BUNDLED_SPEC_PATH, sizes=None,
+                 default_size=25, max_page_size=100, latency=0.,
+                 error_rates=None, export_polls=1, export_file_size=1024,
+                 tile_size=1024, credentials_ttl=3600, asset_size=1024,
+                 gzip=False, seed=0):
+        """Instantiate a new MockServer
+
+        Args:
+            spec_path (str): swagger spec to generate routes and fixtures from
+            sizes (dict): number of objects served by list endpoints, keyed
+                by spec path, e.g. {'/projects/{uuid}/scenes/': 5000}
+            default_size (int): number of objects served by list endpoints
+                not in sizes
+            max_page_size (int): largest page size a list endpoint returns
+            latency (float | callable): seconds to wait before responding, or
+                a function of (method, path) returning seconds
+            error_rates (dict): probability of responding with a status code
+                instead of handling the request, e.g. {429: 0.05, 504: 0.01}
+            export_polls (int): number of detail requests for an export before
+                it reports EXPORTED
+            export_file_size (int): size in bytes of each export file
+            tile_size (int): size in bytes of each tile and tile-server export
+            credentials_ttl (int): seconds until upload credentials expire
+            asset_size (int): size in bytes of each scene asset download
+            gzip (bool): whether to accept gzipped request bodies and gzip
+                JSON responses for clients that accept them. Otherwise
+                gzipped request bodies are rejected with 415
+            seed (int): seed for fixtures and error injection
+        """
+        self.spec = load_file(spec_path)
+        self.base_path = self.spec.get('basePath', '')
+        self.sizes = sizes or {}
+        self.default_size = default_size
+        self.max_page_size = max_page_size
+        self.latency = latency
+        self.error_rates = error_rates or {}
+        self.export_polls = export_polls
+        self.export_file_size = export_file_size
+        self.tile_size = tile_size
+        self.credentials_ttl = credentials_ttl
+        self.asset_size = asset_size
+        self.gzip = gzip
+        self.seed = seed
+
+        self.routes = [
+            (_route_regex(path), path, path_item)
+            for path, path_item in self.spec['paths'].items()
+        ]
+        self.requests = []
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.export_poll_counts = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @property
+    def host(self):
+        return '{}:{}'.format(*self._server.server_address[:2])
+
+    @property
+    def url(self):
+        return 'http://{}'.format(self.host)
+
+    @property
+    def spec_url(self):
+        return '{}/spec.json'.format(self.url)
+
+    def start(self, port=0):
+        """Start serving in a background thread
+
+        Args:
+            port (int): port to listen on, a free port by default
+        """
+        self._server = _ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving"""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def api(self, **kwargs):
+        """Create an API which makes requests against this server
+
+        Args:
+            **kwargs: additional arguments for API
+
+        Returns:
+            API
+        """
+        from rasterfoundry.api import API
+        kwargs.setdefault('api_token', 'mock-api-token')
+        return API(host=self.host, scheme='http', tile_host=self.host,
+                   spec_path=self.spec_url, **kwargs)
+
+    def reset_log(self):
+        """Forget recorded requests, byte counts and export progress"""
+        with self._lock:
+            self.requests = []
+            self.bytes_received = 0
+            self.bytes_sent = 0
+            self.export_poll_counts = {}
+
+    def size(self, path):
+        return self.sizes.get(path, self.default_size)
+
+    # Fixtures
+
+    def _resolve(self, schema):
+        """Flatten $refs and allOf into a single schema"""
+        if '$ref' in schema:
+            name = schema['$ref'].split('/')[-1]
+            resolved = dict(self._resolve(self.spec['definitions'][name]))
+            resolved['x-name'] = name
+            return resolved
+        if 'allOf' in schema:
+            merged = {'type': 'object', 'properties': {}}
+            for part in schema['allOf']:
+                part = self._resolve(part)
+                merged['properties'].update(part.get('properties', {}))
+            merged['properties'].update(schema.get('properties', {}))
+            return merged
+        return schema
+
+    def _polygon(self, rng):
+        x, y = rng.uniform(-120, -70), rng.uniform(25, 48)
+        size = rng.uniform(0.05, 0.5)
+        return {
+            'type': 'Polygon',
+            'coordinates': [[[x, y], [x + size, y], [x + size, y + size],
+                             [x, y + size], [x, y]]]
+        }
+
+    def _multipolygon(self, rng):
+        polygon = self._polygon(rng)
+        return {'type': 'MultiPolygon',
+                'coordinates': [polygon['coordinates']]}
+
+    def fixture(self, schema, rng, name=None, depth=0):
+        """Generate a value matching a spec schema
+
+        Args:
+            schema (dict): swagger schema
+            rng (random.Random): source of randomness
+            name (str): name of the property the value is for
+            depth (int): nesting depth, to bound recursive definitions
+
+        Returns:
+            a JSON-serializable value
+        """
+        schema = self._resolve(schema)
+        if name in ('dataFootprint', 'tileFootprint'):
+            return self._multipolygon(rng)
+        if name in ('extent', 'geometry'):
+            return self._polygon(rng)
+        if 'enum' in schema:
+            return schema['enum'][0]
+        schema_type = schema.get('type', 'object')
+        schema_format = schema.get('format', '')
+        if schema_type == 'object':
+            if depth > 4:
+                return {}
+            return {
+                prop: self.fixture(prop_schema, rng, prop, depth + 1)
+                for prop, prop_schema in schema.get('properties', {}).items()
+            }
+        elif schema_type == 'array':
+            if depth > 4:
+                return []
+            if schema.get('minItems') == 2 and schema.get('maxItems') == 2:
+                return [rng.uniform(-180, 180), rng.uniform(-90, 90)]
+            return [self.fixture(schema.get('items', {}), rng, None, depth + 1)]
+        elif schema_type in ('number', 'integer'):
+            if name and 'cloud' in name.lower():
+                return round(rng.uniform(0, 100), 2)
+            if schema_type == 'integer' or 'int' in schema_format:
+                return rng.randint(0, 1000)
+            return rng.uniform(0, 1000)
+        elif schema_type == 'boolean':
+            return False
+        elif schema_format.lower() == 'uuid':
+            return str(uuid.UUID(int=rng.getrandbits(128)))
+        elif 'date' in schema_format.lower():
+            return '2018-{:02d}-{:02d}T{:02d}:00:00Z'.format(
+                rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23))
+        elif (name and 'uri' in name.lower()) or schema_format == 'uri':
+            return 's3://mock-bucket/{}/{}.tif'.format(
+                name or 'files', uuid.UUID(int=rng.getrandbits(128)))
+        return '{} {}'.format(name or 'value', rng.randint(0, 10 ** 6))
+
+    def object_id(self, path, args, index):
+        return str(uuid.uuid5(
+            FIXTURE_NAMESPACE, '{}:{}:{}'.format(path, ','.join(args), index)))
+
+    def make_object(self, schema, object_id, path, args):
+        schema = self._resolve(schema)
+        rng = random.Random('{}:{}'.format(self.seed, object_id))
+        obj = self.fixture(schema, rng)
+        if not isinstance(obj, dict):
+            return obj
+        if 'properties' in obj and 'geometry' in obj:
+            obj['type'] = 'Feature'
+            obj['id'] = object_id
+            obj['properties']['id'] = object_id
+            return obj
+        obj['id'] = object_id
+        if 'exportOptions' in obj:
+            obj['exportOptions']['source'] = (
+                's3://mock-bucket/exports/{}'.format(object_id))
+            obj['exportStatus'] = 'TOBEEXPORTED'
+        if 'execution_parameters' in obj or schema.get('x-name') == 'ToolRun':
+            obj['executionParameters'] = {
+                'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                'apply': '-',
+                'args': [
+                    {'id': str(uuid.UUID(int=rng.getrandbits(128))),
+                     'type': 'projectSrc', 'band': band,
+                     'projId': self.object_id('/projects/', [], band)}
+                    for band in range(2)
+                ]
+            }
+        for thumbnail in obj.get('thumbnails') or []:
+            thumbnail['url'] = self.thumbnail_url(thumbnail)
+        if schema.get('x-name') == 'Thumbnail':
+            obj['url'] = self.thumbnail_url(obj)
+        for image in obj.get('images') or []:
+            image['sourceUri'] = 's3://mock-bucket/scenes/{}/{}.tif'.format(
+                object_id, image.get('id'))
+        return obj
+
+    def thumbnail_url(self, thumbnail):
+        """Point a thumbnail at this server's simulated tile server"""
+        if self._server is None:
+            return thumbnail.get('url')
+        return '{}/thumbnails/{}.png'.format(self.url, thumbnail.get('id'))
+
+    def page(self, path, args, query, schema):
+        """Serve one page of a paginated list endpoint"""
+        list_field = 'features' if 'features' in schema['properties'] \
+            else 'results'
+        item_schema = schema['properties'][list_field].get('items', {})
+        page = int(float(query.get('page', ['0'])[0]))
+        page_size = min(
+            int(float(query.get('pageSize', ['30'])[0])), self.max_page_size)
+        if path.endswith('/order'):
+            # The order of a project's scenes lists that project's scene ids
+            path, item_schema = path[:-len('order')] + 'scenes/', None
+        count = self.size(path)
+        start, end = page * page_size, min((page + 1) * page_size, count)
+        results = []
+        for index in range(start, end):
+            object_id = self.object_id(path, args, index)
+            if item_schema is None:
+                results.append(object_id)
+            else:
+                results.append(
+                    self.make_object(item_schema, object_id, path, args))
+        body = {
+            'count': count,
+            'page': page,
+            'pageSize': page_size,
+            'hasNext': end < count,
+            'hasPrevious': page > 0,
+            list_field: results
+        }
+        if list_field == 'features':
+            body['type'] = 'FeatureCollection'
+        return body
+
+    # Request handling
+
+    def respond(self, method, url, body, headers=None):
+        """Handle a request
+
+        Args:
+            method (str): HTTP method
+            url (str): request path and query string
+            body (bytes): request body
+            headers (dict): request headers
+
+        Returns:
+            tuple of (status, headers, body), body being a JSON-serializable
+            value, bytes, or an iterable of bytes chunks of known total length
+        """
+        parsed = urlparse(url)
+        query = parse_qs(parsed.query)
+        with self._lock:
+            self.requests.append((method, parsed.path))
+            injected = [
+                status for status, rate in sorted(self.error_rates.items())
+                if self._random.random() < rate
+            ]
+        latency = (self.latency(method, parsed.path)
+                   if callable(self.latency) else self.latency)
+        if latency:
+            time.sleep(latency)
+        if parsed.path == '/spec.json':
+            return 200, {}, client_spec(self.spec)
+        if injected:
+            headers = {'Retry-After': '1'} if injected[0] == 429 else {}
+            return injected[0], headers, {
+                'code': injected[0], 'message': 'Injected by MockServer'}
+        if (headers or {}).get('Content-Encoding') == 'gzip':
+            if not self.gzip:
+                return 415, {}, {'code': 415,
+                                 'message': 'Unsupported Content-Encoding'}
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        if parsed.path.startswith('/assets/'):
+            return self.asset(method, (headers or {}).get('Range'))
+        if not parsed.path.startswith(self.base_path + '/'):
+            return self.tile(method, parsed.path, query)
+
+        path = parsed.path[len(self.base_path):]
+        for regex, spec_path, path_item in self.routes:
+            match = regex.match(path)
+            if match and method.lower() in path_item:
+                return self.handle(method.lower(), spec_path, match.groups(),
+                                   query, body, path_item[method.lower()])
+        return 404, {}, {'code': 404, 'message': 'No route for {}'.format(path)}
+
+    def handle(self, method, path, args, query, body, operation):
+        args = list(args)
+        if method == 'post' and path == '/tokens/':
+            return 201, {}, {'id_token': 'mock-api-token',
+                             'access_token': 'mock-access-token',
+                             'expires_in': 3600, 'token_type': 'Bearer'}
+        if method in ('put', 'delete'):
+            return 204, {}, None
+        if method == 'post':
+            payload = json.loads(body.decode('utf-8')) if body else {}
+            if isinstance(payload, dict) and 'features' in payload:
+                for feature in payload['features']:
+                    feature.setdefault('id', str(uuid.uuid4()))
+            elif isinstance(payload, dict):
+                payload.setdefault('id', str(uuid.uuid4()))
+                if isinstance(payload.get('exportOptions'), dict):
+                    payload['exportOptions'].setdefault(
+                        'source',
+                        's3://mock-bucket/exports/{}'.format(payload['id']))
+            return 201, {}, payload
+
+        if path == '/uploads/{uuid}/credentials/':
+            expiration = datetime.datetime.utcnow() + datetime.timedelta(
+                seconds=self.credentials_ttl)
+            return 200, {}, {
+                'bucketPath': 's3://mock-bucket/user-uploads/{}'.format(
+                    args[0]),
+                'credentials': {
+                    'AccessKeyId': 'mock-access-key-id',
+                    'SecretAccessKey': 'mock-secret-access-key',
+                    'SessionToken': 'mock-session-token',
+                    'Expiration': expiration.strftime('%Y-%m-%dT%H:%M:%SZ')
+                }
+            }
+        if path == '/scenes/{uuid}/download':
+            return 200, {}, [
+                {'filename': '{}.tif'.format(index),
+                 'sourceUri': 's3://mock-bucket/scenes/{}/{}.tif'.format(
+                     args[0], index),
+                 'downloadUri': '{}/assets/{}/{}.tif'.format(
+                     self.url, args[0], index)}
+                for index in range(self.size(path))
+            ]
+        if path == '/projects/{uuid}/mosaic/':
+            # Unlike the spec says, the API returns one definition per scene
+            definitions = []
+            for index in range(self.size(path)):
+                definition = self.make_object(
+                    {'$ref': '#/definitions/MosaicDefinition'},
+                    self.object_id(path, args, index), path, args)
+                definition['sceneId'] = definition.pop('id')
+                definitions.append(definition)
+            return 200, {}, definitions
+        if path == '/exports/{uuid}/files':
+            return 200, {}, ['RFUploadAccessTestFile', '{}.tif'.format(args[0])]
+        if path == '/exports/{uuid}/files/{filename}':
+            return 200, {'Content-Type': 'image/tiff'}, self.file_bytes(
+                self.export_file_size)
+
+        responses = operation.get('responses', {})
+        response = responses.get(200, responses.get('200', {}))
+        schema = self._resolve(response.get('schema', {'type': 'object'}))
+        if 'hasNext' in schema.get('properties', {}):
+            return 200, {}, self.page(path, args, query, schema)
+        if schema.get('type') == 'array':
+            return 200, {}, [
+                self.make_object(schema.get('items', {}),
+                                 self.object_id(path, args, index), path, args)
+                for index in range(self.size(path))
+            ]
+        obj = self.make_object(schema, args[-1] if args else
+                               self.object_id(path, args, 0), path, args)
+        if path == '/exports/{uuid}/':
+            with self._lock:
+                polls = self.export_poll_counts.get(args[0], 0) + 1
+                self.export_poll_counts[args[0]] = polls
+            obj['exportStatus'] = (
+                'EXPORTED' if polls > self.export_polls else 'EXPORTING')
+        return 200, {}, obj
+
+    def tile(self, method, path, query):
+        """Simulate the tile server's tile and export endpoints"""
+        if method != 'GET':
+            return 405, {}, {'code': 405, 'message': 'Tiles are read-only'}
+        content_type = 'image/png'
+        if 'tiff' in query.get('format', [''])[0]:
+            content_type = 'image/tiff'
+        return 200, {'Content-Type': content_type}, self.file_bytes(
+            self.tile_size, PNG_SIGNATURE)
+
+    def asset(self, method, range_header=None):
+        """Simulate a scene asset server that supports ranged requests
+
+        Asset bytes depend on their position, so a download resumed at the
+        wrong offset is detectable.
+        """
+        if method not in ('GET', 'HEAD'):
+            return 405, {}, {'code': 405, 'message': 'Assets are read-only'}
+        size = self.asset_size
+        start, status, headers = 0, 200, {'Content-Type': 'image/tiff'}
+        if range_header and range_header.startswith('bytes='):
+            start = int(range_header[len('bytes='):].split('-')[0])
+            if start >= size:
+                return 416, {'Content-Range': 'bytes */{}'.format(size)}, None
+            status = 206
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, size - 1, size)
+
+        def chunks(chunk_size=64 * 1024):
+            for offset in range(start, size, chunk_size):
+                yield asset_bytes(offset, min(offset + chunk_size, size))
+        return status, headers, _Stream(chunks(), size - start)
+
+    def file_bytes(self, size, header=b'', chunk_size=1024 * 1024):
+        """A body of size bytes, streamed in chunks"""
+        def chunks():
+            sent = 0
+            first = header[:size]
+            if first:
+                yield first
+                sent += len(first)
+            while sent < size:
+                chunk = min(chunk_size, size - sent)
+                yield b'\0' * chunk
+                sent += chunk
+        return _Stream(chunks(), size)
+
+
+def asset_bytes(start, end):
+    """The bytes from start to end of every MockServer scene asset"""
+    return bytes(bytearray(i % 251 for i in range(start, end)))
+
+
+class _Stream(object):
+    def __init__(self, chunks, length):
+        self.chunks = chunks
+        self.length = length
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        status, headers, payload = self.server.mock.respond(
+            self.command, self.path, body, dict(self.headers))
+
+        if isinstance(payload, _Stream):
+            length = payload.length
+        elif payload is None:
+            payload, length = b'', 0
+        else:
+            payload = json.dumps(payload).encode('utf-8')
+            accepts_gzip = 'gzip' in self.headers.get('Accept-Encoding', '')
+            if self.server.mock.gzip and len(payload) > 1024 and accepts_gzip:
+                payload = gzip_bytes(payload)
+                headers['Content-Encoding'] = 'gzip'
+            length = len(payload)
+            headers.setdefault('Content-Type', 'application/json')
+        with self.server.mock._lock:
+            self.server.mock.bytes_received += len(body)
+            self.server.mock.bytes_sent += length
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(length))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        try:
+            if isinstance(payload, _Stream):
+                for chunk in payload:
+                    self.wfile.write(chunk)
+            else:
+                self.wfile.write(payload)
+        except socket.error:
+            # The client closed the response early
+            self.close_connection = True
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _handle
@@ -0,0 +1,87 @@
+import numpy as np
+from shapely.geometry import box
+
+from rasterfoundry.algebra import MapAlgebraEvaluator, classify
+
+
+def source(band):
+    return {'id': 'src-{}'.format(band), 'type': 'projectSrc',
+            'projId': 'project', 'band': band}
+
+
+def ndvi():
+    return {'apply': '/', 'args': [
+        {'apply': '-', 'args': [source(4), source(3)]},
+        {'apply': '+', 'args': [source(4), source(3)]},
+    ]}
+
+
+class CountingArray(object):
+    """An array that counts the rows read from it"""
+
+    def __init__(self, array):
+        self.array = array
+        self.shape = array.shape
+        self.rows_read = 0
+
+    def __getitem__(self, index):
+        rows = self.array[index]
+        self.rows_read += len(rows)
+        return rows
+
+
+def make_sources(shape=(300, 200)):
+    random = np.random.RandomState(0)
+    red, nir = random.rand(*shape), random.rand(*shape)
+    red[0, 0] = np.nan
+    return red, nir
+
+
+def test_evaluate_chunked():
+    red, nir = make_sources()
+    sources = {('project', 3): CountingArray(red),
+               ('project', 4): CountingArray(nir)}
+    evaluator = MapAlgebraEvaluator(sources, chunk_rows=64)
+    tree = {'apply': 'classify', 'args': [ndvi()], 'classMap': {
+        'classifications': {'0': 0, '0.5': 1, '1': 2}}}
+    result = evaluator.evaluate(tree)
+
+    expected = np.select(
+        [np.isnan(red), (nir - red) / (nir + red) <= 0,
+         (nir - red) / (nir + red) <= 0.5], [np.nan, 0, 1], 2)
+    np.testing.assert_array_equal(result, expected)
+    # Each band is read once, although the tree refers to it twice
+    assert sources[('project', 3)].rows_read == 300
+
+    # Changing the classes reuses the NDVI computed for the last evaluation
+    tree['classMap']['classifications'] = {'0.2': 0, '1': 1}
+    evaluator.evaluate(tree)
+    assert sources[('project', 3)].rows_read == 300
+
+
+def test_mask_and_constants():
+    red, nir = make_sources((10, 10))
+    evaluator = MapAlgebraEvaluator(
+        {('project', 3): red, ('project', 4): nir},
+        transform=(0, 1, 0, 10, 0, -1), chunk_rows=3)
+    tree = {'apply': 'mask', 'mask': box(0, 5, 5, 10).__geo_interface__,
+            'args': [{'apply': '*', 'args': [
+                source(4), {'type': 'const', 'constant': '2'}]}]}
+    result = evaluator.evaluate(tree)
+
+    np.testing.assert_array_equal(result[:5, :5], nir[:5, :5] * 2)
+    assert np.isnan(result[5:]).all() and np.isnan(result[:, 5:]).all()
+
+
+def test_classify_boundaries():
+    values = np.array([0., 1., 1.5, 2., 3., np.nan])
+    class_map = {'classifications': {'1': 10, '2': 20},
+                 'options': {'fallback': -1}}
+    np.testing.assert_array_equal(
+        classify(values, class_map), [10, 10, 20, 20, -1, np.nan])
+    class_map['options']['boundaryType'] = 'greaterThanOrEqualTo'
+    np.testing.assert_array_equal(
+        classify(values, class_map), [-1, 10, 10, 20, 20, np.nan])
+    class_map['options']['boundaryType'] = 'exact'
+    np.testing.assert_array_equal(
+        classify(values, class_map), [-1, 10, -1, 20, -1, np.nan])
@@ -0,0 +1,71 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from rasterfoundry.api import make_resolver_thread_safe
+from tests.mock_server import MockServer
+
+
+def test_concurrent_requests():
+    annotation = {
+        'type': 'Feature',
+        'geometry': {'type': 'Polygon',
+                     'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 0]]]},
+        'properties': {'label': 'car', 'description': '',
+                       'machineGenerated': True, 'confidence': 0.5}
+    }
+    with MockServer() as server:
+        api = server.api()
+        project_id = api.projects[0].id
+
+        def post(_):
+            return api.client.Imagery.post_projects_projectID_annotations(
+                projectID=project_id, annotations={
+                    'type': 'FeatureCollection', 'features': [annotation] * 10
+                }).result()
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(post, range(100)))
+
+    assert all(len(result.features) == 10 for result in results)
+
+
+def test_analyses_resolve_inputs_once():
+    with MockServer(default_size=30, max_page_size=10) as server:
+        api = server.api()
+        analyses = api.get_analyses(resolve_inputs=True)
+        project_requests = [
+            path for _, path in server.requests
+            if path.startswith('/api/projects/')]
+        server.reset_log()
+        centers = [analysis.get_center() for analysis in analyses]
+        more_requests = list(server.requests)
+
+        # Projects aren't shared with other APIs, and can be refreshed
+        other_analyses = server.api().get_analyses(resolve_inputs=True)
+        server.reset_log()
+        analyses[0].get_center(refresh=True)
+        refreshed_requests = list(server.requests)
+        api.project_cache.ttl = 0
+        server.reset_log()
+        analyses[0].get_center()
+        expired_requests = list(server.requests)
+
+    project_ids = set(
+        node['projId'] for analysis in analyses
+        for node in analysis.get_inputs())
+    assert len(analyses) == 30
+    assert len(project_requests) == len(project_ids) == 2
+    assert len(set(centers)) == 1
+    assert more_requests == []
+    assert len(other_analyses[0].api.project_cache) == 2
+    assert len(refreshed_requests) == len(expired_requests) == 1
+
+
+def test_make_resolver_thread_safe_skips_unknown_resolvers():
+    class Resolver(object):
+        def __init__(self):
+            self.scopes = ['spec.yml']
+
+    resolver = Resolver()
+    assert not make_resolver_thread_safe(resolver)
+    assert type(resolver) is Resolver
+    assert resolver.scopes == ['spec.yml']
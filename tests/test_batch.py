@@ -0,0 +1,103 @@
+import time
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from rasterfoundry.exceptions import BatchJobTimeoutException
+from rasterfoundry.utils import RasterVisionBatchClient
+
+
+def job(job_id, status):
+    return {
+        'jobId': job_id, 'jobName': 'predict', 'jobQueue': 'queue',
+        'jobDefinition': 'definition', 'status': status, 'startedAt': 0,
+        'container': {'command': ['run', job_id]}
+    }
+
+
+def test_track_polls_in_chunks_and_resubmits_failures():
+    batch = boto3.client('batch', region_name='us-east-1')
+    job_ids = ['job-{}'.format(i) for i in range(150)]
+    stubber = Stubber(batch)
+    # First poll: one chunk of 100 and one of 50; job-0 fails
+    stubber.add_response(
+        'describe_jobs',
+        {'jobs': [job('job-0', 'FAILED')] + [
+            job(i, 'SUCCEEDED') for i in job_ids[1:100]]},
+        {'jobs': job_ids[:100]})
+    stubber.add_response(
+        'describe_jobs', {'jobs': [job(i, 'RUNNING') for i in job_ids[100:]]},
+        {'jobs': job_ids[100:]})
+    stubber.add_response(
+        'submit_job', {'jobName': 'predict', 'jobId': 'job-0-retry'},
+        {'jobName': 'predict', 'jobQueue': 'queue',
+         'jobDefinition': 'definition',
+         'containerOverrides': {'command': ['run', 'job-0']}})
+    # Second poll only asks about unfinished jobs
+    stubber.add_response(
+        'describe_jobs',
+        {'jobs': [job('job-0-retry', 'SUCCEEDED')] + [
+            job(i, 'SUCCEEDED') for i in job_ids[100:]]},
+        {'jobs': ['job-0-retry'] + job_ids[100:]})
+    completed = []
+    with stubber:
+        tracker = RasterVisionBatchClient(batch_client=batch).track(
+            job_ids, max_resubmits=1)
+        statuses = tracker.wait(
+            on_complete=lambda job_id, _: completed.append(job_id),
+            min_delay=0)
+    stubber.assert_no_pending_responses()
+    assert set(statuses.values()) == {'SUCCEEDED'}
+    assert sorted(completed) == sorted(job_ids)
+    assert tracker.current_ids['job-0'] == 'job-0-retry'
+
+
+def test_track_gives_up_on_missing_jobs_and_resubmits_with_overrides():
+    batch = boto3.client('batch', region_name='us-east-1')
+    failed = job('job-0', 'FAILED')
+    failed['container']['environment'] = [{'name': 'STAGE', 'value': 'dev'}]
+    failed['parameters'] = {'uri': 's3://bucket/key'}
+    failed['dependsOn'] = [{'jobId': 'job-before', 'type': 'SEQUENTIAL'}]
+    failed['retryStrategy'] = {'attempts': 2}
+    stubber = Stubber(batch)
+    stubber.add_response(
+        'describe_jobs', {'jobs': [failed]}, {'jobs': ['job-0', 'expired']})
+    stubber.add_response(
+        'submit_job', {'jobName': 'predict', 'jobId': 'job-0-retry'},
+        {'jobName': 'predict', 'jobQueue': 'queue',
+         'jobDefinition': 'definition',
+         'containerOverrides': {
+             'command': ['run', 'job-0'],
+             'environment': [{'name': 'STAGE', 'value': 'dev'}]},
+         'parameters': {'uri': 's3://bucket/key'},
+         'dependsOn': [{'jobId': 'job-before', 'type': 'SEQUENTIAL'}],
+         'retryStrategy': {'attempts': 2}})
+    stubber.add_response(
+        'describe_jobs', {'jobs': [job('job-0-retry', 'SUCCEEDED')]},
+        {'jobs': ['job-0-retry', 'expired']})
+    with stubber:
+        tracker = RasterVisionBatchClient(batch_client=batch).track(
+            ['job-0', 'expired'], max_resubmits=1, max_missing_polls=2)
+        statuses = tracker.wait(min_delay=0)
+    stubber.assert_no_pending_responses()
+    assert statuses == {'job-0': 'SUCCEEDED', 'expired': 'UNKNOWN'}
+
+
+def test_track_polls_again_at_the_deadline():
+    batch = boto3.client('batch', region_name='us-east-1')
+    stubber = Stubber(batch)
+    for status in ['RUNNING', 'SUCCEEDED', 'RUNNING', 'RUNNING']:
+        stubber.add_response(
+            'describe_jobs', {'jobs': [job('job-0', status)]},
+            {'jobs': ['job-0']})
+    client = RasterVisionBatchClient(batch_client=batch)
+    with stubber:
+        start = time.time()
+        statuses = client.track(['job-0']).wait(min_delay=60, timeout=0.2)
+        assert statuses == {'job-0': 'SUCCEEDED'}
+        with pytest.raises(BatchJobTimeoutException):
+            client.track(['job-0']).wait(min_delay=60, timeout=0.2)
+        elapsed = time.time() - start
+    stubber.assert_no_pending_responses()
+    assert elapsed < 5
@@ -0,0 +1,28 @@
+from rasterfoundry.bulk import BulkExecutor
+from tests.mock_server import MockServer
+
+
+def project_center(api, project):
+    if project.name == 'broken':
+        raise ValueError('broken project')
+    return project.get_center()
+
+
+def scene_count(api, project):
+    return len(project.get_scenes())
+
+
+def test_map_over_projects():
+    with MockServer(sizes={'/projects/': 7}) as server:
+        api = server.api()
+        projects = api.projects
+        projects[3]._project.name = 'broken'
+        with BulkExecutor(api, processes=2, chunksize=2) as executor:
+            results = executor.map(project_center, projects)
+            counts = executor.map(scene_count, projects[:2])
+
+    assert [result.index for result in results] == list(range(7))
+    assert results[0].value == projects[0].get_center()
+    assert 'broken project' in results[3].error
+    assert all(result.error is None for result in counts)
+    assert counts[0].value == server.default_size
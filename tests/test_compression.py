@@ -0,0 +1,50 @@
+from tests.mock_server import MockServer
+
+ANNOTATIONS = {'type': 'FeatureCollection', 'features': [{
+    'type': 'Feature',
+    'geometry': {'type': 'Polygon', 'coordinates': [
+        [[i, 0], [i + 1, 0], [i + 1, 1], [i, 0]]]},
+    'properties': {'label': 'car', 'description': '', 'confidence': 0.9}
+} for i in range(1000)]}
+
+
+def post_annotations(server, project):
+    server.reset_log()
+    project.api.client.Imagery.post_projects_projectID_annotations(
+        projectID=project.id, annotations=ANNOTATIONS
+    ).future.result().raise_for_status()
+    return list(server.requests), server.bytes_received
+
+
+def get_scenes(server, project):
+    server.reset_log()
+    scenes = project.get_scenes()
+    return scenes, server.bytes_sent
+
+
+def test_compressed_request_bodies_and_responses():
+    with MockServer() as server:
+        project = server.api().projects[0]
+        _, uncompressed_sent = post_annotations(server, project)
+        scenes, uncompressed_received = get_scenes(server, project)
+
+    with MockServer(gzip=True) as server:
+        project = server.api(compress_min_size=1024).projects[0]
+        requests, compressed_sent = post_annotations(server, project)
+        compressed_scenes, compressed_received = get_scenes(server, project)
+
+    assert len(requests) == 1
+    assert compressed_sent < uncompressed_sent / 10
+    assert [s.id for s in compressed_scenes] == [s.id for s in scenes]
+    assert compressed_received < uncompressed_received / 2
+
+
+def test_uncompressed_fallback():
+    with MockServer() as server:
+        project = server.api(compress_min_size=1024).projects[0]
+        first, _ = post_annotations(server, project)
+        second, _ = post_annotations(server, project)
+
+    # The server rejects the compressed body once, then isn't sent any more
+    assert len(first) == 2
+    assert len(second) == 1
@@ -0,0 +1,59 @@
+import os
+
+from rasterfoundry.download import SceneDownloader
+from tests.mock_server import MockServer, asset_bytes
+
+
+def test_download_scenes_resumes_partial_files(tmpdir):
+    size = 300 * 1024
+    with MockServer(sizes={'/scenes/{uuid}/download': 2},
+                    asset_size=size) as server:
+        api = server.api()
+        scene_ids = [scene.id for scene in api.get_scenes().results[:3]]
+        # A partial download left by an earlier, interrupted run
+        partial = os.path.join(str(tmpdir), scene_ids[0], '0.tif.part')
+        os.makedirs(os.path.dirname(partial))
+        with open(partial, 'wb') as part_file:
+            part_file.write(asset_bytes(0, 1000))
+
+        results = api.download_scenes(scene_ids, str(tmpdir), max_workers=4)
+        assert [result.status for result in results] == ['downloaded'] * 6
+        rerun = api.download_scenes(scene_ids, str(tmpdir))
+        assert [result.status for result in rerun] == ['skipped'] * 6
+
+    assert not os.path.exists(partial)
+    for result in results:
+        assert result.size == size
+        with open(result.destination, 'rb') as asset:
+            assert asset.read() == asset_bytes(0, size)
+
+
+def test_download_scenes_restarts_oversized_parts_and_reports_failures(
+        tmpdir):
+    size = 10 * 1024
+
+    class FailingDownloader(SceneDownloader):
+        def resolve(self, scene_id):
+            if scene_id == 'missing':
+                raise ValueError('No such scene')
+            return super(FailingDownloader, self).resolve(scene_id)
+
+    with MockServer(sizes={'/scenes/{uuid}/download': 1},
+                    asset_size=size) as server:
+        api = server.api()
+        scene_id = api.get_scenes().results[0].id
+        # A partial download larger than the asset can't be resumed
+        partial = os.path.join(str(tmpdir), scene_id, '0.tif.part')
+        os.makedirs(os.path.dirname(partial))
+        with open(partial, 'wb') as part_file:
+            part_file.write(b'x' * (size + 10))
+
+        results = FailingDownloader(api, str(tmpdir)).download(
+            ['missing', scene_id])
+
+    assert [(r.scene_id, r.status) for r in results] == [
+        ('missing', 'failed'), (scene_id, 'downloaded')]
+    assert 'No such scene' in results[0].error
+    assert not os.path.exists(partial)
+    with open(results[1].destination, 'rb') as asset:
+        assert asset.read() == asset_bytes(0, size)
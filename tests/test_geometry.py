@@ -0,0 +1,62 @@
+from argparse import Namespace
+
+from shapely.geometry import Point, box, mapping, shape
+
+from rasterfoundry.geometry import (
+    select_covering_scenes, simplify_geometries, zoom_tolerance
+)
+from tests.mock_server import MockServer
+
+
+def scene(id, footprint, cloud_cover, acquisition_date):
+    return Namespace(id=id, dataFootprint=mapping(footprint), filterFields={
+        'cloudCover': cloud_cover, 'acquisitionDate': acquisition_date})
+
+
+def test_select_covering_scenes():
+    aoi = box(0, 0, 2, 1)
+    scenes = [
+        scene('west', box(0, 0, 1, 1), 0, '2018-06-01T00:00:00Z'),
+        scene('east', box(1, 0, 2, 1), 0, '2018-06-01T00:00:00Z'),
+        # Covers everything but is cloudy and old
+        scene('all', box(0, 0, 2, 1), 90, '2014-06-01T00:00:00Z'),
+        scene('cloudy-west', box(0, 0, 1, 1), 80, '2018-06-01T00:00:00Z'),
+        scene('outside', box(5, 5, 6, 6), 0, '2018-06-01T00:00:00Z'),
+    ]
+
+    chosen = select_covering_scenes(aoi, scenes, age_weight=1.)
+    assert sorted(s.id for s in chosen) == ['east', 'west']
+
+    # Without the age penalty one scene covering everything is cheaper
+    chosen = select_covering_scenes(aoi, scenes, age_weight=0.)
+    assert [s.id for s in chosen] == ['all']
+
+    assert select_covering_scenes(box(10, 10, 11, 11), scenes) == []
+
+
+def test_simplify_geometries():
+    circles = [Point(i, i).buffer(0.1, 2048) for i in range(3)]
+    geometries, reduction = simplify_geometries(
+        [mapping(circle) for circle in circles], zoom=12)
+
+    assert reduction.geometries == 3
+    assert reduction.vertices < reduction.original_vertices / 10
+    assert reduction.ratio < 0.1
+    for circle, geometry in zip(circles, geometries):
+        simplified = shape(geometry)
+        assert simplified.is_valid
+        assert abs(simplified.area - circle.area) < circle.area * 0.01
+        # Coordinates are rounded to a tenth of the tolerance
+        x = geometry['coordinates'][0][0][0]
+        assert round(x, 5) == x
+    assert zoom_tolerance(12) < 1e-3
+
+
+def test_export_with_simplified_mask():
+    with MockServer() as server:
+        project = server.api().projects[0]
+        export = project.create_export(
+            None, zoom=8, mask=Point(0, 0).buffer(1, 1024), simplify=True)
+
+    mask = export._export.exportOptions.mask
+    assert 4 < len(mask['coordinates'][0]) < 1000
@@ -0,0 +1,160 @@
+import io
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from urllib3.response import HTTPResponse
+
+from rasterfoundry.aws import s3
+from rasterfoundry.instrumentation import (
+    Instrumentation, instrument_boto3_client, instrument_session,
+    operation_name
+)
+from rasterfoundry.models import Upload
+from tests.mock_server import MockServer
+
+
+class FakeAdapter(BaseAdapter):
+    def send(self, request, **kwargs):
+        # A chunked response, without a Content-Length
+        response = requests.Response()
+        response.status_code = 200
+        response.raw = HTTPResponse(
+            io.BytesIO(b'{"hasNext": false}'), preload_content=False)
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def test_operation_name_templates_ids():
+    url = ('https://app.rasterfoundry.com/api/projects/'
+           'dfac6307-b5ef-43f7-beda-b9f208bb7726/order?page=3')
+    assert operation_name('get', url) == 'GET /api/projects/{id}/order'
+
+
+def test_session_requests_are_recorded():
+    instrumentation = Instrumentation()
+    spans = []
+
+    class Span(object):
+        def __init__(self, name, attributes):
+            self.name = name
+
+        def __enter__(self):
+            spans.append(self.name)
+
+        def __exit__(self, *args):
+            pass
+
+    instrumentation.add_span_hook(Span)
+    session = requests.Session()
+    session.mount('https://', FakeAdapter())
+    instrument_session(session, instrumentation)
+
+    session.post('https://example.com/api/shapes/', data=b'12345')
+    session.post('https://example.com/api/shapes/', data=b'12345')
+
+    metrics = instrumentation.snapshot()['POST /api/shapes/']
+    assert metrics['latency']['count'] == 2
+    assert metrics['statuses'] == {200: 2}
+    assert metrics['bytes_sent'] == 10
+    assert metrics['bytes_received'] == 36
+    assert metrics['in_flight'] == 0
+    assert spans == ['POST /api/shapes/'] * 2
+
+    text = instrumentation.to_prometheus()
+    assert ('rasterfoundry_client_responses_total'
+            '{operation="POST /api/shapes/",status="200"} 2') in text
+
+
+def test_streamed_bytes_are_counted_as_read():
+    instrumentation = Instrumentation()
+    session = requests.Session()
+    session.mount('https://', FakeAdapter())
+    instrument_session(session, instrumentation)
+
+    response = session.get('https://example.com/api/exports/', stream=True)
+    metrics = instrumentation.snapshot()['GET /api/exports/']
+    assert metrics['latency']['count'] == 1
+    assert metrics['bytes_received'] == 0
+    assert b''.join(response.iter_content(4)) == b'{"hasNext": false}'
+    metrics = instrumentation.snapshot()['GET /api/exports/']
+    assert metrics['bytes_received'] == 18
+
+
+@pytest.fixture
+def mock_aws(monkeypatch):
+    moto = pytest.importorskip('moto')
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    mock = moto.mock_aws() if hasattr(moto, 'mock_aws') else moto.mock_s3()
+    with mock:
+        yield
+
+
+def test_boto3_calls_are_recorded(mock_aws):
+    import boto3
+    instrumentation = Instrumentation()
+    client = boto3.client('s3', region_name='us-east-1')
+    client.create_bucket(Bucket='foo-bucket')
+    instrument_boto3_client(client, instrumentation)
+    # A second call with the same collector doesn't double count
+    instrument_boto3_client(client, instrumentation)
+    client.put_object(Bucket='foo-bucket', Key='foo', Body=b'12345')
+    client.list_objects_v2(Bucket='foo-bucket')
+    body = client.get_object(Bucket='foo-bucket', Key='foo')['Body']
+    assert body.read() == b'12345'
+
+    snapshot = instrumentation.snapshot()
+    assert snapshot['s3 PutObject']['latency']['count'] == 1
+    assert snapshot['s3 PutObject']['statuses'] == {200: 1}
+    assert snapshot['s3 PutObject']['bytes_sent'] == 5
+    assert snapshot['s3 ListObjectsV2']['bytes_received'] > 0
+    assert snapshot['s3 GetObject']['bytes_received'] == 5
+
+
+def test_api_instruments_s3_clients(mock_aws, monkeypatch):
+    import boto3
+    client = boto3.client('s3', region_name='us-east-1')
+    monkeypatch.setattr(s3, 's3', client)
+    monkeypatch.setattr(
+        Upload, 's3_client', boto3.client('s3', region_name='us-east-1'))
+    instrumentation = Instrumentation()
+    with MockServer() as server:
+        api = server.api(instrumentation=instrumentation)
+        # Another API with the same collector doesn't double count, and
+        # closing it leaves the first API's instrumentation in place
+        server.api(instrumentation=instrumentation).close()
+
+    client.create_bucket(Bucket='foo-bucket')
+    s3.str_to_file(u'12345', 's3://foo-bucket/foo')
+    assert s3.file_to_str('s3://foo-bucket/foo') == '12345'
+    Upload.s3_client.list_buckets()
+    api.close()
+    client.list_buckets()
+
+    snapshot = instrumentation.snapshot()
+    assert snapshot['s3 CreateBucket']['latency']['count'] == 1
+    assert snapshot['s3 PutObject']['bytes_sent'] == 5
+    assert snapshot['s3 ListBuckets']['latency']['count'] == 1
+
+
+def test_boto3_calls_are_recorded_by_each_collector(mock_aws):
+    import boto3
+    client = boto3.client('s3', region_name='us-east-1')
+    first, second = Instrumentation(), Instrumentation()
+    uninstrument = instrument_boto3_client(client, first)
+    instrument_boto3_client(client, second)
+    client.create_bucket(Bucket='foo-bucket')
+    uninstrument()
+    client.list_buckets()
+
+    for instrumentation in (first, second):
+        metrics = instrumentation.snapshot()['s3 CreateBucket']
+        assert metrics['latency']['count'] == 1
+        assert metrics['in_flight'] == 0
+    assert 's3 ListBuckets' not in first.snapshot()
+    assert second.snapshot()['s3 ListBuckets']['latency']['count'] == 1
@@ -0,0 +1,26 @@
+import pytest
+from bravado import exception
+
+from tests.mock_server import MockServer
+
+
+def test_paginated_fixtures():
+    with MockServer(sizes={'/projects/': 95}) as server:
+        api = server.api()
+        projects = api.projects
+        assert len(projects) == 95
+        assert len(set(project.id for project in projects)) == 95
+        assert projects[0].id == api.projects[0].id
+
+
+def test_project_order_matches_project_scenes():
+    with MockServer(sizes={'/projects/{uuid}/scenes/': 40}) as server:
+        project = server.api().projects[0]
+        assert len(project.get_image_source_uris()) == 40
+
+
+def test_injected_errors():
+    with MockServer(error_rates={429: 1.}) as server:
+        api = server.api()
+        with pytest.raises(exception.HTTPTooManyRequests):
+            api.projects
@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+from rasterfoundry.api import API
+from rasterfoundry.exceptions import CassetteMissException
+from rasterfoundry.recording import Cassette, RecordingAdapter, ReplayAdapter
+from tests.mock_server import MockServer
+
+
+def test_record_and_replay(tmpdir):
+    path = os.path.join(str(tmpdir), 'session.cassette')
+    cassette = Cassette()
+    with MockServer(sizes={'/projects/': 45}) as server:
+        host = server.host
+        api = server.api(http_adapter=RecordingAdapter(cassette),
+                         refresh_token='secret', api_token=None)
+        project_ids = [project.id for project in api.projects]
+        png = api.projects[0].png('0,0,1,1')
+    cassette.save(path)
+
+    api = API(api_token='replay', host=host, scheme='http', tile_host=host,
+              spec_path='http://{}/spec.json'.format(host),
+              http_adapter=ReplayAdapter(Cassette.load(path)))
+    assert [project.id for project in api.projects] == project_ids
+    assert api.projects[0].png('0,0,1,1') == png
+    with pytest.raises(CassetteMissException):
+        api.exports
+
+
+def test_credentials_are_not_recorded():
+    cassette = Cassette()
+    with MockServer() as server:
+        server.api(http_adapter=RecordingAdapter(cassette),
+                   refresh_token='secret', api_token=None)
+    token_response = [
+        interaction for interaction in cassette.interactions
+        if interaction['key'].endswith('/api/tokens/')
+    ][0]
+    assert token_response['json']['id_token'] == 'REDACTED'
@@ -0,0 +1,43 @@
+import pytest
+from shapely.geometry import box
+
+from rasterfoundry.geometry import to_shape
+from rasterfoundry.search import plan_queries
+from tests.mock_server import MockServer
+
+
+def test_plan_queries():
+    aois = [box(x, y, x + 0.1, y + 0.1)
+            for x, y in [(0, 0), (0.05, 0.05), (0.1, 0), (10, 10), (10, 10)]]
+    queries = plan_queries(aois + [box(20, 20, 30, 30)])
+
+    assert sorted(indices for _, indices in queries) == [
+        [0, 1, 2], [3, 4], [5]]
+    assert dict((tuple(i), b) for b, i in queries)[(0, 1, 2)] == pytest.approx(
+        (0, 0, 0.2, 0.15))
+    assert plan_queries([]) == []
+
+
+def test_search_scenes():
+    with MockServer(max_page_size=10) as server:
+        api = server.api()
+        scenes = api.get_scenes(pageSize=3).results
+        aois = []
+        for scene in scenes:
+            center = to_shape(scene.dataFootprint).centroid
+            # Nearby AOIs that share a query
+            aois.append(center.buffer(0.01))
+            aois.append(center.buffer(0.02))
+        server.reset_log()
+        found = api.search_scenes(aois, page_size=10)
+        searches = [path for _, path in server.requests]
+
+    # Three queries of three pages each
+    assert len(searches) == 9
+    for aoi, aoi_scenes in zip(aois, found):
+        assert len(set(scene.id for scene in aoi_scenes)) == len(aoi_scenes)
+        assert all(to_shape(scene.dataFootprint).intersects(aoi)
+                   for scene in aoi_scenes)
+    for index, scene in enumerate(scenes):
+        assert scene.id in [s.id for s in found[2 * index]]
+        assert scene.id in [s.id for s in found[2 * index + 1]]
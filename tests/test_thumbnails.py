@@ -0,0 +1,95 @@
+import os
+from collections import namedtuple
+
+import requests
+from requests.adapters import BaseAdapter
+
+from rasterfoundry.thumbnails import ThumbnailCache, is_api_url
+from tests.mock_server import MockServer
+
+Scene = namedtuple('Scene', ['id', 'thumbnails'])
+Thumbnail = namedtuple('Thumbnail', ['thumbnailSize', 'url'])
+
+
+class RecordingAdapter(BaseAdapter):
+    """Answers every request with a tiny body and records its URL"""
+
+    def __init__(self):
+        super(RecordingAdapter, self).__init__()
+        self.urls = []
+
+    def send(self, request, **kwargs):
+        self.urls.append(request.url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'thumbnail'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def test_fetch_thumbnails_through_cache(tmpdir):
+    cache_dir = os.path.join(str(tmpdir), 'thumbnails')
+    with MockServer(tile_size=2048) as server:
+        api = server.api()
+        scenes = api.get_scenes().results
+        fetched = list(api.fetch_thumbnails(
+            scenes, cache=ThumbnailCache(cache_dir), decode=False))
+        server.reset_log()
+        cached = list(api.fetch_thumbnails(
+            scenes, cache=ThumbnailCache(cache_dir), decode=False))
+        cached_requests = list(server.requests)
+        by_id = list(api.fetch_thumbnails(
+            [scene.id for scene in scenes], cache=ThumbnailCache(cache_dir),
+            decode=False))
+
+    assert len(fetched) == len(scenes) == 25
+    assert set(id(scene) for scene, _ in fetched) == set(map(id, scenes))
+    assert all(len(thumbnail) == 2048 for _, thumbnail in fetched)
+    assert len(cached) == 25
+    assert cached_requests == []
+    # Scene ids are resolved through the thumbnails API
+    assert all(thumbnail is not None for _, thumbnail in by_id)
+
+
+def test_thumbnail_cache_evicts_least_recently_used(tmpdir):
+    cache = ThumbnailCache(str(tmpdir), max_bytes=3000)
+    cache.put('a', b'a' * 1000)
+    cache.put('b', b'b' * 1000)
+    os.utime(cache.blob_path(cache.index['a']), (0, 0))
+    os.utime(cache.blob_path(cache.index['b']), (1, 1))
+    cache.get('a')
+    cache.put('c', b'c' * 1500)
+    assert cache.get('b') is None
+    assert cache.get('a') == b'a' * 1000
+    assert cache.get('c') == b'c' * 1500
+
+
+def test_thumbnails_on_other_hosts_get_no_token(tmpdir):
+    with MockServer() as server:
+        api = server.api()
+    host = api.app_host
+    lookalike = '{}.evil.net'.format(host.split(':')[0])
+    urls = [
+        'http://evil.example/thumb.png?x={}'.format(host),
+        'http://{}/thumb.png'.format(lookalike),
+        'http://{}/thumb.png'.format(host),
+    ]
+    adapter = RecordingAdapter()
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    scenes = [Scene(str(index), [Thumbnail('SMALL', url)])
+              for index, url in enumerate(urls)]
+    list(api.fetch_thumbnails(
+        scenes, cache=ThumbnailCache(str(tmpdir)), decode=False,
+        session=session))
+
+    assert [is_api_url(api, url) for url in urls] == [False, False, True]
+    sent = dict((url.split('?')[0], url) for url in adapter.urls)
+    assert 'token' not in sent['http://evil.example/thumb.png']
+    assert 'token' not in sent['http://{}/thumb.png'.format(lookalike)]
+    assert 'token=' in sent['http://{}/thumb.png'.format(host)]
@@ -0,0 +1,52 @@
+import os
+
+from shapely.geometry import box
+
+from rasterfoundry.tiles import MBTiles, seed_tiles, tiles_covering
+from tests.mock_server import MockServer
+
+AOI = box(-77.1, 38.85, -76.95, 38.95)
+
+
+def test_tiles_covering():
+    assert list(tiles_covering(AOI, 0)) == [(0, 0, 0)]
+    tiles = list(tiles_covering(AOI, 14))
+    assert len(tiles) == len(set(tiles)) == 49
+    assert all(z == 14 and 4680 <= x <= 4690 for z, x, _ in tiles)
+
+
+def test_seed_tiles(tmpdir):
+    out = os.path.join(str(tmpdir), 'tiles.mbtiles')
+    with MockServer(tile_size=512, error_rates={503: 0.1}) as server:
+        project = server.api().projects[0]
+        report = seed_tiles(project, AOI, range(10, 15), out=out,
+                            max_workers=8, max_retries=10, batch_size=20)
+        server.reset_log()
+        rerun = seed_tiles(project, AOI, range(10, 15), out=out)
+        rerun_requests = list(server.requests)
+
+    assert report.fetched == 75
+    assert report.failed == []
+    assert rerun.skipped == 75
+    assert rerun_requests == []
+    with MBTiles(out) as mbtiles:
+        for z, x, y in tiles_covering(AOI, 14):
+            assert len(mbtiles.read(z, x, y)) == 512
+
+
+def test_seed_tiles_records_empty_tiles(tmpdir):
+    out = os.path.join(str(tmpdir), 'tiles.mbtiles')
+    with MockServer() as server:
+        # The API answers 404 for unknown routes, as the tile server does for
+        # tiles without imagery
+        template = '{}/api/no-tiles/{{z}}/{{x}}/{{y}}'.format(server.url)
+        report = seed_tiles(template, AOI, [12, 13], out=out, batch_size=5)
+        server.reset_log()
+        rerun = seed_tiles(template, AOI, [12, 13], out=out)
+        rerun_requests = list(server.requests)
+
+    assert report.fetched == 0
+    assert report.empty == rerun.skipped > 0
+    assert rerun_requests == []
+    with MBTiles(out) as mbtiles:
+        assert mbtiles.existing(13, include_empty=False) == set()
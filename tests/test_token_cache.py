@@ -0,0 +1,70 @@
+import gc
+import os
+import pickle
+import time
+
+from rasterfoundry.api import API
+from rasterfoundry.token_cache import TokenCache
+from tests.mock_server import MockServer
+
+
+def test_token_cache_is_shared(tmpdir):
+    path = os.path.join(str(tmpdir), 'tokens.json')
+    with MockServer() as server:
+        first = server.api(refresh_token='secret', api_token=None,
+                           token_cache=TokenCache(path))
+        second = server.api(refresh_token='secret', api_token=None,
+                            token_cache=TokenCache(path))
+        token_requests = [
+            request for request in server.requests
+            if request == ('POST', '/api/tokens/')
+        ]
+    assert first.api_token == second.api_token == 'mock-api-token'
+    assert len(token_requests) == 1
+    with open(path) as cache_file:
+        assert 'secret' not in cache_file.read()
+
+
+def test_expiring_tokens_are_not_reused(tmpdir):
+    cache = TokenCache(os.path.join(str(tmpdir), 'tokens.json'))
+    cache.put('secret', 'old-token', time.time() + 60)
+    assert cache.get('secret')[0] == 'old-token'
+    assert cache.get('secret', min_ttl=300) is None
+
+    token, _ = cache.get_or_fetch(
+        'secret', lambda refresh_token: ('new-token', time.time() + 3600),
+        min_ttl=300)
+    assert token == 'new-token'
+
+
+def test_worker_config_lets_workers_refresh_tokens(tmpdir):
+    path = os.path.join(str(tmpdir), 'tokens.json')
+    with MockServer() as server:
+        api = server.api(refresh_token='secret', api_token=None,
+                         token_cache=TokenCache(path))
+        config = pickle.loads(pickle.dumps(api.worker_config()))
+        server.reset_log()
+        with API(**config) as worker:
+            construction_requests = list(server.requests)
+            refresher = worker.token_refresher
+            assert refresher._thread.is_alive()
+        refresher._thread.join(5)
+
+    assert config['refresh_token'] == 'secret'
+    assert worker.api_token == api.api_token
+    assert worker.token_cache.path == path
+    # Workers reuse the current token until their refresher replaces it
+    assert construction_requests == []
+    assert worker.token_refresher is None
+    assert not refresher._thread.is_alive()
+
+
+def test_refresher_exits_once_its_api_is_gone():
+    with MockServer() as server:
+        api = server.api(refresh_token='secret', api_token=None,
+                         auto_refresh=True)
+        refresher = api.token_refresher
+        del api
+        gc.collect()
+        refresher._thread.join(5)
+    assert not refresher._thread.is_alive()